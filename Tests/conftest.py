@@ -0,0 +1,5 @@
+import os
+
+# The API tests run against the deterministic stub model unless a backend
+# is chosen, e.g. MODEL_BACKEND=pytorch pytest
+os.environ.setdefault("MODEL_BACKEND", "stub")
@@ -1,9 +1,17 @@
 import os
+import asyncio
+import json
+import time
 from datetime import timedelta
 from fastapi.testclient import TestClient
 from app import app
+import importlib
+from app.app import batcher
+from app.cache import PredictionCache
 from auth import create_access_token
 
+api = importlib.import_module("app.app")
+
 USER_NAME = os.getenv("USER_NAME")
 
 ACCESS_TOKEN_EXPIRE_MINUTES=30
@@ -20,6 +28,17 @@ def test_health():
     assert response.status_code == 200
     assert response.json() == {"status": "up and running"}
 
+def test_ready_after_startup():
+    # Entering the client runs the startup hook, which loads and warms the model
+    with TestClient(app) as startup_client:
+        deadline = time.time() + 120
+        response = startup_client.get("/ready")
+        while response.status_code == 503 and time.time() < deadline:
+            time.sleep(0.5)
+            response = startup_client.get("/ready")
+    assert response.status_code == 200
+    assert response.json()["status"] == "ready"
+
 def test_predict_no_auth():
     response = client.post(
         "/predict/",
@@ -54,4 +73,318 @@ def test_predict_unsupported_file():
             files={"file": ("test_file.docx", file, "application/vnd.openxmlformats-officedocument.wordprocessingml.document")}
         )
     assert response.status_code == 200
-    assert response.json() == {"error": "Unsupported file type. Please upload a PDF, TXT, or CSV file."}
\ No newline at end of file
+    assert response.json() == {"error": "Unsupported file type. Please upload a PDF, TXT, or CSV file."}
+
+def test_predict_batch_json():
+    token = create_access_token(data={"sub": USER_NAME},expires_delta=timedelta(minutes=ACCESS_TOKEN_EXPIRE_MINUTES))
+
+    response = client.post(
+        "/predict/batch",
+        json=["I am so happy!", {"id": "review-2", "text": "This is terrible."}],
+        headers={"Authorization": f"Bearer {token}"}
+    )
+    assert response.status_code == 200
+    results = response.json()["results"]
+    assert [result["id"] for result in results] == [0, "review-2"]
+    assert all(result["predictions"] for result in results)
+
+def test_predict_batch_output_options():
+    token = create_access_token(data={"sub": USER_NAME},expires_delta=timedelta(minutes=ACCESS_TOKEN_EXPIRE_MINUTES))
+    headers = {"Authorization": f"Bearer {token}"}
+    texts = ["I am so happy!", "This is terrible."]
+
+    top3 = client.post("/predict/batch", params={"top_k": 3}, json=texts, headers=headers).json()["results"]
+    assert [len(result["predictions"]) for result in top3] == [3, 3]
+
+    scores = client.post("/predict/batch", params={"output": "scores"}, json=texts, headers=headers).json()
+    assert len(scores["labels"]) == len(scores["results"][0]["scores"]) == 28
+    best = max(range(28), key=scores["results"][0]["scores"].__getitem__)
+    assert scores["labels"][best] == top3[0]["predictions"][0]["label"]
+
+    ranked = sorted(scores["results"][0]["scores"], reverse=True)
+    cutoff = (ranked[1] + ranked[2]) / 2
+    above = client.post("/predict/batch", params={"threshold": str(cutoff)}, json=texts[:1], headers=headers).json()
+    assert len(above["results"][0]["predictions"]) == 2
+
+    for params in ({"threshold": "sadness:high"}, {"output": "xml"}, {"top_k": 0}):
+        assert client.post("/predict/batch", params=params, json=texts, headers=headers).status_code == 400
+
+def test_predict_batch_binary_formats():
+    import io
+    import msgpack
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+
+    token = create_access_token(data={"sub": USER_NAME},expires_delta=timedelta(minutes=ACCESS_TOKEN_EXPIRE_MINUTES))
+    headers = {"Authorization": f"Bearer {token}"}
+    texts = ["I am so happy!", {"id": "review-2", "text": "This is terrible."}]
+    expected = client.post("/predict/batch", params={"top_k": 2}, json=texts, headers=headers).json()["results"]
+    rows = [(result["id"], pred["label"], pred["score"]) for result in expected for pred in result["predictions"]]
+
+    response = client.post("/predict/batch", params={"top_k": 2}, json=texts, headers={**headers, "Accept": "application/vnd.apache.arrow.stream"})
+    assert response.headers["content-type"] == "application/vnd.apache.arrow.stream"
+    frame = pa.ipc.open_stream(response.content).read_pandas()
+    assert [(str(i), label) for i, label in zip(frame["id"], frame["label"])] == [(str(i), label) for i, label, _ in rows]
+    assert frame["score"].dtype == "float32"
+
+    response = client.post("/predict/batch", params={"output": "scores"}, json=texts, headers={**headers, "Accept": "application/vnd.apache.parquet"})
+    table = pq.read_table(io.BytesIO(response.content))
+    assert table.num_rows == 2 and len(table.column_names) == 29
+
+    response = client.post("/predict/batch", params={"top_k": 2}, json=texts, headers={**headers, "Accept": "application/msgpack"})
+    packed = msgpack.unpackb(response.content)
+    assert [packed["labels"][label] for label in packed["columns"]["label"]] == [label for _, label, _ in rows]
+
+def test_predict_batch_deduplicates(monkeypatch):
+    token = create_access_token(data={"sub": USER_NAME},expires_delta=timedelta(minutes=ACCESS_TOKEN_EXPIRE_MINUTES))
+    headers = {"Authorization": f"Bearer {token}"}
+    texts = ["Great product!", "Never again.", "Great  product!", "Great product!"]
+    expected = client.post("/predict/batch", json=texts[:2], headers=headers).json()["results"]
+
+    scored = []
+    score_texts = api.score_texts
+
+    async def counting_score_texts(distinct):
+        scored.extend(distinct)
+        return await score_texts(distinct)
+
+    monkeypatch.setattr(api, "score_texts", counting_score_texts)
+    response = client.post("/predict/batch", json=texts, headers=headers)
+    body = response.json()
+    assert scored == ["Great product!", "Never again."]
+    assert [r["predictions"] for r in body["results"]] == [expected[i]["predictions"] for i in (0, 1, 0, 0)]
+    assert body["dedup"] == {"units": 4, "scored": 2, "duplicate_ratio": 0.5}
+    assert response.headers["x-dedup-ratio"] == "0.5000"
+
+def test_predict_batch_ndjson():
+    token = create_access_token(data={"sub": USER_NAME},expires_delta=timedelta(minutes=ACCESS_TOKEN_EXPIRE_MINUTES))
+
+    response = client.post(
+        "/predict/batch",
+        content='{"id": "a", "text": "Great product!"}\n{"id": "b", "text": "Awful."}\n',
+        headers={"Authorization": f"Bearer {token}", "Content-Type": "application/x-ndjson"}
+    )
+    assert response.status_code == 200
+    assert [result["id"] for result in response.json()["results"]] == ["a", "b"]
+
+def test_predict_batch_invalid_body():
+    token = create_access_token(data={"sub": USER_NAME},expires_delta=timedelta(minutes=ACCESS_TOKEN_EXPIRE_MINUTES))
+
+    response = client.post(
+        "/predict/batch",
+        json={"text": "not a list"},
+        headers={"Authorization": f"Bearer {token}"}
+    )
+    assert response.status_code == 400
+
+def test_predict_stream_txt():
+    token = create_access_token(data={"sub": USER_NAME},expires_delta=timedelta(minutes=ACCESS_TOKEN_EXPIRE_MINUTES))
+
+    response = client.post(
+        "/predict/stream",
+        headers={"Authorization": f"Bearer {token}"},
+        files={"file": ("reviews.txt", b"I love it.\n\nI hate it.\n\nIt is fine.", "text/plain")}
+    )
+    assert response.status_code == 200
+    lines = [json.loads(line) for line in response.text.splitlines()]
+    assert [line["id"] for line in lines] == ["paragraph-1", "paragraph-2", "paragraph-3"]
+    assert all(line["predictions"] for line in lines)
+
+def test_predict_stream_scores():
+    token = create_access_token(data={"sub": USER_NAME},expires_delta=timedelta(minutes=ACCESS_TOKEN_EXPIRE_MINUTES))
+    headers = {"Authorization": f"Bearer {token}"}
+    files = {"file": ("reviews.txt", b"I love it.\n\nI hate it.", "text/plain")}
+
+    response = client.post("/predict/stream", data={"output": "scores"}, files=files, headers=headers)
+    assert len(response.headers["x-score-labels"].split(",")) == 28
+    assert [len(json.loads(line)["scores"]) for line in response.text.splitlines()] == [28, 28]
+
+    response = client.post("/predict/stream", data={"output": "scores", "format": "csv"}, files=files, headers=headers)
+    assert response.status_code == 400
+
+def test_predict_stream_arrow():
+    import pyarrow as pa
+
+    token = create_access_token(data={"sub": USER_NAME},expires_delta=timedelta(minutes=ACCESS_TOKEN_EXPIRE_MINUTES))
+    response = client.post(
+        "/predict/stream",
+        headers={"Authorization": f"Bearer {token}", "Accept": "application/vnd.apache.arrow.stream"},
+        data={"include_text": "true"},
+        files={"file": ("reviews.csv", b"review\nGreat product!\nNever again.\n", "text/csv")}
+    )
+    assert response.status_code == 200
+    frame = pa.ipc.open_stream(response.content).read_pandas()
+    assert list(frame["id"]) == [0, 1]
+    assert list(frame["text"]) == ["Great product!", "Never again."]
+    assert frame["label"].dtype == "category"
+
+    # A file without units still answers a valid, empty stream
+    response = client.post(
+        "/predict/stream",
+        headers={"Authorization": f"Bearer {token}"},
+        data={"format": "arrow"},
+        files={"file": ("blank.txt", b"\n\n", "text/plain")}
+    )
+    assert response.status_code == 200
+    assert pa.ipc.open_stream(response.content).read_all().num_rows == 0
+
+    response = client.post(
+        "/predict/stream",
+        headers={"Authorization": f"Bearer {token}"},
+        data={"format": "parquet"},
+        files={"file": ("reviews.csv", b"review\nGreat product!\n", "text/csv")}
+    )
+    assert response.status_code == 400
+
+def test_predict_stream_csv_sse():
+    token = create_access_token(data={"sub": USER_NAME},expires_delta=timedelta(minutes=ACCESS_TOKEN_EXPIRE_MINUTES))
+
+    response = client.post(
+        "/predict/stream",
+        headers={"Authorization": f"Bearer {token}"},
+        data={"format": "sse"},
+        files={"file": ("reviews.csv", b"review\nGreat product!\nNever again.\n", "text/csv")}
+    )
+    assert response.status_code == 200
+    assert response.headers["content-type"].startswith("text/event-stream")
+    events = [json.loads(event[len("data: "):]) for event in response.text.split("\n\n") if event]
+    assert [event["id"] for event in events] == [0, 1]
+
+def test_predict_stream_csv_columns():
+    token = create_access_token(data={"sub": USER_NAME},expires_delta=timedelta(minutes=ACCESS_TOKEN_EXPIRE_MINUTES))
+    headers = {"Authorization": f"Bearer {token}"}
+    content = b"id,stars,review\na1,5,Great product!\na2,1,Never again.\n"
+
+    response = client.post(
+        "/predict/stream",
+        headers=headers,
+        data={"format": "csv", "text_column": "review", "id_column": "id"},
+        files={"file": ("reviews.csv", content, "text/csv")}
+    )
+    assert response.status_code == 200
+    assert response.headers["content-type"].startswith("text/csv")
+    rows = [line.split(",") for line in response.text.splitlines()]
+    assert rows[0] == ["id", "label", "score"]
+    assert [row[0] for row in rows[1:]] == ["a1", "a2"]
+
+    response = client.post(
+        "/predict/stream",
+        headers=headers,
+        data={"text_column": "comment"},
+        files={"file": ("reviews.csv", content, "text/csv")}
+    )
+    assert response.status_code == 400
+
+def test_predictions_are_logged(tmp_path, monkeypatch):
+    from app.app import prediction_log
+    from app.prediction_log import LocalLogWriter
+
+    monkeypatch.setattr(prediction_log, "writer", LocalLogWriter(str(tmp_path)))
+    token = create_access_token(data={"sub": USER_NAME},expires_delta=timedelta(minutes=ACCESS_TOKEN_EXPIRE_MINUTES))
+
+    response = client.post("/predict/batch", json=["Logged review one", "Logged review two"], headers={"Authorization": f"Bearer {token}"})
+    assert response.status_code == 200
+    prediction_log.flush()
+
+    records = [json.loads(line) for path in tmp_path.rglob("*.jsonl") for line in path.read_text().splitlines()]
+    assert [record["Texts"] for record in records] == ["Logged review one", "Logged review two"]
+    assert all(record["username"] == USER_NAME for record in records)
+
+def test_history_endpoints():
+    token = create_access_token(data={"sub": USER_NAME},expires_delta=timedelta(minutes=ACCESS_TOKEN_EXPIRE_MINUTES))
+    headers = {"Authorization": f"Bearer {token}"}
+
+    for path in ("/history/labels", "/history/users", "/history/latency"):
+        assert client.get(path, headers=headers).status_code == 200
+    assert client.get("/history/labels", params={"interval": "decade"}, headers=headers).status_code == 400
+    assert client.get("/history/users").status_code == 401
+
+def test_cache_stats():
+    token = create_access_token(data={"sub": USER_NAME},expires_delta=timedelta(minutes=ACCESS_TOKEN_EXPIRE_MINUTES))
+    headers = {"Authorization": f"Bearer {token}"}
+
+    client.post("/predict/", data={"text": "A cached review"}, headers=headers)
+    client.post("/predict/", data={"text": "A cached review"}, headers=headers)
+
+    response = client.get("/cache/stats", headers=headers)
+    assert response.status_code == 200
+    assert response.json()["hits"] >= 1
+
+def test_disk_cache_is_called_off_the_event_loop(tmp_path, monkeypatch):
+    token = create_access_token(data={"sub": USER_NAME},expires_delta=timedelta(minutes=ACCESS_TOKEN_EXPIRE_MINUTES))
+    headers = {"Authorization": f"Bearer {token}"}
+    cache = PredictionCache("model", max_entries=10, path=str(tmp_path / "predictions.db"))
+    calls = []
+
+    def record(function):
+        def call(*args):
+            try:
+                asyncio.get_running_loop()
+                calls.append("event loop")
+            except RuntimeError:
+                calls.append("thread")
+            return function(*args)
+        return call
+
+    monkeypatch.setattr(cache.disk, "get", record(cache.disk.get))
+    monkeypatch.setattr(cache.disk, "set", record(cache.disk.set))
+    monkeypatch.setattr(api, "prediction_cache", cache)
+    response = client.post("/predict/batch", json=["Kept on disk", "Also on disk"], headers=headers)
+    assert response.status_code == 200
+    assert calls == ["thread"] * 4
+
+def test_predict_long_document():
+    token = create_access_token(data={"sub": USER_NAME},expires_delta=timedelta(minutes=ACCESS_TOKEN_EXPIRE_MINUTES))
+
+    response = client.post(
+        "/predict/",
+        data={"text": "I love this product. " * 400, "long_document": "true", "aggregation": "weighted", "return_chunks": "true"},
+        headers={"Authorization": f"Bearer {token}"}
+    )
+    assert response.status_code == 200
+    body = response.json()
+    assert body["document"]["chunks"] > 1
+    assert len(body["chunks"]) == body["document"]["chunks"]
+    assert len(body["predictions"][0]) == 1
+
+def test_batching_stats():
+    token = create_access_token(data={"sub": USER_NAME},expires_delta=timedelta(minutes=ACCESS_TOKEN_EXPIRE_MINUTES))
+    headers = {"Authorization": f"Bearer {token}"}
+
+    client.post("/predict/batch", json=["Short.", "A much longer review about the product " * 5], headers=headers)
+
+    response = client.get("/batching/stats", headers=headers)
+    assert response.status_code == 200
+    assert response.json()["batches"] >= 1
+
+def test_predict_batch_overloaded(monkeypatch):
+    token = create_access_token(data={"sub": USER_NAME},expires_delta=timedelta(minutes=ACCESS_TOKEN_EXPIRE_MINUTES))
+    monkeypatch.setattr(batcher, "max_queue", 1)
+
+    response = client.post(
+        "/predict/batch",
+        json=["An uncached review", "Another uncached review"],
+        headers={"Authorization": f"Bearer {token}"}
+    )
+    assert response.status_code == 503
+    assert "Retry-After" in response.headers
+
+def test_metrics():
+    token = create_access_token(data={"sub": USER_NAME},expires_delta=timedelta(minutes=ACCESS_TOKEN_EXPIRE_MINUTES))
+    client.post("/predict/batch", json=["Metrics review"], headers={"Authorization": f"Bearer {token}"})
+
+    response = client.get("/metrics")
+    assert response.status_code == 200
+    assert response.headers["content-type"].startswith("text/plain")
+    for series in (
+        'emotion_stage_seconds_count{format="",stage="auth"}',
+        'emotion_stage_seconds_count{format="",stage="model"}',
+        'emotion_stage_seconds_count{format="",stage="serialize"}',
+        'emotion_request_seconds_count{method="POST",route="/predict/batch",status="200"}',
+        'emotion_predictions_total{source="batch"}',
+        'emotion_queue_depth{queue="inference_batcher"}',
+        'emotion_cache_hit_rate{cache="predictions"}',
+        "emotion_input_tokens_bucket",
+        "emotion_requests_in_flight",
+    ):
+        assert series in response.text
@@ -0,0 +1,83 @@
+import os
+from datetime import timedelta
+
+import httpx
+from fastapi.testclient import TestClient
+
+from app import app
+from auth import create_access_token
+from UI.api_client import EmotionClient
+
+USER_NAME = os.getenv("USER_NAME")
+
+
+def make_client(http, **kwargs):
+    token = create_access_token(data={"sub": USER_NAME}, expires_delta=timedelta(minutes=30))
+    return EmotionClient("http://testserver", token, http=http, backoff=0, **kwargs)
+
+
+def test_predict_texts_in_concurrent_chunks():
+    texts = ["I love it.", "I hate it.", "It is fine.", "Never again.", "Great product!"]
+    progress = []
+    with TestClient(app) as http:
+        client = make_client(http, concurrency=2, batch_size=2)
+        results = client.predict_texts(texts, on_progress=lambda done, total: progress.append((done, total)))
+        expected = http.post("/predict/batch", json=texts, headers=client.headers).json()["results"]
+    assert list(results["id"]) == [0, 1, 2, 3, 4]
+    assert list(results["label"]) == [result["predictions"][0]["label"] for result in expected]
+    assert sorted(progress)[-1] == (5, 5) and len(progress) == 3
+
+
+def test_predict_file_streams_arrow():
+    content = b"review\nGreat product!\nNever again.\nIt is fine.\n"
+    progress = []
+    with TestClient(app) as http:
+        client = make_client(http)
+        results = client.predict_file(
+            "reviews.csv", content, on_progress=lambda done, total: progress.append(done),
+            total=3, text_column="review", include_text=True,
+        )
+    assert list(results["id"]) == [0, 1, 2]
+    assert list(results["text"]) == ["Great product!", "Never again.", "It is fine."]
+    assert progress[-1] == 3
+
+
+def test_retries_overloaded_answers():
+    calls = []
+
+    def handler(request):
+        calls.append(request.url.path)
+        if len(calls) < 3:
+            return httpx.Response(503, headers={"Retry-After": "0"}, json={"detail": "busy"})
+        return httpx.Response(200, json={"access_token": "token", "token_type": "bearer"})
+
+    client = EmotionClient("http://api", http=httpx.Client(transport=httpx.MockTransport(handler)), backoff=0)
+    assert client.login("user", "password")
+    assert client.token == "token" and calls == ["/token"] * 3
+
+
+def test_falls_back_to_single_predictions():
+    def handler(request):
+        if request.url.path == "/openapi.json":
+            return httpx.Response(200, json={"paths": {"/predict/": {}}})
+        text = dict(httpx.QueryParams(request.content.decode()))["text"]
+        return httpx.Response(200, json={"predictions": [[{"label": "joy" if "love" in text else "anger", "score": 0.9}]]})
+
+    client = EmotionClient("http://api", http=httpx.Client(transport=httpx.MockTransport(handler)))
+    results = client.predict_texts(["I love it.", "I hate it."])
+    assert list(results["label"]) == ["joy", "anger"]
+
+
+def test_predict_file_without_units():
+    def handler(request):
+        if request.url.path == "/openapi.json":
+            return httpx.Response(200, json={"paths": {"/predict/stream": {}}})
+        return httpx.Response(200, content=b"", headers={"Content-Type": "application/vnd.apache.arrow.stream"})
+
+    client = EmotionClient("http://api", http=httpx.Client(transport=httpx.MockTransport(handler)))
+    results = client.predict_file("book.pdf", b"%PDF", unit="chapter", include_text=True)
+    assert len(results) == 0 and list(results.columns) == ["id", "text", "label", "score"]
+
+    with TestClient(app) as http:
+        results = make_client(http).predict_file("blank.txt", b"\n\n", include_text=True)
+    assert len(results) == 0 and "text" in results.columns
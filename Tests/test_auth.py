@@ -0,0 +1,89 @@
+import asyncio
+import os
+import time
+from datetime import timedelta
+import pytest
+from fastapi import HTTPException
+from fastapi.testclient import TestClient
+from app import app
+from auth import auth
+from auth import TokenCache, create_access_token, decode_token
+
+client = TestClient(app)
+
+
+def test_token_cache_skips_verification_until_expiry(monkeypatch):
+    token = create_access_token({"sub": "alice"}, timedelta(minutes=5))
+    auth.token_cache.clear()
+    assert decode_token(token) == "alice"
+
+    # A cached token is not verified again
+    def fail(*args, **kwargs):
+        raise AssertionError("token verified twice")
+
+    monkeypatch.setattr(auth.jwt, "decode", fail)
+    assert decode_token(token) == "alice"
+
+
+def test_token_cache_expires_and_evicts():
+    cache = TokenCache(max_entries=2)
+    cache.set("expired", "alice", time.time() - 1)
+    cache.set("a", "alice", time.time() + 60)
+    cache.set("b", "bob", time.time() + 60)
+    cache.set("c", "carol", time.time() + 60)
+
+    assert cache.get("expired") is None
+    assert cache.get("a") is None
+    assert [cache.get("b"), cache.get("c")] == ["bob", "carol"]
+
+
+def test_invalid_token_is_rejected():
+    with pytest.raises(HTTPException):
+        decode_token(create_access_token({"sub": "alice"}) + "x")
+
+
+def test_api_key_auth(monkeypatch):
+    monkeypatch.setattr(auth, "API_KEYS", "bulk-scorer:s3cret, other:key2")
+    auth.get_api_keys.cache_clear()
+    try:
+        response = client.post("/predict/batch", json=["Nice"], headers={"X-API-Key": "s3cret"})
+        assert response.status_code == 200
+        assert client.post("/predict/batch", json=["Nice"], headers={"X-API-Key": "wrong"}).status_code == 401
+        assert client.post("/predict/batch", json=["Nice"]).status_code == 401
+    finally:
+        auth.get_api_keys.cache_clear()
+
+
+def test_api_key_named_like_the_admin_is_not_an_admin(monkeypatch):
+    monkeypatch.setattr(auth, "API_KEYS", f"{os.getenv('ADMIN_NAME')}:s3cret")
+    auth.get_api_keys.cache_clear()
+    try:
+        headers = {"X-API-Key": "s3cret"}
+        assert client.post("/predict/batch", json=["Nice"], headers=headers).status_code == 200
+        assert client.get("/admin/profile", headers=headers).status_code == 403
+        admin = create_access_token({"sub": os.getenv("ADMIN_NAME")}, timedelta(minutes=5))
+        assert client.get("/admin/profile", headers={"Authorization": f"Bearer {admin}"}).status_code == 200
+    finally:
+        auth.get_api_keys.cache_clear()
+
+
+def test_user_records_are_built_off_the_event_loop(monkeypatch):
+    calls = []
+    hash_password = auth.get_password_hash
+
+    def recording_hash(password):
+        try:
+            asyncio.get_running_loop()
+            calls.append("event loop")
+        except RuntimeError:
+            calls.append("thread")
+        return hash_password(password)
+
+    monkeypatch.setattr(auth, "get_password_hash", recording_hash)
+    auth.get_db.cache_clear()
+    try:
+        db = asyncio.run(auth.user_db())
+    finally:
+        auth.get_db.cache_clear()
+    assert os.getenv("ADMIN_NAME") in db
+    assert calls and set(calls) == {"thread"}
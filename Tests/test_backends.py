@@ -0,0 +1,128 @@
+import os
+import threading
+import time
+import pytest
+from app import backends
+from app.backends import REFERENCE_TEXTS, LazyClassifier, OnnxClassifier, check_parity, export_onnx, load_classifier
+
+MODEL_NAME = "SamLowe/roberta-base-go_emotions"
+# The parity tests load the real model (and export and quantize it), so they
+# only run when it is asked for, e.g. MODEL_BACKEND=pytorch pytest
+requires_model = pytest.mark.skipif(os.getenv("MODEL_BACKEND") != "pytorch", reason="runs with MODEL_BACKEND=pytorch")
+
+
+# The tiny backend needs the real model's tokenizer and config, from the
+# local Hub cache only
+def model_files_cached() -> bool:
+    from transformers import AutoConfig, AutoTokenizer # type: ignore
+
+    try:
+        AutoConfig.from_pretrained(MODEL_NAME, local_files_only=True)
+        AutoTokenizer.from_pretrained(MODEL_NAME, local_files_only=True)
+    except OSError:
+        return False
+    return True
+
+
+@pytest.fixture(scope="module")
+def reference():
+    return load_classifier(MODEL_NAME, top_k=1, backend="pytorch")
+
+
+@pytest.fixture(scope="module")
+def onnx_classifier(tmp_path_factory):
+    pytest.importorskip("onnxruntime")
+    model_dir = str(tmp_path_factory.mktemp("onnx_model"))
+    export_onnx(MODEL_NAME, model_dir)
+    return OnnxClassifier(model_dir, top_k=1)
+
+
+@requires_model
+def test_onnx_output_format_matches_pipeline(reference, onnx_classifier):
+    expected = reference(REFERENCE_TEXTS[:3], top_k=None, batch_size=3)
+    actual = onnx_classifier(REFERENCE_TEXTS[:3], top_k=None, batch_size=2)
+
+    assert len(actual) == 3
+    for want, got in zip(expected, actual):
+        assert [pred["label"] for pred in got] == [pred["label"] for pred in want]
+        assert [pred["score"] for pred in got] == pytest.approx([pred["score"] for pred in want], abs=1e-4)
+    assert onnx_classifier("I am so happy!")[0][0].keys() == {"label", "score"}
+
+
+@requires_model
+def test_onnx_top1_parity(reference, onnx_classifier):
+    assert check_parity(reference, onnx_classifier) == []
+
+
+@requires_model
+def test_int8_top1_parity(reference):
+    quantized = load_classifier(MODEL_NAME, top_k=1, backend="pytorch-int8")
+    assert check_parity(reference, quantized) == []
+
+
+def test_unknown_backend():
+    with pytest.raises(ValueError):
+        load_classifier(MODEL_NAME, backend="tensorrt")
+
+
+def test_lazy_classifier_loads_once(monkeypatch):
+    loads = []
+
+    def slow_load(model_name, top_k, backend):
+        loads.append(model_name)
+        time.sleep(0.1)
+        return lambda texts, **kwargs: [[{"label": "joy", "score": 1.0}] for _ in texts]
+
+    monkeypatch.setattr(backends, "load_classifier", slow_load)
+    classifier = LazyClassifier(MODEL_NAME)
+    assert not classifier.loaded
+
+    threads = [threading.Thread(target=classifier, args=(["text"],)) for _ in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert classifier.loaded
+    assert loads == [MODEL_NAME]
+
+
+def test_stub_classifier_is_deterministic_and_pipeline_shaped():
+    stub = load_classifier(MODEL_NAME, top_k=1, backend="stub")
+    first = stub(REFERENCE_TEXTS[:3], batch_size=3)
+
+    assert first == stub(REFERENCE_TEXTS[:3], batch_size=1)
+    assert [len(predictions) for predictions in first] == [1, 1, 1]
+    assert first[0][0].keys() == {"label", "score"}
+    everything = stub("I am so happy!", top_k=None)[0]
+    assert sorted(pred["label"] for pred in everything) == sorted(backends.GO_EMOTIONS_LABELS)
+    assert [pred["score"] for pred in everything] == sorted((pred["score"] for pred in everything), reverse=True)
+
+
+def test_stub_tokenizer_supports_lengths_and_chunking():
+    from app.bucketing import token_lengths
+    from app.chunking import chunk_text
+
+    tokenizer = load_classifier(MODEL_NAME, backend="stub").tokenizer
+    assert token_lengths(tokenizer, ["Great value!", "Bad"]) == [5, 3]
+    chunks = chunk_text("one two three four five", tokenizer, window=2, stride=0)
+    assert [chunk["text"] for chunk in chunks] == ["one two", "three four", "five"]
+
+
+def test_tiny_backend_has_the_model_labels(monkeypatch):
+    pytest.importorskip("transformers")
+    monkeypatch.setenv("HF_HUB_OFFLINE", "1")
+    if not model_files_cached():
+        pytest.skip("the model's tokenizer and config are not in the local Hub cache")
+    tiny = load_classifier(MODEL_NAME, top_k=None, backend="tiny")
+    labels = [pred["label"] for pred in tiny(["I am so happy!"])[0]]
+    assert sorted(labels) == sorted(backends.GO_EMOTIONS_LABELS)
+
+
+def make_classifier(model_name, top_k):
+    return lambda texts, **kwargs: [[{"label": model_name, "score": 1.0}] * top_k for _ in texts]
+
+
+def test_backend_factory_from_configuration():
+    classifier = load_classifier(MODEL_NAME, top_k=2, backend="Tests.test_backends:make_classifier")
+    assert classifier(["text"]) == [[{"label": MODEL_NAME, "score": 1.0}] * 2]
@@ -0,0 +1,57 @@
+import asyncio
+import threading
+import time
+import pytest
+from app.batching import MicroBatcher
+from app.executors import Overloaded
+
+
+def fake_predict(texts):
+    if "boom" in texts:
+        raise ValueError("bad input")
+    return [[{"label": text.upper(), "score": 1.0}] for text in texts]
+
+
+def test_batcher_groups_concurrent_requests():
+    batch_sizes = []
+
+    def predict_fn(texts):
+        batch_sizes.append(len(texts))
+        return fake_predict(texts)
+
+    batcher = MicroBatcher(predict_fn, max_batch_size=8, max_wait_ms=200)
+    results = asyncio.run(batcher.predict_many([f"text {i}" for i in range(8)]))
+    batcher.close()
+
+    assert [r[0]["label"] for r in results] == [f"TEXT {i}" for i in range(8)]
+    assert batch_sizes == [8]
+
+
+def test_batcher_isolates_failing_input():
+    batcher = MicroBatcher(fake_predict, max_batch_size=4, max_wait_ms=200)
+    futures = [batcher.submit(text) for text in ("ok", "boom", "fine")]
+
+    assert futures[0].result(timeout=5)[0]["label"] == "OK"
+    assert isinstance(futures[1].exception(timeout=5), ValueError)
+    assert futures[2].result(timeout=5)[0]["label"] == "FINE"
+    batcher.close()
+
+
+def test_batcher_rejects_when_queue_is_full():
+    release = threading.Event()
+
+    def blocked_predict(texts):
+        release.wait(5)
+        return fake_predict(texts)
+
+    batcher = MicroBatcher(blocked_predict, max_batch_size=1, max_wait_ms=0, max_queue=2)
+    first = batcher.submit("first")
+    time.sleep(0.1)  # the worker is now busy with "first"
+    queued = [batcher.submit("second"), batcher.submit("third")]
+
+    with pytest.raises(Overloaded):
+        asyncio.run(batcher.predict_many(["fourth"]))
+
+    release.set()
+    assert [f.result(timeout=5)[0]["label"] for f in [first] + queued] == ["FIRST", "SECOND", "THIRD"]
+    batcher.close()
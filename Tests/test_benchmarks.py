@@ -0,0 +1,52 @@
+import pytest
+from benchmarks.load_test import free_port, local_server
+from benchmarks.suite import find_regressions
+
+BASELINE = {
+    "environment": {"python": "3.11"},
+    "settings": {"latency_ms": 1},
+    "latency": {"tokens_128": {"p50_ms": 100.0, "p95_ms": 200.0, "max_ms": 300.0}},
+    "throughput": {"batch_32": {"texts_per_s": 50.0}},
+    "load": {"requests_per_s": 20.0, "errors": 0},
+    "extraction": {"pdf": {"units_per_s": 10.0}},
+}
+
+
+def test_find_regressions_checks_each_metric_in_its_direction():
+    current = {
+        "environment": {"python": "3.12"},
+        "settings": {"latency_ms": 100},
+        # Latencies rising and rates falling past the threshold regress;
+        # max_ms and counters are not compared
+        "latency": {"tokens_128": {"p50_ms": 125.0, "p95_ms": 150.0, "max_ms": 900.0}},
+        "throughput": {"batch_32": {"texts_per_s": 35.0}},
+        "load": {"requests_per_s": 40.0, "errors": 5},
+        "extraction": {"pdf": {"units_per_s": 9.5}},
+    }
+    regressions = find_regressions(BASELINE, current, threshold=0.1)
+
+    assert [r["metric"] for r in regressions] == ["latency.tokens_128.p50_ms", "throughput.batch_32.texts_per_s"]
+    assert regressions[0] == {"metric": "latency.tokens_128.p50_ms", "baseline": 100.0, "current": 125.0, "change": 0.25}
+    assert regressions[1]["change"] == pytest.approx(-0.3)
+
+
+def test_find_regressions_threshold():
+    current = {"latency": {"tokens_128": {"p50_ms": 109.0, "p95_ms": 230.0}}, "throughput": {"batch_32": {"texts_per_s": 44.0}}}
+
+    assert [r["metric"] for r in find_regressions(BASELINE, current, threshold=0.1)] == [
+        "latency.tokens_128.p95_ms", "throughput.batch_32.texts_per_s"
+    ]
+    assert find_regressions(BASELINE, current, threshold=0.2) == []
+
+
+def test_find_regressions_skips_missing_metrics():
+    current = {"latency": {"tokens_128": {"p95_ms": 500.0}}, "throughput": {}, "extra": {"p50_ms": 1.0}}
+
+    assert [r["metric"] for r in find_regressions(BASELINE, current, threshold=0.1)] == ["latency.tokens_128.p95_ms"]
+    assert find_regressions(BASELINE, {}, threshold=0.1) == []
+
+
+def test_local_server_raises_when_the_server_is_not_ready():
+    with pytest.raises(RuntimeError, match="not ready"):
+        with local_server(f"http://127.0.0.1:{free_port()}", ready_timeout=1):
+            pass
@@ -0,0 +1,49 @@
+from app.bucketing import LengthBucketer
+
+
+# One token per word, which is enough to exercise the bucketing logic
+def word_lengths(texts):
+    return [len(text.split()) for text in texts]
+
+
+def test_bucketer_batches_similar_lengths_and_keeps_order():
+    batches = []
+
+    def predict_fn(texts):
+        batches.append(texts)
+        return [[{"label": text, "score": 1.0}] for text in texts]
+
+    texts = ["a", "b " * 40, "c", "d " * 45, "e"]
+    bucketer = LengthBucketer(predict_fn, word_lengths, max_batch_size=8, boundaries=[4, 64])
+    results = bucketer(texts)
+
+    assert [result[0]["label"] for result in results] == texts
+    assert sorted(len(batch) for batch in batches) == [2, 3]
+
+
+def test_bucketer_reports_padding_ratio():
+    bucketer = LengthBucketer(lambda texts: [[]] * len(texts), word_lengths, max_batch_size=2, boundaries=[8])
+    bucketer(["one", "one two three four"])
+
+    summary = bucketer.stats.summary()
+    assert summary["batches"] == 1
+    assert summary["recent"][0]["padding_ratio"] == 1 - 5 / 8
+    assert summary["buckets"]["<=8"]["padded_tokens"] == 8
+
+
+def test_bucketer_submits_every_batch_before_waiting():
+    from concurrent.futures import Future
+
+    submitted = []
+
+    def submit_fn(texts):
+        submitted.append((texts, Future()))
+        if len(submitted) == 2:
+            # Both batches were handed over before the first one is answered
+            for batch, future in submitted:
+                future.set_result([[{"label": text, "score": 1.0}] for text in batch])
+        return submitted[-1][1]
+
+    texts = ["a", "b " * 40, "c"]
+    bucketer = LengthBucketer(None, word_lengths, max_batch_size=8, boundaries=[4, 64], submit_fn=submit_fn)
+    assert [result[0]["label"] for result in bucketer(texts)] == texts
@@ -0,0 +1,79 @@
+import importlib
+import time
+from app.cache import PredictionCache, SqliteCache
+
+PREDICTION = [{"label": "joy", "score": 0.9}]
+
+
+def test_cache_normalizes_whitespace_and_counts_hits():
+    cache = PredictionCache("model", top_k=1, max_entries=10, path="")
+    assert cache.get("Great product!") is None
+    cache.set("Great product!", PREDICTION)
+
+    assert cache.get("  Great   product!\n") == PREDICTION
+    assert cache.stats()["hits"] == 1
+    assert cache.stats()["misses"] == 1
+
+
+def test_cache_key_depends_on_model_and_top_k():
+    cache = PredictionCache("model", top_k=1, max_entries=10, path="")
+    other = PredictionCache("model", top_k=3, max_entries=10, path="")
+    assert cache.key("text") != other.key("text")
+
+
+def test_api_cache_is_keyed_by_backend():
+    api = importlib.import_module("app.app")
+    assert api.prediction_cache.model_id == f"{api.MODEL_NAME}@{api.MODEL_BACKEND}"
+    other = PredictionCache(f"{api.MODEL_NAME}@onnx", top_k=api.prediction_cache.top_k, max_entries=10, path="")
+    assert api.prediction_cache.key("text") != other.key("text")
+
+
+def test_cache_evicts_least_recently_used():
+    cache = PredictionCache("model", max_entries=2, path="")
+    cache.set("a", PREDICTION)
+    cache.set("b", PREDICTION)
+    cache.get("a")
+    cache.set("c", PREDICTION)
+
+    assert cache.get("b") is None
+    assert cache.get("a") == PREDICTION
+
+
+def test_cache_expires_entries():
+    cache = PredictionCache("model", max_entries=10, ttl=0.05, path="")
+    cache.set("a", PREDICTION)
+    time.sleep(0.1)
+    assert cache.get("a") is None
+
+
+def test_disk_tier_survives_restart(tmp_path):
+    path = str(tmp_path / "predictions.db")
+    cache = PredictionCache("model", max_entries=10, path=path)
+    cache.set("Great product!", PREDICTION)
+    cache.disk.close()
+
+    restarted = PredictionCache("model", max_entries=10, path=path)
+    assert restarted.get("Great product!") == PREDICTION
+    assert restarted.stats()["disk_hits"] == 1
+
+
+def test_disk_tier_stays_bounded(tmp_path):
+    disk = SqliteCache(str(tmp_path / "predictions.db"), max_entries=20)
+    for i in range(100):
+        disk.set(f"key {i}", [i])
+        if i < 90:
+            disk.get("key 0")
+        assert disk.count() <= 20 + disk.purge_every
+
+    # The most recently used entries are kept
+    assert disk.get("key 0") == [0]
+    assert disk.get("key 99") == [99]
+    assert disk.get("key 1") is None
+
+
+def test_disk_tier_deletes_expired_entries(tmp_path):
+    disk = SqliteCache(str(tmp_path / "predictions.db"), ttl=0.05, max_entries=10)
+    disk.set("a", [1])
+    time.sleep(0.1)
+    assert disk.get("a") is None
+    assert disk.count() == 0
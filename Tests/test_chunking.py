@@ -0,0 +1,45 @@
+import pytest
+from app.chunking import aggregate_scores, chunk_text
+
+
+class WordTokenizer:
+    # Minimal stand-in for a fast tokenizer: one token per word
+    def __call__(self, text, **kwargs):
+        offsets, position = [], 0
+        for word in text.split():
+            start = text.index(word, position)
+            position = start + len(word)
+            offsets.append((start, position))
+        return {"offset_mapping": offsets}
+
+
+def test_chunk_text_windows_overlap_by_stride():
+    text = " ".join(f"w{i}" for i in range(10))
+    chunks = chunk_text(text, WordTokenizer(), window=4, stride=1)
+
+    assert [chunk["text"] for chunk in chunks] == ["w0 w1 w2 w3", "w3 w4 w5 w6", "w6 w7 w8 w9"]
+    assert all(chunk["tokens"] == 4 for chunk in chunks)
+    assert text[chunks[1]["start"]:chunks[1]["end"]] == chunks[1]["text"]
+
+
+def test_chunk_text_short_text_is_one_chunk():
+    chunks = chunk_text("just a few words", WordTokenizer(), window=10, stride=2)
+    assert [chunk["text"] for chunk in chunks] == ["just a few words"]
+
+
+# Scores of the labels (joy, anger) for two chunks
+CHUNK_SCORES = [[0.8, 0.2], [0.2, 0.6]]
+
+
+def test_aggregate_mean_and_max():
+    assert aggregate_scores(CHUNK_SCORES, [1, 1], "mean").tolist() == pytest.approx([0.5, 0.4])
+    assert aggregate_scores(CHUNK_SCORES, [1, 1], "max").tolist() == pytest.approx([0.8, 0.6])
+
+
+def test_aggregate_weighted_by_length():
+    assert aggregate_scores(CHUNK_SCORES, [1, 3], "weighted").tolist() == pytest.approx([0.35, 0.5])
+
+
+def test_aggregate_rejects_unknown_method():
+    with pytest.raises(ValueError):
+        aggregate_scores(CHUNK_SCORES, [1, 1], "median")
@@ -0,0 +1,44 @@
+import numpy as np
+import pytest
+from app.decoding import compact_scores, decode_scores, parse_thresholds
+
+LABELS = ["joy", "anger", "fear", "neutral"]
+SCORES = np.array([[0.9, 0.05, 0.3, 0.6], [0.1, 0.7, 0.2, 0.4]], dtype=np.float32)
+
+
+def test_decode_top_k_orders_best_first():
+    assert [[pred["label"] for pred in row] for row in decode_scores(SCORES, LABELS, 2)] == [
+        ["joy", "neutral"], ["anger", "neutral"],
+    ]
+    assert [len(row) for row in decode_scores(SCORES, LABELS, None)] == [4, 4]
+
+
+def test_decode_threshold_with_and_without_top_k():
+    thresholds = parse_thresholds("0.35", LABELS)
+    assert [[pred["label"] for pred in row] for row in decode_scores(SCORES, LABELS, None, thresholds)] == [
+        ["joy", "neutral"], ["anger", "neutral"],
+    ]
+    assert [[pred["label"] for pred in row] for row in decode_scores(SCORES, LABELS, 1, parse_thresholds("0.8", LABELS))] == [
+        ["joy"], [],
+    ]
+
+
+def test_per_label_thresholds():
+    thresholds = parse_thresholds("neutral:0.5, *:0.25", LABELS)
+    assert thresholds.tolist() == pytest.approx([0.25, 0.25, 0.25, 0.5])
+    rows = decode_scores(SCORES, LABELS, None, thresholds)
+    assert [[pred["label"] for pred in row] for row in rows] == [["joy", "neutral", "fear"], ["anger"]]
+    # Labels not listed, without "*", are never returned
+    assert decode_scores(SCORES, LABELS, None, parse_thresholds("anger:0.5", LABELS)) == [
+        [], [{"label": "anger", "score": pytest.approx(0.7)}],
+    ]
+
+
+@pytest.mark.parametrize("spec", ["joy", "sadness:0.5", "joy:high"])
+def test_invalid_thresholds(spec):
+    with pytest.raises(ValueError):
+        parse_thresholds(spec, LABELS)
+
+
+def test_compact_scores_are_rounded():
+    assert compact_scores(SCORES, 2) == [[0.9, 0.05, 0.3, 0.6], [0.1, 0.7, 0.2, 0.4]]
@@ -0,0 +1,41 @@
+import asyncio
+
+import numpy as np
+
+from app.dedup import Deduplicator, text_digest
+
+
+def make_scorer(calls):
+    async def score_texts(texts):
+        calls.append(list(texts))
+        return np.array([[len(text), 1.0] for text in texts], dtype=np.float32).reshape(len(texts), 2)
+    return score_texts
+
+
+def test_duplicates_in_a_batch_are_scored_once():
+    calls = []
+    dedup = Deduplicator()
+    scores = asyncio.run(dedup.score(["good", "bad", "good", "good  ", "bad"], make_scorer(calls)))
+    assert calls == [["good", "bad"]]
+    assert scores[:, 0].tolist() == [4, 3, 4, 4, 3]
+    assert dedup.summary() == {"units": 5, "scored": 2, "duplicate_ratio": 0.6}
+
+
+def test_later_batches_reuse_scores_up_to_max_entries():
+    calls = []
+    dedup = Deduplicator(max_entries=1)
+    asyncio.run(dedup.score(["good", "bad"], make_scorer(calls)))
+    scores = asyncio.run(dedup.score(["good", "bad", "new"], make_scorer(calls)))
+    assert calls == [["good", "bad"], ["bad", "new"]]
+    assert scores[:, 0].tolist() == [4, 3, 3]
+
+    calls = []
+    dedup = Deduplicator(max_entries=0)
+    asyncio.run(dedup.score(["good"], make_scorer(calls)))
+    asyncio.run(dedup.score(["good", "good"], make_scorer(calls)))
+    assert calls == [["good"], ["good"]]
+
+
+def test_digest_uses_the_cache_normalization():
+    assert text_digest("Café  is\ngreat") == text_digest("Café is great")
+    assert text_digest("great") != text_digest("Great")
@@ -0,0 +1,73 @@
+import io
+import fitz   # type: ignore
+from app import extraction
+import pytest
+from app.extraction import iter_csv_units, iter_pdf_pages, iter_pdf_units, iter_txt_units
+
+
+class Upload:
+    # Just the part of UploadFile the extraction functions use
+    def __init__(self, filename, content):
+        self.filename = filename
+        self.file = io.BytesIO(content)
+
+
+def make_pdf(texts):
+    doc = fitz.open()
+    for text in texts:
+        doc.new_page().insert_text((72, 72), text)
+    return doc.tobytes()
+
+
+def write_pdf(tmp_path, texts):
+    path = tmp_path / "doc.pdf"
+    path.write_bytes(make_pdf(texts))
+    return str(path)
+
+
+def test_pdf_pages_respect_range_and_limit(tmp_path):
+    path = write_pdf(tmp_path, [f"page {i}" for i in range(1, 11)])
+
+    assert [number for number, _ in iter_pdf_pages(path, first_page=3, last_page=5)] == [3, 4, 5]
+    assert [number for number, _ in iter_pdf_pages(path, first_page=8, max_pages=0)] == [8, 9, 10]
+    assert [number for number, _ in iter_pdf_pages(path, max_pages=2)] == [1, 2]
+
+
+def test_pdf_pages_in_parallel_keep_order(tmp_path, monkeypatch):
+    monkeypatch.setattr(extraction, "PDF_PROCESSES", 2)
+    monkeypatch.setattr(extraction, "PDF_PARALLEL_MIN_PAGES", 2)
+    monkeypatch.setattr(extraction, "PDF_PAGES_PER_TASK", 3)
+    path = write_pdf(tmp_path, [f"page {i}" for i in range(1, 11)])
+
+    pages = list(iter_pdf_pages(path))
+    assert [number for number, _ in pages] == list(range(1, 11))
+    assert [text.strip() for _, text in pages] == [f"page {i}" for i in range(1, 11)]
+
+
+def test_pdf_chapters_span_pages():
+    upload = Upload("book.pdf", make_pdf(["Preface", "Chapter 1 Start\nHello", "more\nChapter 2 End\nBye"]))
+    assert list(iter_pdf_units(upload, "chapter")) == [("Chapter 1 Start", "Hello\nmore"), ("Chapter 2 End", "Bye")]
+
+
+def test_txt_paragraphs():
+    upload = Upload("notes.txt", b"first line\nstill first\n\n\nsecond\n")
+    assert list(iter_txt_units(upload)) == [("paragraph-1", "first line\nstill first"), ("paragraph-2", "second")]
+
+
+CSV = b"review_id,stars,review\nr1,5,Great product!\nr2,1,\nr3,2,Never again.\n"
+
+
+def test_csv_reads_selected_columns_in_chunks(monkeypatch):
+    monkeypatch.setattr(extraction, "CSV_CHUNK_ROWS", 1)
+
+    by_name = list(iter_csv_units(Upload("reviews.csv", CSV), text_column="review", id_column="review_id"))
+    by_index = list(iter_csv_units(Upload("reviews.csv", CSV), text_column="2"))
+
+    assert by_name == [("r1", "Great product!"), ("r3", "Never again.")]
+    assert by_index == [(0, "Great product!"), (2, "Never again.")]
+
+
+def test_csv_unknown_column():
+    with pytest.raises(ValueError):
+        list(iter_csv_units(Upload("reviews.csv", CSV), text_column="comment"))
+
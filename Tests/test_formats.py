@@ -0,0 +1,67 @@
+import io
+
+import msgpack
+import numpy as np
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+from app.formats import ArrowStreamEncoder, encode_msgpack, encode_parquet, negotiate, result_columns
+
+LABELS = ["joy", "anger", "neutral"]
+SCORES = np.array([[0.7, 0.2, 0.4], [0.1, 0.3, 0.9]], dtype=np.float32)
+OFFERED = ["json", "arrow", "parquet", "msgpack"]
+
+
+def test_negotiate():
+    assert negotiate(None, OFFERED) == "json"
+    assert negotiate("*/*", OFFERED) == "json"
+    assert negotiate("application/x-msgpack", OFFERED) == "msgpack"
+    assert negotiate("application/json;q=0.5, application/vnd.apache.parquet", OFFERED) == "parquet"
+    assert negotiate("application/*;q=0.2, application/json;q=0", OFFERED) == "arrow"
+    assert negotiate("text/html", OFFERED) is None
+
+
+def test_label_columns():
+    columns = result_columns(["a", "b"], SCORES, LABELS, {"output": "labels", "top_k": 2, "thresholds": None})
+    assert columns["id"] == ["a", "a", "b", "b"]
+    assert columns["label"].tolist() == [0, 2, 2, 1]
+    assert columns["score"].dtype == np.float32
+
+    thresholds = np.array([0.5, 0.5, 0.5], dtype=np.float32)
+    columns = result_columns(["a", "b"], SCORES, LABELS, {"output": "labels", "top_k": None, "thresholds": thresholds})
+    assert columns["id"] == ["a", "b"]
+    assert [LABELS[i] for i in columns["label"]] == ["joy", "neutral"]
+
+
+def test_arrow_stream_batches():
+    encoder = ArrowStreamEncoder(LABELS)
+    options = {"output": "labels", "top_k": 1, "thresholds": None}
+    content = encoder.encode(result_columns([0, 1], SCORES, LABELS, options))
+    content += encoder.encode(result_columns([2], SCORES[:1], LABELS, options))
+    content += encoder.close()
+    frame = pa.ipc.open_stream(content).read_pandas()
+    assert list(frame["id"]) == [0, 1, 2]
+    assert list(frame["label"]) == ["joy", "neutral", "joy"]
+
+
+def test_scores_parquet_and_msgpack():
+    columns = result_columns([7, 8], SCORES, LABELS, {"output": "scores"})
+    table = pq.read_table(io.BytesIO(encode_parquet(columns, LABELS)))
+    assert table.column_names == ["id"] + LABELS
+    assert table.schema.field("joy").type == pa.float32()
+    np.testing.assert_array_equal(table.to_pandas()[LABELS].to_numpy(), SCORES)
+
+    packed = msgpack.unpackb(encode_msgpack(columns, LABELS))
+    assert packed["labels"] == LABELS
+    assert packed["columns"]["id"] == [7, 8]
+    np.testing.assert_array_equal(np.array([packed["columns"][label] for label in LABELS], dtype=np.float32).T, SCORES)
+
+
+def test_empty_arrow_stream_has_a_schema():
+    encoder = ArrowStreamEncoder(LABELS, {"output": "labels", "top_k": 1, "thresholds": None}, include_text=True)
+    table = pa.ipc.open_stream(encoder.close()).read_all()
+    assert table.num_rows == 0
+    assert table.column_names == ["id", "text", "label", "score"]
+
+    encoder = ArrowStreamEncoder(LABELS, {"output": "scores"})
+    assert pa.ipc.open_stream(encoder.close()).read_all().column_names == ["id"] + LABELS
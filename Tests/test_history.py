@@ -0,0 +1,83 @@
+from datetime import datetime, timezone
+from app.history import HistoryStore
+from app.prediction_log import LocalLogWriter, PredictionLog, prediction_records
+
+
+def log_predictions(tmp_path):
+    log = PredictionLog(LocalLogWriter(str(tmp_path / "log")))
+    for day, hour, user, label, response_time in [
+        (1, 9, "alice", "joy", 0.1),
+        (1, 9, "bob", "anger", 0.2),
+        (1, 10, "alice", "joy", 0.3),
+        (2, 9, "alice", "sadness", 0.4),
+        (2, 23, "bob", "joy", 0.5),
+    ]:
+        request_time = datetime(2024, 5, day, hour, 15, tzinfo=timezone.utc)
+        log.log(prediction_records(user, request_time, response_time, ["text"], [[{"label": label, "score": 0.9}]]))
+    log.flush()
+    return log.writer
+
+
+def test_compaction_skips_open_hours(tmp_path):
+    writer = log_predictions(tmp_path)
+    store = HistoryStore(str(tmp_path / "history"), grace_seconds=300)
+
+    assert store.compact(writer, now=datetime(2024, 5, 2, 23, 30, tzinfo=timezone.utc)) == 3
+    assert store.compact(writer, now=datetime(2024, 5, 3, 1, 0, tzinfo=timezone.utc)) == 1
+    assert store.compact(writer, now=datetime(2024, 5, 3, 1, 0, tzinfo=timezone.utc)) == 0
+    assert sorted(path.parent.name for path in (tmp_path / "history").rglob("*.parquet")) == [
+        "date=2024-05-01", "date=2024-05-01", "date=2024-05-02", "date=2024-05-02"
+    ]
+
+
+def test_history_queries(tmp_path):
+    store = HistoryStore(str(tmp_path / "history"))
+    store.compact(log_predictions(tmp_path), now=datetime(2024, 6, 1, tzinfo=timezone.utc))
+
+    start, end = datetime(2024, 5, 1), datetime(2024, 5, 2, 12)
+    assert store.label_distribution(start, end, "day") == [
+        {"period": "2024-05-01T00:00:00+00:00", "counts": {"joy": 2, "anger": 1}},
+        {"period": "2024-05-02T00:00:00+00:00", "counts": {"sadness": 1}},
+    ]
+    assert store.user_volume(start, end) == [{"username": "alice", "predictions": 3}, {"username": "bob", "predictions": 1}]
+
+    latency = store.latency_percentiles(start, end)
+    assert latency["count"] == 4
+    assert latency["p50"] == 0.25
+
+    assert HistoryStore(str(tmp_path / "empty")).latency_percentiles(start, end) == {"count": 0}
+
+
+def test_segments_that_grew_are_compacted_again(tmp_path):
+    writer = log_predictions(tmp_path)
+    store = HistoryStore(str(tmp_path / "history"))
+    now = datetime(2024, 5, 3, 1, 0, tzinfo=timezone.utc)
+    assert store.compact(writer, now=now) == 4
+
+    # A record of a compacted hour flushed late
+    log = PredictionLog(writer)
+    request_time = datetime(2024, 5, 2, 9, 45, tzinfo=timezone.utc)
+    log.log(prediction_records("carol", request_time, 0.6, ["text"], [[{"label": "joy", "score": 0.9}]]))
+    log.flush()
+
+    assert store.compact(writer, now=now) == 1
+    assert store.compact(writer, now=now) == 0
+    volume = store.user_volume(datetime(2024, 5, 2), datetime(2024, 5, 3))
+    assert {"username": "carol", "predictions": 1} in volume
+
+
+def test_compaction_lists_only_recent_partitions(tmp_path):
+    writer = log_predictions(tmp_path)
+    store = HistoryStore(str(tmp_path / "history"), rescan_hours=0)
+    store.compact(writer, now=datetime(2024, 5, 3, 1, 0, tzinfo=timezone.utc))
+
+    prefixes = []
+    sizes = writer.sizes
+
+    def recording_sizes(prefix=""):
+        prefixes.append(prefix)
+        return sizes(prefix)
+
+    writer.sizes = recording_sizes
+    assert store.compact(writer, now=datetime(2024, 5, 3, 2, 0, tzinfo=timezone.utc)) == 0
+    assert prefixes == ["date=2024-05-02/", "date=2024-05-03/"]
@@ -0,0 +1,154 @@
+import io
+import os
+import time
+from datetime import timedelta
+from fastapi.testclient import TestClient
+import importlib
+from app import app
+from app.jobs import JobRunner, JobStore, job_summary
+from auth import auth, create_access_token
+
+api = importlib.import_module("app.app")
+
+USER_NAME = os.getenv("USER_NAME")
+
+TXT = b"\n\n".join(f"Review number {i}.".encode() for i in range(5))
+
+
+class Upload:
+    # Just the part of UploadFile the job store uses
+    def __init__(self, filename, content):
+        self.filename = filename
+        self.file = io.BytesIO(content)
+
+
+def fake_predict(job, texts):
+    return [[{"label": text.upper(), "score": 1.0}] for text in texts]
+
+
+def wait_for(store, job_id, timeout=10):
+    deadline = time.time() + timeout
+    while store.get(job_id)["status"] not in ("completed", "failed") and time.time() < deadline:
+        time.sleep(0.05)
+    return store.get(job_id)
+
+
+def test_job_runs_in_batches_and_pages_results(tmp_path):
+    store = JobStore(str(tmp_path / "jobs.db"), str(tmp_path / "files"))
+    runner = JobRunner(store, fake_predict, batch_size=2)
+    job_id = store.create("alice", Upload("reviews.txt", TXT), {})
+    runner.submit(job_id)
+
+    job = wait_for(store, job_id)
+    runner.close()
+    assert (job["status"], job["units_done"], job["batches_done"]) == ("completed", 5, 3)
+    assert [r["id"] for r in store.results(job_id, offset=3, limit=10)] == ["paragraph-4", "paragraph-5"]
+    assert store.results(job_id, 0, 1)[0]["predictions"][0]["label"] == "REVIEW NUMBER 0."
+    assert not os.listdir(tmp_path / "files")
+
+
+def test_job_resumes_after_last_saved_batch(tmp_path):
+    store = JobStore(str(tmp_path / "jobs.db"), str(tmp_path / "files"))
+    job_id = store.create("alice", Upload("reviews.txt", TXT), {})
+    # A previous run saved the first batch, then the server stopped
+    store.mark_running(job_id)
+    store.save_batch(job_id, 0, [("paragraph-1", [{"label": "SAVED", "score": 1.0}]),
+                                 ("paragraph-2", [{"label": "SAVED", "score": 1.0}])])
+    store.close()
+
+    seen = []
+
+    def predict(job, texts):
+        seen.extend(texts)
+        return fake_predict(job, texts)
+
+    store = JobStore(str(tmp_path / "jobs.db"), str(tmp_path / "files"))
+    runner = JobRunner(store, predict, batch_size=2)
+    runner.start()
+    job = wait_for(store, job_id)
+    runner.close()
+
+    assert job["status"] == "completed"
+    assert seen == ["Review number 2.", "Review number 3.", "Review number 4."]
+    assert [r["predictions"][0]["label"] for r in store.results(job_id)][:3] == ["SAVED", "SAVED", "REVIEW NUMBER 2."]
+
+
+def test_job_counts_duplicate_units(tmp_path):
+    import asyncio
+    import sqlite3
+    import numpy as np
+
+    # A database from before duplicates were counted gets the new column
+    sqlite3.connect(str(tmp_path / "jobs.db")).execute(
+        "CREATE TABLE jobs (id TEXT PRIMARY KEY, username TEXT, filename TEXT, path TEXT, options TEXT, status TEXT, "
+        "units_done INTEGER DEFAULT 0, batches_done INTEGER DEFAULT 0, error TEXT, "
+        "created_at REAL, started_at REAL, updated_at REAL, finished_at REAL)"
+    ).connection.close()
+    store = JobStore(str(tmp_path / "jobs.db"), str(tmp_path / "files"))
+    seen = []
+
+    def predict(job, texts):
+        async def score_texts(distinct):
+            seen.extend(distinct)
+            return np.zeros((len(distinct), 1), dtype=np.float32)
+        asyncio.run(job["dedup"].score(texts, score_texts))
+        return fake_predict(job, texts)
+
+    runner = JobRunner(store, predict, batch_size=2)
+    job_id = store.create("alice", Upload("reviews.txt", b"Great.\n\nAwful.\n\nGreat.\n\nGreat."), {})
+    runner.submit(job_id)
+    job = wait_for(store, job_id)
+    runner.close()
+
+    assert seen == ["Great.", "Awful."]
+    assert (job["units_done"], job["units_scored"]) == (4, 2)
+    assert job_summary(job)["duplicate_ratio"] == 0.5
+    assert [r["predictions"][0]["label"] for r in store.results(job_id)] == ["GREAT.", "AWFUL.", "GREAT.", "GREAT."]
+
+
+def test_jobs_api(tmp_path, monkeypatch):
+    store = JobStore(str(tmp_path / "jobs.db"), str(tmp_path / "files"))
+    monkeypatch.setattr(api, "job_store", store)
+    monkeypatch.setattr(api.job_runner, "store", store)
+    headers = {"Authorization": f"Bearer {create_access_token({'sub': USER_NAME}, timedelta(minutes=30))}"}
+
+    with TestClient(app) as client:
+        response = client.post(
+            "/jobs",
+            headers=headers,
+            data={"text_column": "review"},
+            files={"file": ("reviews.csv", b"review\nGreat product!\nNever again.\nIt is fine.\n", "text/csv")},
+        )
+        assert response.status_code == 202
+        job_id = response.json()["id"]
+
+        deadline = time.time() + 60
+        status = client.get(f"/jobs/{job_id}", headers=headers).json()
+        while status["status"] not in ("completed", "failed") and time.time() < deadline:
+            time.sleep(0.1)
+            status = client.get(f"/jobs/{job_id}", headers=headers).json()
+        assert status["status"] == "completed"
+        assert status["units_done"] == status["units_scored"] == 3
+
+        page = client.get(f"/jobs/{job_id}/results", params={"limit": 2}, headers=headers).json()
+        assert [r["id"] for r in page["results"]] == [0, 1]
+        page = client.get(f"/jobs/{job_id}/results", params={"offset": page["next_offset"]}, headers=headers).json()
+        assert [r["id"] for r in page["results"]] == [2]
+        assert page["next_offset"] is None
+
+        # An API key named like the user is not the job's owner
+        monkeypatch.setattr(auth, "API_KEYS", f"{USER_NAME}:s3cret")
+        auth.get_api_keys.cache_clear()
+        try:
+            key_headers = {"X-API-Key": "s3cret"}
+            assert client.get(f"/jobs/{job_id}", headers=key_headers).status_code == 404
+            assert client.get(f"/jobs/{job_id}/results", headers=key_headers).status_code == 404
+            response = client.post("/jobs", headers=key_headers, files={"file": ("reviews.txt", TXT)})
+            key_job = response.json()["id"]
+            assert client.get(f"/jobs/{key_job}", headers=key_headers).status_code == 200
+            assert client.get(f"/jobs/{key_job}", headers=headers).status_code == 404
+        finally:
+            auth.get_api_keys.cache_clear()
+
+        assert client.get("/jobs/unknown", headers=headers).status_code == 404
+        assert client.post("/jobs", headers=headers, files={"file": ("a.docx", b"x")}).status_code == 400
@@ -0,0 +1,65 @@
+import os
+import numpy as np
+import pytest
+from app.backends import REFERENCE_TEXTS, load_classifier
+from app.decoding import decode_scores, labels_of, scores_from_predictions
+from app.pipeline import BatchScorer, StagedPipeline
+
+MODEL_NAME = "SamLowe/roberta-base-go_emotions"
+# Tests comparing with the real model only run when it is asked for, e.g.
+# MODEL_BACKEND=pytorch pytest
+requires_model = pytest.mark.skipif(os.getenv("MODEL_BACKEND") != "pytorch", reason="runs with MODEL_BACKEND=pytorch")
+
+
+@pytest.fixture(scope="module")
+def reference():
+    return load_classifier(MODEL_NAME, top_k=None, backend="pytorch")
+
+
+@requires_model
+def test_staged_pipeline_matches_the_transformers_pipeline(reference):
+    staged = StagedPipeline(reference)
+    try:
+        actual = staged(REFERENCE_TEXTS, batch_size=4)
+    finally:
+        staged.close()
+    labels = labels_of(reference)
+    expected = reference(REFERENCE_TEXTS, top_k=None, batch_size=4, truncation=True)
+
+    assert staged.staged
+    assert actual.shape == (len(REFERENCE_TEXTS), len(labels))
+    np.testing.assert_allclose(actual, scores_from_predictions(expected, labels), atol=1e-6)
+    for want, got in zip(expected, decode_scores(actual, labels, 3)):
+        assert [pred["label"] for pred in got] == [pred["label"] for pred in want[:3]]
+
+    stages = staged.stats()["stages"]
+    assert [stages[stage]["texts"] for stage in ("tokenize", "forward", "postprocess")] == [len(REFERENCE_TEXTS)] * 3
+
+
+@requires_model
+def test_batch_scorer_matches_the_staged_pipeline(reference):
+    staged = StagedPipeline(reference)
+    try:
+        np.testing.assert_allclose(BatchScorer(reference)(REFERENCE_TEXTS[:4]), staged(REFERENCE_TEXTS[:4]), atol=1e-6)
+    finally:
+        staged.close()
+
+
+@requires_model
+def test_failed_batch_fails_only_its_own_future(reference):
+    staged = StagedPipeline(reference)
+    try:
+        bad = staged.submit([None])
+        good = staged.submit(["I love it"])
+        with pytest.raises(Exception):
+            bad.result(timeout=10)
+        assert good.result(timeout=10).shape == (1, len(labels_of(reference)))
+    finally:
+        staged.close()
+
+
+def test_unsplittable_models_are_called_whole():
+    stub = load_classifier(MODEL_NAME, backend="stub")
+    staged = StagedPipeline(stub)
+    np.testing.assert_array_equal(staged(["Great value"]), stub.scores(["Great value"]))
+    assert not staged.staged
@@ -0,0 +1,186 @@
+import json
+import os
+import threading
+import uuid
+from datetime import datetime, timezone
+from types import SimpleNamespace
+import pytest
+from app.prediction_log import BLOB_BLOCK_BYTES, BlobLogWriter, LocalLogWriter, PredictionLog, prediction_records
+
+
+def records_at(hour, count):
+    request_time = datetime(2024, 5, 1, hour, 30, tzinfo=timezone.utc)
+    return prediction_records("user", request_time, 0.01, [f"text {i}" for i in range(count)],
+                              [[{"label": "joy", "score": 0.9}]] * count)
+
+
+def read_segments(tmp_path):
+    return {
+        str(path.relative_to(tmp_path).parent): [json.loads(line) for line in path.read_text().splitlines()]
+        for path in tmp_path.rglob("*.jsonl")
+    }
+
+
+def test_log_appends_records_to_hourly_segments(tmp_path):
+    log = PredictionLog(LocalLogWriter(str(tmp_path)), batch_size=100)
+    log.log(records_at(9, 2))
+    log.log(records_at(10, 1))
+    log.flush()
+    log.log(records_at(9, 1))
+    log.flush()
+
+    segments = read_segments(tmp_path)
+    assert sorted(segments) == ["date=2024-05-01/hour=09", "date=2024-05-01/hour=10"]
+    assert [r["Texts"] for r in segments["date=2024-05-01/hour=09"]] == ["text 0", "text 1", "text 0"]
+    assert segments["date=2024-05-01/hour=10"][0]["predictions"] == "joy"
+    assert log.stats() == {"buffered": 0, "written": 4, "dropped": 0, "failed": 0}
+
+
+def test_log_flushes_in_background_when_batch_is_full(tmp_path):
+    written = threading.Event()
+
+    class Writer(LocalLogWriter):
+        def append(self, name, data):
+            super().append(name, data)
+            written.set()
+
+    log = PredictionLog(Writer(str(tmp_path)), batch_size=3, flush_seconds=60)
+    log.start()
+    log.log(records_at(9, 3))
+    assert written.wait(5)
+    log.close()
+    assert log.stats()["written"] == 3
+
+
+def test_log_drops_records_beyond_buffer_and_survives_write_errors():
+    class FailingWriter:
+        def append(self, name, data):
+            raise OSError("disk full")
+
+    log = PredictionLog(FailingWriter(), batch_size=100, max_buffer=2)
+    log.log(records_at(9, 3))
+    log.flush()
+    assert log.stats() == {"buffered": 0, "written": 0, "dropped": 1, "failed": 2}
+
+
+# In-memory stand-in for an Azure container, enforcing what the service does
+# for append blobs: conditional creation and blocks of at most 4 MiB
+class FakeContainer:
+    def __init__(self):
+        from azure.core.exceptions import ResourceExistsError # type: ignore
+
+        self.exists_error = ResourceExistsError
+        self.created = False
+        self.blobs = {}
+        self.blocks = {}
+
+    def create_container(self):
+        if self.created:
+            raise self.exists_error("container exists")
+        self.created = True
+
+    def get_blob_client(self, name):
+        return FakeBlobClient(self, name)
+
+    def list_blobs(self, name_starts_with=None):
+        return [
+            SimpleNamespace(name=name, size=len(data))
+            for name, data in self.blobs.items()
+            if name.startswith(name_starts_with or "")
+        ]
+
+
+class FakeBlobClient:
+    def __init__(self, container, name):
+        self.container = container
+        self.name = name
+
+    def create_append_blob(self, etag=None, match_condition=None):
+        from azure.core import MatchConditions # type: ignore
+
+        assert (etag, match_condition) == ("*", MatchConditions.IfMissing)
+        if self.name in self.container.blobs:
+            raise self.container.exists_error("blob exists")
+        self.container.blobs[self.name] = b""
+
+    def append_block(self, data):
+        assert self.name in self.container.blobs, "append to a missing blob"
+        assert len(data) <= 4 * 1024 * 1024
+        self.container.blobs[self.name] += data
+        self.container.blocks.setdefault(self.name, []).append(len(data))
+
+    def download_blob(self):
+        return SimpleNamespace(readall=lambda: self.container.blobs[self.name])
+
+
+@pytest.fixture
+def fake_container(monkeypatch):
+    pytest.importorskip("azure.storage.blob")
+    from azure.storage import blob # type: ignore
+
+    container = FakeContainer()
+
+    class Service:
+        def get_container_client(self, name):
+            assert name == "predictions"
+            return container
+
+    monkeypatch.setattr(blob.BlobServiceClient, "from_connection_string", lambda connection_string: Service())
+    return container
+
+
+def test_blob_log_appends_records_to_hourly_blobs(fake_container):
+    log = PredictionLog(BlobLogWriter("UseDevelopmentStorage=true", "predictions"), batch_size=100)
+    log.log(records_at(9, 2))
+    log.log(records_at(10, 1))
+    log.flush()
+    log.log(records_at(9, 1))
+    log.flush()
+
+    hour_9 = f"date=2024-05-01/hour=09/predictions-{log.writer_id}.jsonl"
+    hour_10 = f"date=2024-05-01/hour=10/predictions-{log.writer_id}.jsonl"
+    assert sorted(fake_container.blobs) == [hour_9, hour_10]
+    assert [json.loads(line)["Texts"] for line in log.writer.read(hour_9).splitlines()] == ["text 0", "text 1", "text 0"]
+    assert log.writer.list("date=2024-05-01/hour=10/") == [hour_10]
+    assert log.writer.sizes()[hour_9] == len(fake_container.blobs[hour_9])
+    assert log.stats()["failed"] == 0
+
+
+def test_blob_log_appends_to_blobs_created_elsewhere(fake_container):
+    name = "date=2024-05-01/hour=09/predictions-other.jsonl"
+    BlobLogWriter("UseDevelopmentStorage=true", "predictions").append(name, b"first\n")
+    # A restarted process: both the container and the blob already exist
+    BlobLogWriter("UseDevelopmentStorage=true", "predictions").append(name, b"second\n")
+
+    assert fake_container.blobs[name] == b"first\nsecond\n"
+
+
+def test_blob_log_splits_appends_into_blocks(fake_container):
+    writer = BlobLogWriter("UseDevelopmentStorage=true", "predictions")
+    data = b"x" * (2 * BLOB_BLOCK_BYTES + 10)
+    writer.append("segment.jsonl", data)
+
+    assert fake_container.blocks["segment.jsonl"] == [BLOB_BLOCK_BYTES, BLOB_BLOCK_BYTES, 10]
+    assert writer.read("segment.jsonl") == data
+
+
+# Runs against a real Azurite emulator, e.g.
+# AZURITE_CONNECTION_STRING=UseDevelopmentStorage=true pytest
+@pytest.mark.skipif(not os.getenv("AZURITE_CONNECTION_STRING"), reason="set AZURITE_CONNECTION_STRING to run against Azurite")
+def test_blob_log_against_azurite():
+    container = f"predictions-test-{uuid.uuid4().hex[:8]}"
+    writer = BlobLogWriter(os.environ["AZURITE_CONNECTION_STRING"], container)
+    try:
+        log = PredictionLog(writer, batch_size=100)
+        log.log(records_at(9, 2))
+        log.flush()
+        log.log(records_at(9, 1))
+        log.flush()
+        writer.append("date=2024-05-01/hour=11/big.jsonl", b"x" * (BLOB_BLOCK_BYTES + 1))
+
+        hour_9 = f"date=2024-05-01/hour=09/predictions-{log.writer_id}.jsonl"
+        assert writer.list("date=2024-05-01/hour=09/") == [hour_9]
+        assert len(writer.read(hour_9).splitlines()) == 3
+        assert writer.sizes()["date=2024-05-01/hour=11/big.jsonl"] == BLOB_BLOCK_BYTES + 1
+    finally:
+        writer.container_client.delete_container()
@@ -0,0 +1,74 @@
+import json
+import marshal
+import os
+import time
+from datetime import timedelta
+from fastapi.testclient import TestClient
+from app import app
+from app.profiling import Profiler
+from auth import create_access_token
+
+client = TestClient(app)
+
+
+def busy(n=20000):
+    return sum(i * i for i in range(n))
+
+
+def test_cprofile_session_stops_after_max_calls():
+    profiler = Profiler()
+    profiler.start("cprofile", max_calls=2, seconds=60, memory=True)
+    for _ in range(3):
+        with profiler.capture():
+            busy()
+
+    status = profiler.status()
+    assert (status["active"], status["calls"]) == (False, 2)
+    assert status["outputs"] == ["pstats", "memory"]
+    stats = marshal.loads(profiler.output("pstats"))
+    assert any(function == "busy" for (_, _, function) in stats)
+    assert len(json.loads(profiler.output("memory"))["peak_bytes_per_call"]) == 2
+
+
+def test_sampler_session_writes_flamegraph_and_speedscope():
+    profiler = Profiler()
+    profiler.start("sampler", max_calls=100, seconds=0.3)
+    deadline = time.time() + 0.5
+    while time.time() < deadline:
+        busy(1000)
+
+    folded = profiler.output("flamegraph").decode()
+    assert "busy (test_profiling.py" in folded
+    speedscope = json.loads(profiler.output("speedscope"))
+    assert speedscope["profiles"][0]["type"] == "sampled"
+    assert profiler.output("pstats") is None
+
+
+def test_torch_operator_timings():
+    import torch
+
+    profiler = Profiler()
+    profiler.start("cprofile", max_calls=1, seconds=60, torch_ops=True)
+    with profiler.capture():
+        torch.ones(8, 8) @ torch.ones(8, 8)
+
+    ops = [op["op"] for op in json.loads(profiler.output("torch"))]
+    assert "aten::matmul" in ops
+
+
+def test_profile_endpoints_are_admin_only():
+    admin = {"Authorization": f"Bearer {create_access_token({'sub': os.getenv('ADMIN_NAME')}, timedelta(minutes=30))}"}
+    user = {"Authorization": f"Bearer {create_access_token({'sub': os.getenv('USER_NAME')}, timedelta(minutes=30))}"}
+
+    assert client.get("/admin/profile", headers=user).status_code == 403
+    assert client.post("/admin/profile", data={"mode": "nope"}, headers=admin).status_code == 400
+
+    response = client.post("/admin/profile", data={"mode": "cprofile", "calls": 1}, headers=admin)
+    assert response.status_code == 200
+    client.post("/predict/batch", json=["Profiled review"], headers=user)
+
+    assert client.get("/admin/profile", headers=admin).json()["active"] is False
+    response = client.get("/admin/profile/pstats", headers=admin)
+    assert response.status_code == 200
+    assert "profile.pstats" in response.headers["content-disposition"]
+    assert client.get("/admin/profile/speedscope", headers=admin).status_code == 404
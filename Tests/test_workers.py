@@ -0,0 +1,27 @@
+import os
+from app.workers import InferenceWorkerPool
+
+
+def fake_classifier(texts, batch_size=1, truncation=False):
+    return [[{"label": text, "score": float(os.getpid())}] for text in texts]
+
+
+def test_pool_runs_batches_in_forked_workers():
+    pool = InferenceWorkerPool(fake_classifier, processes=2, threads=1)
+    try:
+        results = pool.predict(["happy", "sad"])
+    finally:
+        pool.close()
+
+    assert [result[0]["label"] for result in results] == ["happy", "sad"]
+    assert results[0][0]["score"] != os.getpid()
+
+
+def test_pool_is_started_once():
+    pool = InferenceWorkerPool(fake_classifier, processes=1, threads=1)
+    pool.start()
+    executor = pool._executor
+    pool.start()
+    assert pool._executor is executor
+    pool.close()
+    assert not pool.started
@@ -0,0 +1,200 @@
+import io
+import itertools
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from typing import Callable, List, Optional
+
+import httpx # type: ignore
+import pandas as pd # type: ignore
+import pyarrow as pa # type: ignore
+
+ARROW_STREAM = "application/vnd.apache.arrow.stream"
+# Answers of an overloaded or restarting server, worth retrying
+RETRY_STATUSES = (429, 502, 503, 504)
+RESULT_COLUMNS = ["id", "label", "score"]
+
+
+# Keep-alive connection pool, shared by every client using the same server
+def http_client(max_connections: int = 8, timeout: float = 600) -> httpx.Client:
+    limits = httpx.Limits(max_connections=max_connections, max_keepalive_connections=max_connections)
+    return httpx.Client(limits=limits, timeout=timeout)
+
+
+# File-like view of a streamed response body, so Arrow can read each record
+# batch as soon as it arrives
+class ResponseStream(io.RawIOBase):
+    def __init__(self, chunks):
+        self._chunks = iter(chunks)
+        self._buffer = b""
+
+    def readable(self) -> bool:
+        return True
+
+    def readinto(self, buffer) -> int:
+        while not self._buffer:
+            self._buffer = next(self._chunks, None)
+            if self._buffer is None:
+                self._buffer = b""
+                return 0
+        size = min(len(buffer), len(self._buffer))
+        buffer[:size] = self._buffer[:size]
+        self._buffer = self._buffer[size:]
+        return size
+
+
+# Client of the emotion API. Texts go to /predict/batch in chunks, up to
+# `concurrency` at a time, and files to /predict/stream, whose results are
+# read record batch by record batch; both answer as Arrow and come back as
+# DataFrames. Servers without those endpoints get one text per /predict/
+# call instead. Overloaded answers and connection errors are retried with
+# exponential backoff (or the server's Retry-After, when longer).
+# `on_progress(done, total)` is called from the calling thread as results
+# arrive; `total` is None when it is not known up front.
+class EmotionClient:
+    def __init__(
+        self,
+        base_url: str,
+        token: Optional[str] = None,
+        http: Optional[httpx.Client] = None,
+        concurrency: int = 4,
+        batch_size: int = 256,
+        retries: int = 3,
+        backoff: float = 0.5,
+    ):
+        self.base_url = base_url.rstrip("/")
+        self.token = token
+        self.http = http or http_client(concurrency)
+        self.concurrency = max(1, concurrency)
+        self.batch_size = max(1, batch_size)
+        self.retries = retries
+        self.backoff = backoff
+        self._endpoints = None
+
+    @property
+    def headers(self) -> dict:
+        return {"Authorization": f"Bearer {self.token}"} if self.token else {}
+
+    def login(self, username: str, password: str) -> bool:
+        response = self._request("POST", "/token", data={"username": username, "password": password})
+        if response.status_code != 200:
+            return False
+        self.token = response.json()["access_token"]
+        return True
+
+    # Paths the server offers, from its OpenAPI schema
+    def endpoints(self) -> set:
+        if self._endpoints is None:
+            try:
+                response = self._request("GET", "/openapi.json")
+                self._endpoints = set(response.json().get("paths", {})) if response.status_code == 200 else set()
+            except (httpx.HTTPError, ValueError):
+                self._endpoints = set()
+        return self._endpoints
+
+    def _delay(self, attempt: int, retry_after: Optional[str] = None) -> float:
+        delay = self.backoff * 2 ** attempt
+        try:
+            return max(delay, float(retry_after)) if retry_after else delay
+        except ValueError:
+            return delay
+
+    def _request(self, method: str, path: str, stream: bool = False, headers: dict = None, **kwargs) -> httpx.Response:
+        for attempt in range(self.retries + 1):
+            request = self.http.build_request(method, self.base_url + path, headers={**self.headers, **(headers or {})}, **kwargs)
+            try:
+                response = self.http.send(request, stream=stream)
+            except httpx.TransportError:
+                if attempt == self.retries:
+                    raise
+                time.sleep(self._delay(attempt))
+                continue
+            if response.status_code not in RETRY_STATUSES or attempt == self.retries:
+                return response
+            response.close()
+            time.sleep(self._delay(attempt, response.headers.get("retry-after")))
+
+    # Top predictions of one text, from /predict/
+    def predict_text(self, text: str) -> List[dict]:
+        response = self._request("POST", "/predict/", data={"text": text})
+        response.raise_for_status()
+        return response.json()["predictions"][0]
+
+    def _score_chunk(self, start: int, texts: List[str]) -> pd.DataFrame:
+        response = self._request(
+            "POST", "/predict/batch",
+            headers={"Accept": ARROW_STREAM},
+            json=[{"id": start + i, "text": text} for i, text in enumerate(texts)],
+        )
+        response.raise_for_status()
+        return pa.ipc.open_stream(response.content).read_pandas()
+
+    def _score_chunk_singly(self, start: int, texts: List[str]) -> pd.DataFrame:
+        rows = []
+        for i, text in enumerate(texts):
+            top = self.predict_text(text)[:1]
+            rows += [{"id": start + i, "label": pred["label"], "score": pred["score"]} for pred in top]
+        return pd.DataFrame(rows, columns=RESULT_COLUMNS)
+
+    # Top label of each text, with `id` its position in `texts`
+    def predict_texts(self, texts: List[str], on_progress: Callable = None) -> pd.DataFrame:
+        score = self._score_chunk if "/predict/batch" in self.endpoints() else self._score_chunk_singly
+        frames, done = [], 0
+        with ThreadPoolExecutor(self.concurrency) as pool:
+            futures = {
+                pool.submit(score, start, texts[start:start + self.batch_size]): min(self.batch_size, len(texts) - start)
+                for start in range(0, len(texts), self.batch_size)
+            }
+            for future in as_completed(futures):
+                frames.append(future.result())
+                done += futures[future]
+                if on_progress is not None:
+                    on_progress(done, len(texts))
+        if not frames:
+            return pd.DataFrame(columns=RESULT_COLUMNS)
+        return pd.concat(frames, ignore_index=True).sort_values("id", kind="stable", ignore_index=True)
+
+    # Top label of each unit of a PDF, TXT or CSV file (see /predict/stream
+    # for `form`), with the unit's text when include_text is set
+    def predict_file(self, name: str, content: bytes, on_progress: Callable = None, total: int = None, **form) -> pd.DataFrame:
+        if "/predict/stream" not in self.endpoints():
+            return self._predict_file_locally(name, content, on_progress, **form)
+        form = {key: str(value).lower() if isinstance(value, bool) else value for key, value in form.items() if value is not None}
+        response = self._request("POST", "/predict/stream", stream=True, files={"file": (name, content)}, data={**form, "format": "arrow"})
+        try:
+            if response.status_code != 200:
+                response.read()
+                response.raise_for_status()
+            chunks = response.iter_bytes()
+            first = next((chunk for chunk in chunks if chunk), None)
+            # Servers from before empty streams carried a schema send no bytes at all
+            if first is None:
+                columns = ["id", "text", "label", "score"] if form.get("include_text") == "true" else RESULT_COLUMNS
+                return pd.DataFrame(columns=columns)
+            reader = pa.ipc.open_stream(ResponseStream(itertools.chain([first], chunks)))
+            batches, done = [], 0
+            for batch in reader:
+                batches.append(batch)
+                done += batch.num_rows
+                if on_progress is not None:
+                    on_progress(done, total)
+            return pa.Table.from_batches(batches, reader.schema).to_pandas()
+        finally:
+            response.close()
+
+    # TXT and CSV files split here when the server cannot stream them
+    def _predict_file_locally(self, name: str, content: bytes, on_progress: Callable = None, text_column=None, include_text=False, **form) -> pd.DataFrame:
+        if name.endswith(".txt"):
+            texts = [paragraph for paragraph in content.decode("utf-8").split("\n\n") if paragraph.strip()]
+        elif name.endswith(".csv"):
+            frame = pd.read_csv(io.BytesIO(content))
+            column = text_column if text_column in frame.columns else frame.columns[0]
+            texts = frame[column].fillna("").astype(str).tolist()
+        else:
+            raise ValueError(f"The server cannot stream {name}")
+        results = self.predict_texts(texts, on_progress)
+        if include_text:
+            results.insert(1, "text", [texts[i] for i in results["id"]])
+        return results
+
+    def close(self):
+        self.http.close()
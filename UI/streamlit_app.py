@@ -1,14 +1,52 @@
+import hashlib
+
 import streamlit as st # type: ignore
-import requests # type: ignore
+import httpx # type: ignore
 import pandas as pd # type: ignore
-from PyPDF2 import PdfReader  # type: ignore #
-import io
+import pyarrow as pa # type: ignore
+
+from api_client import EmotionClient, http_client
 
 
 # Define the FastAPI URL endpoint
 API_URL = "http://127.0.0.1:8000"
-TOKEN_ENDPOINT = f"{API_URL}/token"
-PREDICT_ENDPOINT = f"{API_URL}/predict/"
+# Chunks of texts (or one streamed file) sent to the API at the same time
+API_CONCURRENCY = 4
+
+
+# One pool of keep-alive connections for every session of this UI
+@st.cache_resource
+def shared_http_client():
+    return http_client(API_CONCURRENCY)
+
+def api_client():
+    return EmotionClient(API_URL, st.session_state["access_token"], http=shared_http_client(), concurrency=API_CONCURRENCY)
+
+# Results of an upload, kept across reruns and keyed by the file's hash and
+# the scoring options; the content and the progress callback are left out
+# of the key
+@st.cache_data(show_spinner=False, max_entries=32)
+def score_upload(file_hash: str, file_name: str, form: dict, _content: bytes, _total=None, _on_progress=None):
+    return api_client().predict_file(file_name, _content, on_progress=_on_progress, total=_total, **form)
+
+# Score an upload with a progress bar that moves as results arrive
+def score_with_progress(uploaded_file, form: dict, total=None):
+    content = uploaded_file.getvalue()
+    progress = st.progress(0.0, text="Scoring...")
+
+    def on_progress(done, total):
+        value = min(done / total, 1.0) if total else 0.0
+        progress.progress(value, text=f"{done} results")
+
+    try:
+        results = score_upload(hashlib.sha256(content).hexdigest(), uploaded_file.name, form, content, total, on_progress)
+    except (httpx.HTTPError, pa.ArrowInvalid, ValueError) as e:
+        # Unreachable server, error answer, or a result that cannot be read
+        progress.empty()
+        st.error(f"Prediction failed: {e}")
+        return None
+    progress.progress(1.0, text=f"{len(results)} results")
+    return results
 
 # Initialize session state for authorization and access token
 if "authorized" not in st.session_state:
@@ -23,11 +61,10 @@ password = st.sidebar.text_input("Password", type="password")
 
 if st.sidebar.button("Login and Authorize"):
     # Request an access token from FastAPI using username and password
-    response = requests.post(TOKEN_ENDPOINT, data={"username": username, "password": password}, timeout=100)
-    if response.status_code == 200:
-        access_token = response.json().get("access_token")
+    client = EmotionClient(API_URL, http=shared_http_client())
+    if client.login(username, password):
         st.sidebar.success("Logged in and authorized successfully")
-        st.session_state["access_token"] = access_token
+        st.session_state["access_token"] = client.token
         st.session_state["authorized"] = True
     else:
         st.sidebar.error("Login failed. Please check your credentials.")
@@ -38,30 +75,28 @@ if st.session_state["authorized"]:
 
     file_option = st.radio("Choose input type:", ("Text", "PDF", "TXT", "CSV"))
 
+    uploaded_file = None
+    text_column = None
     if file_option == "Text":
         input_text = st.text_area("Enter text for prediction")
 
     elif file_option in ["PDF", "TXT", "CSV"]:
         uploaded_file = st.file_uploader(f"Upload {file_option} file")
         input_text = None
-
-    predict_response = None
+        if file_option == "CSV" and uploaded_file:
+            # Only the header is read here; the server streams the rows
+            columns = list(pd.read_csv(uploaded_file, nrows=0).columns)
+            text_column = st.selectbox("Text column:", columns)
 
     if st.button("Predict"):
-        # headers = {"Authorization": f"Bearer {client_secret}"}
-        headers = {"Authorization": f"Bearer {st.session_state['access_token']}"}
-
         if file_option == "Text" and input_text:
             # Prediction for text input
-            predict_response = requests.post(
-                PREDICT_ENDPOINT,
-                headers=headers,
-                data={"text": input_text}
-            )
-
-            if predict_response.status_code == 200:
+            try:
+                predictions = api_client().predict_text(input_text)
+            except httpx.HTTPError as e:
+                st.error(f"Prediction failed: {e}")
+            else:
                 st.success("Prediction Result:")
-                predictions = predict_response.json()['predictions'][0]
 
                 # Create dataframe to show text, label, and score
                 result_df = pd.DataFrame([{
@@ -72,90 +107,39 @@ if st.session_state["authorized"]:
                 st.dataframe(result_df)
 
         elif uploaded_file:
+            content = uploaded_file.getvalue()
             if file_option == "PDF":
-                # Extract text from PDF file
-                pdf_reader = PdfReader(io.BytesIO(uploaded_file.read()))
-                full_text = ""
-                for page in pdf_reader.pages:
-                    # page = pdf_reader.getPage(page_num)
-                    full_text += page.extract_text()
-
-                # Split the text into chapters
-                chapters = full_text.split("Chapter ")  # Split by chapter identifier
-                
-                predictions_list = []
-                for chapter in chapters[1:]:  # Skip the first item as it's before "Chapter 1"
-                    chapter_title = "Chapter " + chapter.split("\n")[0]  # Get chapter title
-                    chapter_text = chapter[len(chapter_title):].strip()  # Get chapter content
-
-                    # Make prediction for the entire chapter text
-                    predict_response = requests.post(
-                        PREDICT_ENDPOINT,
-                        headers=headers,
-                        data={"text": chapter_text}
-                    )
-
-                    if predict_response.status_code == 200:
-                        predictions = predict_response.json()['predictions'][0]
-                        for pred in predictions:
-                            predictions_list.append({
-                                "Text": f"{chapter_text[0:70]}...",
-                                "Label": pred.get('label', 'Unknown label'),
-                                "Score": pred.get('score', 'No score')
-                            })
-
-                if predictions_list:
-                    st.dataframe(pd.DataFrame(predictions_list))
-
+                # The server extracts the chapters and streams back one result per chapter
+                results = score_with_progress(uploaded_file, {"unit": "chapter", "include_text": True})
+                if results is not None and len(results):
+                    st.dataframe(pd.DataFrame({
+                        "Text": results["text"].str[:70] + "...",
+                        "Label": results["label"],
+                        "Score": results["score"]
+                    }))
 
             elif file_option == "TXT":
-                # Extract text from TXT file
-                input_text = uploaded_file.read().decode("utf-8")
-                paragraphs = input_text.split("\n\n")  # Split by double newline to simulate paragraphs
-
-                predictions_list = []
-                for paragraph in paragraphs:
-                    predict_response = requests.post(
-                        PREDICT_ENDPOINT,
-                        headers=headers,
-                        data={"text": paragraph}
-                    )
-                    if predict_response.status_code == 200:
-                        predictions = predict_response.json()['predictions'][0]
-                        for pred in predictions:
-                            predictions_list.append({
-                                "Paragraph": paragraph[:50],  # Show only first 50 characters for preview
-                                "Label": pred.get('label', 'Unknown label'),
-                                "Score": pred.get('score', 'No score')
-                            })
-
-                if predictions_list:
-                    st.dataframe(pd.DataFrame(predictions_list))
+                # The server splits the file into paragraphs at blank lines
+                results = score_with_progress(uploaded_file, {"include_text": True}, total=content.count(b"\n\n") + 1)
+                if results is not None and len(results):
+                    st.dataframe(pd.DataFrame({
+                        "Paragraph": results["text"].str[:50],  # Show only first 50 characters for preview
+                        "Label": results["label"],
+                        "Score": results["score"]
+                    }))
 
             elif file_option == "CSV":
-                df = pd.read_csv(uploaded_file)
-
-                predictions_list = []
-                for index, row in df.iterrows():
-                    row_text = ' '.join([str(item) for item in row]) 
-                    predict_response = requests.post(
-                        PREDICT_ENDPOINT,
-                        headers=headers,
-                        data={"text": row_text}
-                    )
-
-                    if predict_response.status_code == 200:
-                        predictions = predict_response.json()['predictions'][0]
-                        label = predictions[0].get('label', 'Unknown label')
-                        score = predictions[0].get('score', 'No score')
-                        predictions_list.append({
-                            "Label": label,
-                            "Score": score
-                        })
-
-                # Combine original dataframe with the prediction results
-                result_df = pd.concat([df, pd.DataFrame(predictions_list)], axis=1)
-                st.dataframe(result_df)
+                # Rows are counted by line breaks, close enough for the progress bar
+                results = score_with_progress(
+                    uploaded_file, {"text_column": text_column, "include_text": True}, total=max(1, content.count(b"\n"))
+                )
+                if results is not None and len(results):
+                    st.dataframe(pd.DataFrame({
+                        "Row": results["id"],
+                        "Text": results["text"].str[:70],
+                        "Label": results["label"],
+                        "Score": results["score"]
+                    }))
 
     # Footer
     st.markdown(
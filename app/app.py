@@ -187,69 +187,122 @@
 
 
 from datetime import datetime, timedelta, timezone
-from typing import Union, Optional
+from typing import Optional
+from contextlib import asynccontextmanager
+from functools import lru_cache
+import asyncio
+import csv
+import io
+import json
+import logging
+import threading
+import time
 # from fastapi import FastAPI
-from fastapi import Depends, FastAPI, HTTPException, status, UploadFile, File, Form # type: ignore
-from fastapi.security import OAuth2PasswordBearer, OAuth2PasswordRequestForm # type: ignore
-from passlib.context import CryptContext # type: ignore
-import jwt # type: ignore
-from jwt import PyJWTError # type: ignore
+from fastapi import Depends, FastAPI, HTTPException, status, UploadFile, File, Form, Request # type: ignore
+from fastapi.security import OAuth2PasswordRequestForm # type: ignore
+from fastapi.responses import JSONResponse, Response, StreamingResponse # type: ignore
+from starlette.concurrency import run_in_threadpool # type: ignore
 from pydantic import BaseModel # type: ignore
-from transformers import pipeline # type: ignore
-import fitz   # type: ignore
-import pandas as pd  # type: ignore
 from dotenv import load_dotenv # type: ignore
+import numpy as np # type: ignore
 import os
+from app.backends import MODEL_BACKEND, LazyClassifier
+from app.batching import BATCH_MAX_SIZE, MicroBatcher
+from app.bucketing import BUCKET_POOL_SIZE, LengthBucketer, token_lengths
+from app.cache import PredictionCache
+from app.chunking import AGGREGATIONS, CHUNK_BATCH_SIZE, aggregate_scores, chunk_text
+from app.dedup import Deduplicator
+from app.decoding import OUTPUTS, compact_scores, decode_scores, labels_of, parse_thresholds
+from app.executors import (
+    EXTRACTION_MAX_PENDING, EXTRACTION_THREADS, INFERENCE_MAX_PENDING, INFERENCE_THREADS, OVERLOAD_RETRY_AFTER,
+    BoundedExecutor, Overloaded,
+)
+from app.extraction import batched, file_format, iter_csv_units, iter_file_units, iter_pdf_pages, spooled_upload
+from app.formats import (
+    BINARY_FORMATS, ENCODERS, MEDIA_TYPES, ArrowStreamEncoder, msgpack_available, msgpack_columns, negotiate,
+    pack_msgpack, result_columns,
+)
+from app.history import INTERVALS, PREDICTION_HISTORY, HistoryStore
+from app.jobs import JOB_RESULTS_PAGE_SIZE, JobRunner, JobStore, job_summary
+from app.metrics import (
+    BATCH_SIZE, CACHE_HIT_RATE, DEDUP_TEXTS, INPUT_TOKENS, LOG_BUFFERED, PREDICTIONS, QUEUE_DEPTH, RequestMetricsMiddleware,
+    render_metrics, stage_timer, timed_iter,
+)
+from app.pipeline import STAGED_INFERENCE, STAGES, BatchScorer, StagedPipeline
+from app.prediction_log import PredictionLog, get_log_writer, prediction_records
+from app.profiling import PROFILE_OUTPUTS, Profiler
+from app.workers import INFERENCE_WORKERS, InferenceWorkerPool
+from auth import (
+    ACCESS_TOKEN_EXPIRE_MINUTES, Identity, api_key_scheme, authenticate_user, bearer_scheme, create_access_token,
+    get_current_admin, get_current_username, get_db, token_cache,
+)
 load_dotenv()
 
-ADMIN_NAME=os.getenv("ADMIN_NAME")
-PASSWORD_ADMIN=os.getenv("PASSWORD_ADMIN")
-USER_NAME=os.getenv("USER_NAME")
-PASSWORD_USER = os.getenv("PASSWORD_USER")
-
-# JWT settings
-SECRET_KEY = os.getenv("SECRET_KEY")
-ALGORITHM = os.getenv("ALGORITHM")
-ACCESS_TOKEN_EXPIRE_MINUTES = 30
-
-# Password hashing context
-pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
-
-app = FastAPI()
-oauth2_scheme = OAuth2PasswordBearer(tokenUrl="token")
-
-# User database
-users_db = {
-    "admin": {"username": ADMIN_NAME, "password": pwd_context.hash(PASSWORD_ADMIN), "role": "admin"},
-    "user": {"username": USER_NAME, "password": pwd_context.hash(PASSWORD_USER), "role": "user"},
-}
-
-
-# Helper functions
-def verify_password(plain_password, hashed_password):
-    return pwd_context.verify(plain_password, hashed_password)
-
-
-def authenticate_user(username: str, password: str):
-    user = users_db.get(username)
-    if not user or not verify_password(password, user["password"]):
-        return False
-    return user
+# Maximum number of texts accepted by a single /predict/batch call
+BATCH_REQUEST_MAX_ITEMS = int(os.getenv("BATCH_REQUEST_MAX_ITEMS", "1000"))
+
+# Number of file units classified per step of /predict/stream
+STREAM_BATCH_SIZE = int(os.getenv("STREAM_BATCH_SIZE", "64"))
+
+# Start loading the model as soon as the server starts, and run one batch
+# through it before reporting ready
+MODEL_PRELOAD = os.getenv("MODEL_PRELOAD", "true").lower() == "true"
+MODEL_WARMUP = os.getenv("MODEL_WARMUP", "true").lower() == "true"
+
+logger = logging.getLogger(__name__)
+
+# The model loads on a background thread so the server answers /health
+# right away; /ready reports when it can take predictions
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    global warmup_thread, event_loop
+    if MODEL_PRELOAD:
+        warmup_thread = threading.Thread(target=warm_up_model, name="model-warmup", daemon=True)
+        warmup_thread.start()
+    prediction_log.start()
+    # Hash the account passwords now rather than on the first login
+    await run_in_threadpool(get_db)
+    event_loop = asyncio.get_running_loop()
+    job_runner.start()
+    yield
+    # Job workers wait on this event loop, so they are stopped off of it
+    await run_in_threadpool(job_runner.close)
+    event_loop = None
+    batcher.close()
+    staged_pipeline.close()
+    prediction_log.close()
+    if inference_pool is not None:
+        inference_pool.close()
+
+app = FastAPI(lifespan=lifespan)
+
+# Blocking work in the request path runs on these bounded pools, never on
+# the event loop, so /health and small requests stay fast under load
+extraction_executor = BoundedExecutor("extraction", EXTRACTION_THREADS, EXTRACTION_MAX_PENDING)
+inference_executor = BoundedExecutor("inference", INFERENCE_THREADS, INFERENCE_MAX_PENDING)
+
+@app.exception_handler(Overloaded)
+async def overloaded_handler(request: Request, exc: Overloaded):
+    return JSONResponse(
+        status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+        content={"detail": str(exc)},
+        headers={"Retry-After": str(OVERLOAD_RETRY_AFTER)},
+    )
 
+# Time every request by route, and count the ones being answered
+app.add_middleware(RequestMetricsMiddleware)
 
-def create_access_token(data: dict, expires_delta: Union[timedelta, None] = None):
-    to_encode = data.copy()
-    if expires_delta:
-        expire = datetime.now(timezone.utc) + expires_delta
-    else:
-        expire = datetime.now(timezone.utc) + timedelta(minutes=15)
-    to_encode.update({"exp": expire})
-    encoded_jwt = jwt.encode(to_encode, SECRET_KEY, algorithm=ALGORITHM)
-    return encoded_jwt
+# The shared auth dependency, timed
+async def authenticated_username(
+    token: Optional[str] = Depends(bearer_scheme), api_key: Optional[str] = Depends(api_key_scheme)
+) -> Identity:
+    with stage_timer("auth"):
+        return await get_current_username(token, api_key)
 
 @app.post("/token")
 async def login(form_data: OAuth2PasswordRequestForm = Depends()):
-    user = authenticate_user(form_data.username, form_data.password)
+    # bcrypt is deliberately slow, keep it off the event loop
+    user = await run_in_threadpool(authenticate_user, form_data.username, form_data.password)
     if not user:
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
@@ -258,47 +311,270 @@ async def login(form_data: OAuth2PasswordRequestForm = Depends()):
         )
     access_token_expires = timedelta(minutes=ACCESS_TOKEN_EXPIRE_MINUTES)
     access_token = create_access_token(
-        data={"sub": user["username"]}, expires_delta=access_token_expires
+        data={"sub": user.username}, expires_delta=access_token_expires
     )
     return {"access_token": access_token, "token_type": "bearer"}
 
 
-def decode_token(token: str):
+# The text-classification model, loaded on first use
+MODEL_NAME = "SamLowe/roberta-base-go_emotions"
+TOP_K = 1
+classifier = LazyClassifier(MODEL_NAME, TOP_K)
+warmup_thread = None
+
+WARMUP_TEXTS = ["Warming up the emotion model.", "This product is great, I love it!"]
+
+# The model called for score matrices (texts, labels) instead of
+# per-label dicts; responses are decoded from those
+scorer = BatchScorer(classifier)
+
+# Optional pool of inference processes forked from this one after the model
+# is loaded, so they share its weights
+inference_pool = InferenceWorkerPool(scorer) if INFERENCE_WORKERS > 0 else None
+
+# The model's labels, in the column order of its score matrices
+@lru_cache(maxsize=1)
+def model_labels() -> list:
+    return labels_of(classifier)
+
+# Function that loads the model and runs a first batch through it
+def warm_up_model():
     try:
-        payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
-        username: str = payload.get("sub")
-        if username is None:
-            raise HTTPException(
-                status_code=status.HTTP_401_UNAUTHORIZED, detail="Invalid token"
-            )
-        return username
-    except PyJWTError:
-        raise HTTPException(
-            status_code=status.HTTP_401_UNAUTHORIZED, detail="Invalid token"
-        )
+        classifier.load()
+        if MODEL_WARMUP:
+            classifier(WARMUP_TEXTS, batch_size=len(WARMUP_TEXTS))
+        if inference_pool is not None:
+            inference_pool.start()
+    except Exception as e:
+        logger.error(f"Error loading the model: {e}")
+
+# Admin-controlled profiling of the model calls, off unless a session runs
+profiler = Profiler()
+
+# Function that scores one model batch, in a worker process when there are
+# any; texts past the model's 512 tokens are truncated (see long_document mode)
+def run_model(texts: list):
+    BATCH_SIZE.observe(len(texts))
+    with stage_timer("model"), profiler.capture():
+        if inference_pool is not None:
+            return inference_pool.predict(texts)
+        return scorer(texts, truncation=True)
+
+# In-process inference split into tokenize, forward and postprocess stages
+# (worker processes run their batches whole), profiled around the forward pass
+staged_pipeline = StagedPipeline(classifier, forward_context=profiler.capture)
+
+# Function that queues one model batch on the staged pipeline
+def submit_model(texts: list):
+    BATCH_SIZE.observe(len(texts))
+    return staged_pipeline.submit(texts, truncation=True)
+
+# Function that counts each text's model input tokens, for bucketing
+def measure_token_lengths(texts: list) -> list:
+    with stage_timer("tokenize"):
+        lengths = token_lengths(classifier.tokenizer, texts)
+    for length in lengths:
+        INPUT_TOKENS.observe(length)
+    return lengths
+
+# Batch concurrent requests together, then split each pool of queued texts
+# into length buckets so short texts are not padded to the longest one
+bucketer = LengthBucketer(
+    run_model,
+    measure_token_lengths,
+    BATCH_MAX_SIZE,
+    submit_fn=submit_model if STAGED_INFERENCE and inference_pool is None else None,
+)
+batcher = MicroBatcher(
+    bucketer,
+    max_batch_size=max(BUCKET_POOL_SIZE, BATCH_MAX_SIZE),
+    concurrency=max(1, INFERENCE_WORKERS),
+)
+
+# Append-only log of every prediction, written in the background; closed
+# hours are compacted into the Parquet history behind the /history endpoints
+history_store = HistoryStore()
+prediction_log = PredictionLog(get_log_writer(), history=history_store if PREDICTION_HISTORY else None)
+
+# Cache of the score rows of recent texts, checked before anything is sent
+# to the model; every label is kept, so one entry serves any output option.
+# Entries are keyed by backend too, so a SQLite file shared by workers
+# running different backends never serves one backend's scores to another
+prediction_cache = PredictionCache(f"{MODEL_NAME}@{MODEL_BACKEND}")
+
+# Labels without loading the model on the event loop
+async def current_labels() -> list:
+    return model_labels() if classifier.loaded else await run_in_threadpool(model_labels)
+
+# Calls the prediction cache; with a SQLite tier its lookups and writes
+# block, so they run in the thread pool instead of on the event loop
+async def cache_call(function, *args):
+    return await run_in_threadpool(function, *args) if prediction_cache.disk else function(*args)
+
+# Function that scores a list of texts, only sending cache misses to the
+# model; returns a (texts, labels) matrix
+async def score_texts(texts: list):
+    rows = await cache_call(prediction_cache.get_many, texts)
+    missing = [i for i, row in enumerate(rows) if row is None]
+    if missing:
+        missing_texts = [texts[i] for i in missing]
+        fresh = await batcher.predict_many(missing_texts)
+        await cache_call(prediction_cache.set_many, missing_texts, fresh)
+        for i, row in zip(missing, fresh):
+            rows[i] = row
+    labels = await current_labels()
+    return np.asarray(rows, dtype=np.float32).reshape(len(texts), len(labels))
+
+# Function that scores a list of texts once per distinct (normalized) text;
+# `dedup` remembers the texts of an upload already scored in earlier batches
+async def predict_texts(texts: list, dedup: Deduplicator = None):
+    dedup = dedup if dedup is not None else Deduplicator(0)
+    scored_before = dedup.scored
+    scores = await dedup.score(texts, score_texts)
+    scored = dedup.scored - scored_before
+    DEDUP_TEXTS.labels(outcome="scored").inc(scored)
+    DEDUP_TEXTS.labels(outcome="duplicate").inc(len(texts) - scored)
+    return scores
+
+# Headers reporting how many of a request's texts were duplicates
+def dedup_headers(dedup: Deduplicator) -> dict:
+    summary = dedup.summary()
+    return {
+        "X-Dedup-Units": str(summary["units"]),
+        "X-Dedup-Scored": str(summary["scored"]),
+        "X-Dedup-Ratio": f"{summary['duplicate_ratio']:.4f}",
+    }
+
+# Function that checks a request's output options: at most `top_k` labels
+# (TOP_K, or every label when a threshold is given), each reaching its
+# threshold, or with output=scores the whole distribution as float arrays
+def output_options(top_k: Optional[int], threshold: Optional[str], output: str, labels: list) -> dict:
+    if output not in OUTPUTS:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=f"Unsupported output. Please use one of: {', '.join(OUTPUTS)}.")
+    if top_k is not None and top_k < 1:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="top_k must be at least 1")
+    try:
+        thresholds = parse_thresholds(threshold, labels) if threshold else None
+    except ValueError as e:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=str(e))
+    if top_k is None and thresholds is None:
+        top_k = TOP_K
+    return {"top_k": top_k, "thresholds": thresholds, "output": output}
+
+# Function that turns a score matrix into each text's predictions, or into
+# compact score arrays for output=scores
+def render_predictions(scores, options: dict) -> list:
+    if options["output"] == "scores":
+        return compact_scores(scores)
+    return decode_scores(scores, model_labels(), options["top_k"], options["thresholds"])
+
+# Function that picks a response format from the request's Accept header,
+# among `formats` (the first one when none of them is asked for)
+def response_format(request: Request, formats: tuple) -> str:
+    formats = [name for name in formats if name != "msgpack" or msgpack_available()]
+    return negotiate(request.headers.get("accept"), formats) or formats[0]
+
+# Bulk scoring jobs run on their own worker threads and send each batch
+# through predict_texts on the server's event loop, so they share the
+# cache, the micro-batcher and its backpressure with interactive requests
+event_loop = None
+
+def predict_job_batch(job: dict, texts: list) -> list:
+    if event_loop is None:
+        raise RuntimeError("The server is not running")
+    request_time = datetime.now(timezone.utc)
+    start_time = time.perf_counter()
+    scores = asyncio.run_coroutine_threadsafe(predict_texts(texts, job.get("dedup")), event_loop).result()
+    record_predictions("job", job["username"], request_time, start_time, texts, scores)
+    options = job["options"]
+    return decode_scores(
+        scores, model_labels(), options.get("top_k", TOP_K),
+        parse_thresholds(options["threshold"], model_labels()) if options.get("threshold") else None,
+    )
 
-# Load the text-classification model
-classifier = pipeline(task="text-classification", model="SamLowe/roberta-base-go_emotions", top_k=1)
+job_store = JobStore()
+job_runner = JobRunner(job_store, predict_job_batch)
+
+# Function that logs and counts the predictions of one request or batch;
+# the log keeps each text's top label, whatever the request asked for
+def record_predictions(source: str, username: str, request_time: datetime, start_time: float, texts: list, scores):
+    PREDICTIONS.labels(source=source).inc(len(texts))
+    predictions = decode_scores(scores, model_labels(), 1)
+    prediction_log.log(prediction_records(username, request_time, time.perf_counter() - start_time, texts, predictions))
+
+# Function that classifies a long document window by window and combines the
+# per-window scores into one document-level distribution; returns the
+# response and the document's score row
+def predict_long_document(input_text: str, aggregation: str = "mean", return_chunks: bool = False, options: dict = None) -> dict:
+    options = options or output_options(None, None, "labels", model_labels())
+    with stage_timer("tokenize"):
+        chunks = chunk_text(input_text, classifier.tokenizer)
+    texts = [chunk["text"] for chunk in chunks]
+    with stage_timer("model"), profiler.capture():
+        chunk_scores = np.concatenate([
+            scorer(texts[start:start + CHUNK_BATCH_SIZE], truncation=True)
+            for start in range(0, len(texts), CHUNK_BATCH_SIZE)
+        ])
+    distribution = aggregate_scores(chunk_scores, [chunk["tokens"] for chunk in chunks], aggregation)
+
+    key = "scores" if options["output"] == "scores" else "predictions"
+    document = {"aggregation": aggregation, "chunks": len(chunks)}
+    if options["output"] == "scores":
+        document["scores"] = compact_scores(distribution)
+    else:
+        document["distribution"] = decode_scores(distribution, model_labels(), None)[0]
+    result = {key: render_predictions(distribution[None], options), "document": document}
+    if return_chunks:
+        result["chunks"] = [
+            {"start": chunk["start"], "end": chunk["end"], "tokens": chunk["tokens"], key: rendered}
+            for chunk, rendered in zip(chunks, render_predictions(chunk_scores, options))
+        ]
+    return result, distribution[None]
 
 # Function that extract text from PDF
-def extract_text_from_pdf(file: UploadFile) -> str:
-    with fitz.open(stream=file.file.read(), filetype="pdf") as doc:
-        text = ""
-        for page in doc:
-            text += page.get_text()
-    return text
+def extract_text_from_pdf(file: UploadFile, first_page: int = None, last_page: int = None) -> str:
+    with spooled_upload(file, ".pdf") as path, stage_timer("extract", "pdf"):
+        return "".join(text for _, text in iter_pdf_pages(path, first_page, last_page))
 
 # Function that extract text from TXT file
 def extract_text_from_txt(file: UploadFile) -> str:
-    text = file.file.read().decode("utf-8")
+    with stage_timer("file_read", "txt"):
+        data = file.file.read()
+    with stage_timer("extract", "txt"):
+        text = data.decode("utf-8")
     return text
 
 # Function that extract text from CSV file (assume text is in a single column)
 def extract_text_from_csv(file: UploadFile) -> str:
-    df = pd.read_csv(file.file)
     # Assuming the text is in the first column, concatenate all rows
-    text = " ".join(df.iloc[:, 0].astype(str).tolist())
-    return text
+    with stage_timer("extract", "csv"):
+        return " ".join(text for _, text in iter_csv_units(file))
+
+# Function that parses a batch body: a JSON array or NDJSON lines, where each
+# item is either a plain string or an object with "text" and an optional "id"
+def parse_batch_items(body: bytes, content_type: str = "") -> list:
+    try:
+        if "ndjson" in content_type or "jsonlines" in content_type:
+            raw_items = [json.loads(line) for line in body.decode("utf-8").splitlines() if line.strip()]
+        else:
+            raw_items = json.loads(body)
+    except (UnicodeDecodeError, json.JSONDecodeError):
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Body must be a JSON array or NDJSON")
+    if not isinstance(raw_items, list):
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Body must be a JSON array or NDJSON")
+
+    items = []
+    for index, item in enumerate(raw_items):
+        if isinstance(item, str):
+            items.append((index, item))
+        elif isinstance(item, dict) and isinstance(item.get("text"), str):
+            items.append((item.get("id", index), item["text"]))
+        else:
+            raise HTTPException(
+                status_code=status.HTTP_400_BAD_REQUEST,
+                detail=f"Item {index} must be a string or an object with a 'text' field",
+            )
+    return items
 
 @app.get("/")
 def read_root():
@@ -308,31 +584,357 @@ def read_root():
 async def predict(
     text: Optional[str] = Form(None), 
     file: Optional[UploadFile] = File(None),
-    token: str = Depends(oauth2_scheme)
+    long_document: bool = Form(False),
+    aggregation: str = Form("mean"),
+    return_chunks: bool = Form(False),
+    first_page: Optional[int] = Form(None),
+    last_page: Optional[int] = Form(None),
+    top_k: Optional[int] = Form(None),
+    threshold: Optional[str] = Form(None),
+    output: str = Form("labels"),
+    username: str = Depends(authenticated_username)
 ):
     input_text = None
 
+    request_time = datetime.now(timezone.utc)
+    start_time = time.perf_counter()
+
+    if long_document and aggregation not in AGGREGATIONS:
+        return {"error": f"Unsupported aggregation. Please use one of: {', '.join(AGGREGATIONS)}."}
+    options = output_options(top_k, threshold, output, await current_labels())
+
     if text:
         # If text is provided, use it
         input_text = text
     elif file:
         # Check file type and extract text
         if file.filename.endswith(".pdf"):
-            input_text = extract_text_from_pdf(file)
+            input_text = await extraction_executor.run(extract_text_from_pdf, file, first_page, last_page)
         elif file.filename.endswith(".txt"):
-            input_text = extract_text_from_txt(file)
+            input_text = await extraction_executor.run(extract_text_from_txt, file)
         elif file.filename.endswith(".csv"):
-            input_text = extract_text_from_csv(file)
+            input_text = await extraction_executor.run(extract_text_from_csv, file)
         else:
             return {"error": "Unsupported file type. Please upload a PDF, TXT, or CSV file."}
     else:
         return {"error": "Please provide a text or upload a file for prediction"}
 
-    # Emotions prediction
-    predictions = classifier(input_text)
+    # Long documents are split into token windows instead of being truncated
+    if long_document:
+        result, scores = await inference_executor.run(predict_long_document, input_text, aggregation, return_chunks, options)
+    else:
+        # Emotions prediction
+        scores = await predict_texts([input_text])
+        result = {"scores" if output == "scores" else "predictions": render_predictions(scores, options)}
+    if output == "scores":
+        result = {"labels": model_labels(), **result}
+
+    record_predictions("predict", username, request_time, start_time, [input_text], scores)
+    return result
+
+@app.post("/predict/batch")
+async def predict_batch(
+    request: Request,
+    top_k: Optional[int] = None,
+    threshold: Optional[str] = None,
+    output: str = "labels",
+    username: str = Depends(authenticated_username),
+):
+    request_time = datetime.now(timezone.utc)
+    start_time = time.perf_counter()
+    options = output_options(top_k, threshold, output, await current_labels())
+    response_type = response_format(request, ("json",) + BINARY_FORMATS)
+
+    items = parse_batch_items(await request.body(), request.headers.get("content-type", ""))
+    if len(items) > BATCH_REQUEST_MAX_ITEMS:
+        raise HTTPException(
+            status_code=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE,
+            detail=f"At most {BATCH_REQUEST_MAX_ITEMS} texts per batch request",
+        )
 
-    return {"predictions": predictions}
+    texts = [text for _, text in items]
+    dedup = Deduplicator()
+    scores = await predict_texts(texts, dedup)
+    record_predictions("batch", username, request_time, start_time, texts, scores)
+
+    # Binary formats are columnar: label IDs into the label list, float32 scores
+    headers = {"Vary": "Accept", **dedup_headers(dedup)}
+    with stage_timer("serialize"):
+        if response_type in BINARY_FORMATS:
+            columns = result_columns([item_id for item_id, _ in items], scores, model_labels(), options)
+            content = ENCODERS[response_type](columns, model_labels())
+            return Response(content=content, media_type=MEDIA_TYPES[response_type], headers=headers)
+        if output == "scores":
+            return JSONResponse({"labels": model_labels(), "results": [
+                {"id": item_id, "scores": row}
+                for (item_id, _), row in zip(items, compact_scores(scores))
+            ], "dedup": dedup.summary()}, headers=headers)
+        return JSONResponse({"results": [
+            {"id": item_id, "predictions": prediction}
+            for (item_id, _), prediction in zip(items, render_predictions(scores, options))
+        ], "dedup": dedup.summary()}, headers=headers)
+
+# Function that writes one streamed result as a CSV row with its top label
+def format_csv_line(content: dict) -> str:
+    buffer = io.StringIO()
+    if "error" in content:
+        csv.writer(buffer).writerow(["", "error", content["error"]])
+    else:
+        top = content["predictions"][0] if content["predictions"] else {}
+        csv.writer(buffer).writerow([content["id"], top.get("label", ""), top.get("score", "")])
+    return buffer.getvalue().replace("\r\n", "\n")
+
+STREAM_FORMATS = ("ndjson", "sse", "csv", "arrow", "msgpack")
+
+@app.post("/predict/stream")
+async def predict_stream(
+    request: Request,
+    file: UploadFile = File(...),
+    unit: str = Form("page"),
+    format: Optional[str] = Form(None),
+    include_text: bool = Form(False),
+    first_page: Optional[int] = Form(None),
+    last_page: Optional[int] = Form(None),
+    text_column: Optional[str] = Form(None),
+    id_column: Optional[str] = Form(None),
+    top_k: Optional[int] = Form(None),
+    threshold: Optional[str] = Form(None),
+    output: str = Form("labels"),
+    username: str = Depends(authenticated_username)
+):
+
+    units = iter_file_units(file, unit, first_page, last_page, text_column, id_column)
+    if units is None:
+        return {"error": "Unsupported file type. Please upload a PDF, TXT, or CSV file."}
+    options = output_options(top_k, threshold, output, await current_labels())
+    format = format or response_format(request, STREAM_FORMATS)
+    if format not in STREAM_FORMATS:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=f"Unsupported format. Please use one of: {', '.join(STREAM_FORMATS)}.")
+    if format == "msgpack" and not msgpack_available():
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="format=msgpack needs the msgpack package")
+    if output == "scores" and format == "csv":
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="output=scores is not available with format=csv")
+
+    def format_line(content: dict) -> str:
+        with stage_timer("serialize", format):
+            if format == "csv":
+                return format_csv_line(content)
+            line = json.dumps(content)
+            return f"data: {line}\n\n" if format == "sse" else line + "\n"
+
+    # Units are read off the event loop and classified one batch at a time,
+    # so results go out while the rest of the file is still being read. The
+    # first batch is read before answering, so an overloaded server can
+    # still reply 503 instead of starting the stream.
+    batches = extraction_executor.iterate(
+        timed_iter(batched(units, STREAM_BATCH_SIZE), "extract", file_format(file.filename))
+    )
+    try:
+        first_batch = await anext(batches, None)
+    except ValueError as e:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=str(e))
+
+    # The binary formats send one columnar chunk per batch: an Arrow record
+    # batch, or a MessagePack map after a first one holding the labels
+    arrow = ArrowStreamEncoder(model_labels(), options, include_text) if format == "arrow" else None
+    # Repeated units of the file are scored once
+    dedup = Deduplicator()
+
+    def format_batch(batch: list, scores) -> bytes:
+        with stage_timer("serialize", format):
+            texts = [text for _, text in batch] if include_text else None
+            columns = result_columns([unit_id for unit_id, _ in batch], scores, model_labels(), options, texts)
+            return arrow.encode(columns) if arrow is not None else pack_msgpack({"columns": msgpack_columns(columns)})
+
+    async def stream_results():
+        if format == "csv":
+            yield "id,label,score\n"
+        elif format == "msgpack":
+            yield pack_msgpack({"labels": model_labels()})
+        batch = first_batch
+        while batch is not None:
+            request_time = datetime.now(timezone.utc)
+            start_time = time.perf_counter()
+            texts = [text for _, text in batch]
+            try:
+                scores = await predict_texts(texts, dedup)
+            except Overloaded as e:
+                # An Arrow stream cannot carry the error; it is cut short instead
+                if arrow is not None:
+                    raise
+                yield pack_msgpack({"error": str(e)}) if format == "msgpack" else format_line({"error": str(e)})
+                return
+            record_predictions("stream", username, request_time, start_time, texts, scores)
+            if format in BINARY_FORMATS:
+                yield format_batch(batch, scores)
+            else:
+                key = "scores" if output == "scores" else "predictions"
+                for (unit_id, text), prediction in zip(batch, render_predictions(scores, options)):
+                    result = {"id": unit_id, key: prediction}
+                    if include_text:
+                        result["text"] = text
+                    yield format_line(result)
+            batch = await anext(batches, None)
+        if arrow is not None:
+            yield arrow.close()
+
+    media_type = MEDIA_TYPES[format]
+    # With output=scores each line holds bare arrays; the header names their columns
+    headers = {"X-Score-Labels": ",".join(model_labels())} if output == "scores" and format not in BINARY_FORMATS else None
+    return StreamingResponse(stream_results(), media_type=media_type, headers=headers)
+
+@app.post("/jobs", status_code=status.HTTP_202_ACCEPTED)
+async def create_job(
+    file: UploadFile = File(...),
+    unit: str = Form("page"),
+    first_page: Optional[int] = Form(None),
+    last_page: Optional[int] = Form(None),
+    text_column: Optional[str] = Form(None),
+    id_column: Optional[str] = Form(None),
+    top_k: Optional[int] = Form(None),
+    threshold: Optional[str] = Form(None),
+    username: Identity = Depends(authenticated_username)
+):
+    if not file.filename.endswith((".pdf", ".txt", ".csv")):
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="Unsupported file type. Please upload a PDF, TXT, or CSV file.",
+        )
+    top_k = output_options(top_k, threshold, "labels", await current_labels())["top_k"]
+    options = {
+        "unit": unit, "first_page": first_page, "last_page": last_page,
+        "text_column": text_column, "id_column": id_column, "top_k": top_k, "threshold": threshold,
+    }
+    job_id = await extraction_executor.run(job_store.create, username, file, options, username.via_api_key)
+    job_runner.submit(job_id)
+    return {"id": job_id, "status": "queued"}
+
+# Function that loads a job, hiding the jobs of other users and of API
+# keys sharing their name
+async def get_user_job(job_id: str, username: Identity) -> dict:
+    job = await run_in_threadpool(job_store.get, job_id)
+    if job is None or (job["username"], bool(job["via_api_key"])) != (username, username.via_api_key):
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Job not found")
+    return job
+
+@app.get("/jobs/{job_id}")
+async def get_job(job_id: str, username: Identity = Depends(authenticated_username)):
+    return job_summary(await get_user_job(job_id, username))
+
+@app.get("/jobs/{job_id}/results")
+async def get_job_results(
+    job_id: str,
+    offset: int = 0,
+    limit: int = JOB_RESULTS_PAGE_SIZE,
+    username: Identity = Depends(authenticated_username)
+):
+    job = await get_user_job(job_id, username)
+    offset, limit = max(0, offset), max(1, min(limit, JOB_RESULTS_PAGE_SIZE))
+    results = await run_in_threadpool(job_store.results, job_id, offset, limit)
+    more = len(results) == limit or job["status"] in ("queued", "running")
+    return {
+        "id": job_id,
+        "status": job["status"],
+        "offset": offset,
+        "results": results,
+        "next_offset": offset + len(results) if more else None,
+    }
+
+@app.get("/cache/stats")
+def cache_stats(username: str = Depends(authenticated_username)):
+    return prediction_cache.stats()
+
+@app.get("/batching/stats")
+def batching_stats(username: str = Depends(authenticated_username)):
+    return dict(bucketer.stats.summary(), pipeline=staged_pipeline.stats())
+
+# Time range of a history query, the last 7 days unless given
+def history_range(start: Optional[datetime], end: Optional[datetime]):
+    end = end or datetime.now(timezone.utc)
+    return start or end - timedelta(days=7), end
+
+@app.get("/history/labels")
+async def history_labels(
+    start: Optional[datetime] = None,
+    end: Optional[datetime] = None,
+    interval: str = "day",
+    username: str = Depends(authenticated_username)
+):
+    if interval not in INTERVALS:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=f"Unsupported interval. Please use one of: {', '.join(INTERVALS)}.",
+        )
+    start, end = history_range(start, end)
+    return {"interval": interval, "periods": await run_in_threadpool(history_store.label_distribution, start, end, interval)}
+
+@app.get("/history/users")
+async def history_users(start: Optional[datetime] = None, end: Optional[datetime] = None, username: str = Depends(authenticated_username)):
+    start, end = history_range(start, end)
+    return {"users": await run_in_threadpool(history_store.user_volume, start, end)}
+
+@app.get("/history/latency")
+async def history_latency(start: Optional[datetime] = None, end: Optional[datetime] = None, username: str = Depends(authenticated_username)):
+    start, end = history_range(start, end)
+    return await run_in_threadpool(history_store.latency_percentiles, start, end)
+
+@app.post("/admin/profile")
+def start_profile(
+    mode: str = Form("cprofile"),
+    calls: int = Form(20),
+    seconds: float = Form(30),
+    torch_ops: bool = Form(False),
+    memory: bool = Form(False),
+    username: str = Depends(get_current_admin)
+):
+    try:
+        return profiler.start(mode, calls, seconds, torch_ops, memory)
+    except ValueError as e:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=str(e))
+    except RuntimeError as e:
+        raise HTTPException(status_code=status.HTTP_409_CONFLICT, detail=str(e))
+
+@app.get("/admin/profile")
+def profile_status(username: str = Depends(get_current_admin)):
+    return profiler.status()
+
+@app.delete("/admin/profile")
+def stop_profile(username: str = Depends(get_current_admin)):
+    return profiler.stop()
+
+@app.get("/admin/profile/{output}")
+def download_profile(output: str, username: str = Depends(get_current_admin)):
+    content = profiler.output(output) if output in PROFILE_OUTPUTS else None
+    if content is None:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail=f"No {output} output, is a session finished?")
+    filename, media_type = PROFILE_OUTPUTS[output]
+    return Response(content=content, media_type=media_type, headers={"Content-Disposition": f"attachment; filename={filename}"})
+
+# Queue depths and cache hit rates are read from their owners when scraped
+QUEUE_DEPTH.labels(queue="inference_batcher").set_function(lambda: batcher.queue_depth)
+QUEUE_DEPTH.labels(queue="extraction").set_function(lambda: extraction_executor.pending)
+QUEUE_DEPTH.labels(queue="inference").set_function(lambda: inference_executor.pending)
+for stage in STAGES:
+    QUEUE_DEPTH.labels(queue=f"model_{stage}").set_function(lambda stage=stage: staged_pipeline.queue_depth(stage))
+CACHE_HIT_RATE.labels(cache="predictions").set_function(lambda: prediction_cache.stats()["hit_rate"])
+CACHE_HIT_RATE.labels(cache="auth_tokens").set_function(lambda: token_cache.stats()["hit_rate"])
+LOG_BUFFERED.set_function(lambda: prediction_log.stats()["buffered"])
+
+@app.get("/metrics")
+def metrics():
+    content, content_type = render_metrics()
+    return Response(content=content, media_type=content_type)
 
 @app.get("/health")
 def health():
-    return {"status": "up and running"}
\ No newline at end of file
+    return {"status": "up and running"}
+
+@app.get("/ready")
+def ready():
+    warming_up = warmup_thread is not None and warmup_thread.is_alive()
+    if not classifier.loaded or warming_up:
+        content = {"status": "loading"}
+        if classifier.error:
+            content["error"] = classifier.error
+        return JSONResponse(status_code=status.HTTP_503_SERVICE_UNAVAILABLE, content=content)
+    return {"status": "ready", "model": MODEL_NAME, "backend": MODEL_BACKEND}
\ No newline at end of file
@@ -0,0 +1,261 @@
+import hashlib
+import importlib
+import os
+import re
+import threading
+import zlib
+
+from app.decoding import decode_scores
+
+# Inference backend chosen at startup: "pytorch" (eager), "pytorch-int8"
+# (dynamically quantized linear layers), "onnx" (ONNX Runtime), "tiny" (a
+# small randomly initialized model of the same architecture), "stub" (a
+# deterministic stand-in without torch), or "module:function" for a
+# factory called with the model name and top_k
+MODEL_BACKEND = os.getenv("MODEL_BACKEND", "pytorch")
+# Where the ONNX export is read from, and written to on first use
+ONNX_MODEL_DIR = os.getenv("ONNX_MODEL_DIR", "onnx_model")
+
+BACKENDS = ("pytorch", "pytorch-int8", "onnx", "tiny", "stub")
+
+# Labels of the go_emotions model, in its output order
+GO_EMOTIONS_LABELS = (
+    "admiration", "amusement", "anger", "annoyance", "approval", "caring", "confusion", "curiosity",
+    "desire", "disappointment", "disapproval", "disgust", "embarrassment", "excitement", "fear",
+    "gratitude", "grief", "joy", "love", "nervousness", "optimism", "pride", "realization", "relief",
+    "remorse", "sadness", "surprise", "neutral",
+)
+# Size of the "tiny" backend's model; its vocabulary, labels and tokenizer
+# are the real model's, its weights are random
+TINY_MODEL_CONFIG = {"hidden_size": 64, "num_hidden_layers": 2, "num_attention_heads": 2, "intermediate_size": 128}
+
+# Short product reviews used to check that every backend agrees on the top label
+REFERENCE_TEXTS = [
+    "I am so happy with this purchase!",
+    "This is the worst product I have ever bought.",
+    "Thank you so much, the support team was amazing.",
+    "I'm not sure how this is supposed to work.",
+    "The package arrived late and the box was crushed.",
+    "Wow, I did not expect it to be this good.",
+    "It's okay, nothing special.",
+    "I love the color and the fit is perfect.",
+    "Why does it stop charging after two days?",
+    "I'm scared the battery might catch fire.",
+    "So disappointed, it broke after one use.",
+    "This made my day, highly recommend it!",
+    "Honestly, what a waste of money.",
+    "I feel bad for returning it, but it didn't fit.",
+    "Great value for the price.",
+    "I'm curious whether the new version fixes the noise.",
+]
+
+_DEFAULT_TOP_K = object()
+
+
+# Function that loads the text-classification model for the given backend;
+# every backend is called like a transformers pipeline and returns the same
+# list of {"label", "score"} dicts per text
+def load_classifier(model_name: str, top_k=1, backend: str = MODEL_BACKEND):
+    if backend == "stub":
+        return StubClassifier(top_k=top_k)
+    if ":" in backend:
+        module_name, _, factory = backend.partition(":")
+        return getattr(importlib.import_module(module_name), factory)(model_name, top_k)
+    from transformers import pipeline # type: ignore
+
+    if backend == "pytorch":
+        return pipeline(task="text-classification", model=model_name, top_k=top_k)
+    if backend == "pytorch-int8":
+        import torch # type: ignore
+        from transformers import AutoModelForSequenceClassification, AutoTokenizer # type: ignore
+
+        model = AutoModelForSequenceClassification.from_pretrained(model_name).eval()
+        model = torch.quantization.quantize_dynamic(model, {torch.nn.Linear}, dtype=torch.qint8)
+        tokenizer = AutoTokenizer.from_pretrained(model_name)
+        return pipeline(task="text-classification", model=model, tokenizer=tokenizer, top_k=top_k)
+    if backend == "onnx":
+        if not os.path.exists(os.path.join(ONNX_MODEL_DIR, "model.onnx")):
+            export_onnx(model_name, ONNX_MODEL_DIR)
+        return OnnxClassifier(ONNX_MODEL_DIR, top_k=top_k)
+    if backend == "tiny":
+        import torch # type: ignore
+        from transformers import AutoConfig, AutoModelForSequenceClassification, AutoTokenizer # type: ignore
+
+        # An offline test backend: the config and tokenizer come from the
+        # local Hub cache only, never the network
+        config = AutoConfig.from_pretrained(model_name, local_files_only=True)
+        config.update(TINY_MODEL_CONFIG)
+        torch.manual_seed(0)
+        model = AutoModelForSequenceClassification.from_config(config).eval()
+        tokenizer = AutoTokenizer.from_pretrained(model_name, local_files_only=True)
+        return pipeline(task="text-classification", model=model, tokenizer=tokenizer, top_k=top_k)
+    raise ValueError(f"Unknown model backend '{backend}', expected one of {', '.join(BACKENDS)}")
+
+
+# Classifier that loads the model on first use; concurrent first calls wait
+# for a single load instead of each loading their own copy
+class LazyClassifier:
+    def __init__(self, model_name: str, top_k=1, backend: str = MODEL_BACKEND):
+        self.model_name = model_name
+        self.top_k = top_k
+        self.backend = backend
+        self.error = None
+        self._classifier = None
+        self._lock = threading.Lock()
+
+    @property
+    def loaded(self) -> bool:
+        return self._classifier is not None
+
+    def load(self):
+        if self._classifier is None:
+            with self._lock:
+                if self._classifier is None:
+                    try:
+                        self._classifier = load_classifier(self.model_name, self.top_k, self.backend)
+                        self.error = None
+                    except Exception as e:
+                        self.error = str(e)
+                        raise
+        return self._classifier
+
+    @property
+    def tokenizer(self):
+        return self.load().tokenizer
+
+    def __call__(self, *args, **kwargs):
+        return self.load()(*args, **kwargs)
+
+
+# Function that exports the model to ONNX with dynamic batch and sequence axes
+def export_onnx(model_name: str, output_dir: str):
+    import torch # type: ignore
+    from transformers import AutoModelForSequenceClassification, AutoTokenizer # type: ignore
+
+    model = AutoModelForSequenceClassification.from_pretrained(model_name).eval()
+    tokenizer = AutoTokenizer.from_pretrained(model_name)
+    sample = tokenizer(["export sample"], return_tensors="pt")
+
+    os.makedirs(output_dir, exist_ok=True)
+    torch.onnx.export(
+        model,
+        (sample["input_ids"], sample["attention_mask"]),
+        os.path.join(output_dir, "model.onnx"),
+        input_names=["input_ids", "attention_mask"],
+        output_names=["logits"],
+        dynamic_axes={
+            "input_ids": {0: "batch", 1: "sequence"},
+            "attention_mask": {0: "batch", 1: "sequence"},
+            "logits": {0: "batch"},
+        },
+        opset_version=17,
+        dynamo=False,
+    )
+    tokenizer.save_pretrained(output_dir)
+    model.config.save_pretrained(output_dir)
+
+
+# ONNX Runtime classifier with the call signature and output format of the
+# transformers text-classification pipeline
+class OnnxClassifier:
+    def __init__(self, model_dir: str, top_k=1):
+        import onnxruntime as ort # type: ignore
+        from transformers import AutoConfig, AutoTokenizer # type: ignore
+
+        self.tokenizer = AutoTokenizer.from_pretrained(model_dir)
+        self.config = AutoConfig.from_pretrained(model_dir)
+        self.top_k = top_k
+        self.session = ort.InferenceSession(os.path.join(model_dir, "model.onnx"), providers=["CPUExecutionProvider"])
+        self.input_names = [model_input.name for model_input in self.session.get_inputs()]
+        # Same rule the pipeline uses to pick sigmoid or softmax
+        self.multi_label = self.config.problem_type == "multi_label_classification" or self.config.num_labels == 1
+
+    @property
+    def labels(self) -> list:
+        return [self.config.id2label[i] for i in range(len(self.config.id2label))]
+
+    def __call__(self, inputs, top_k=_DEFAULT_TOP_K, batch_size: int = 1, truncation: bool = False, **kwargs):
+        texts = [inputs] if isinstance(inputs, str) else list(inputs)
+        top_k = self.top_k if top_k is _DEFAULT_TOP_K else top_k
+        results = []
+        for start in range(0, len(texts), max(1, batch_size)):
+            results.extend(decode_scores(self.scores(texts[start:start + batch_size], truncation), self.labels, top_k))
+        return results
+
+    # Every label's score for every text, as a (texts, labels) float32 matrix
+    def scores(self, texts, truncation: bool = False):
+        import numpy as np # type: ignore
+
+        encoded = self.tokenizer(list(texts), padding=True, truncation=truncation, return_tensors="np")
+        feed = {name: encoded[name].astype(np.int64) for name in self.input_names}
+        logits = self.session.run(None, feed)[0].astype(np.float32)
+        if self.multi_label:
+            return 1 / (1 + np.exp(-logits))
+        exp = np.exp(logits - logits.max(axis=-1, keepdims=True))
+        return exp / exp.sum(axis=-1, keepdims=True)
+
+
+# Word-level tokenizer answering the calls the API makes of the model's
+# tokenizer: input IDs, with or without the two special tokens, and
+# character offsets
+class StubTokenizer:
+    model_max_length = 512
+    _TOKEN = re.compile(r"\w+|[^\w\s]")
+
+    def __call__(self, text, add_special_tokens: bool = True, truncation: bool = False,
+                 return_offsets_mapping: bool = False, **kwargs):
+        texts = [text] if isinstance(text, str) else list(text)
+        encodings = [self._encode(t, add_special_tokens, truncation, return_offsets_mapping) for t in texts]
+        if isinstance(text, str):
+            return encodings[0]
+        keys = ["input_ids", "offset_mapping"] if return_offsets_mapping else ["input_ids"]
+        return {key: [encoding[key] for encoding in encodings] for key in keys}
+
+    def _encode(self, text: str, add_special_tokens: bool, truncation: bool, return_offsets_mapping: bool) -> dict:
+        matches = list(self._TOKEN.finditer(text))
+        ids = [3 + zlib.crc32(match.group().encode("utf-8")) % 50000 for match in matches]
+        offsets = [match.span() for match in matches]
+        if add_special_tokens:
+            ids, offsets = [0] + ids + [2], [(0, 0)] + offsets + [(0, 0)]
+        if truncation and len(ids) > self.model_max_length:
+            ids, offsets = ids[:self.model_max_length], offsets[:self.model_max_length]
+        encoding = {"input_ids": ids}
+        if return_offsets_mapping:
+            encoding["offset_mapping"] = offsets
+        return encoding
+
+
+# Deterministic stand-in for the model, called like the text-classification
+# pipeline: each label's score is a sigmoid of a hash of the text, so the
+# same text always gets the same scores and nothing is computed
+class StubClassifier:
+    def __init__(self, top_k=1, labels=GO_EMOTIONS_LABELS):
+        self.top_k = top_k
+        self.labels = labels
+        self.tokenizer = StubTokenizer()
+
+    def __call__(self, inputs, top_k=_DEFAULT_TOP_K, batch_size: int = 1, truncation: bool = False, **kwargs):
+        texts = [inputs] if isinstance(inputs, str) else list(inputs)
+        top_k = self.top_k if top_k is _DEFAULT_TOP_K else top_k
+        return decode_scores(self.scores(texts), self.labels, top_k)
+
+    def scores(self, texts, truncation: bool = False):
+        import numpy as np # type: ignore
+
+        digests = b"".join(
+            hashlib.blake2b(text.encode("utf-8"), digest_size=len(self.labels)).digest() for text in texts
+        )
+        raw = np.frombuffer(digests, dtype=np.uint8).reshape(len(texts), len(self.labels)).astype(np.float32)
+        return 1 / (1 + np.exp(-(raw - 160) / 24))
+
+
+# Function that returns the reference texts whose top-1 label differs
+# between two classifiers
+def check_parity(reference, candidate, texts=REFERENCE_TEXTS) -> list:
+    expected = reference(texts, top_k=1, batch_size=len(texts))
+    actual = candidate(texts, top_k=1, batch_size=len(texts))
+    return [
+        {"text": text, "expected": want[0]["label"], "actual": got[0]["label"]}
+        for text, want, got in zip(texts, expected, actual)
+        if want[0]["label"] != got[0]["label"]
+    ]
@@ -0,0 +1,129 @@
+import asyncio
+import os
+import queue
+import threading
+import time
+from concurrent.futures import Future
+from typing import Callable, List
+from app.executors import Overloaded
+
+# Micro-batching settings
+BATCH_MAX_SIZE = int(os.getenv("BATCH_MAX_SIZE", "16"))
+BATCH_MAX_WAIT_MS = float(os.getenv("BATCH_MAX_WAIT_MS", "10"))
+# Texts allowed to wait for the model before new requests are turned away
+BATCH_MAX_QUEUE = int(os.getenv("BATCH_MAX_QUEUE", "4096"))
+
+
+# Collects single-text requests into batches and runs them through the model
+# on background threads, so the event loop never waits on a forward pass.
+# `concurrency` is the number of batches in flight at once, which only helps
+# when predict_fn hands batches to several worker processes.
+class MicroBatcher:
+    def __init__(
+        self,
+        predict_fn: Callable[[List[str]], list],
+        max_batch_size: int = BATCH_MAX_SIZE,
+        max_wait_ms: float = BATCH_MAX_WAIT_MS,
+        concurrency: int = 1,
+        max_queue: int = BATCH_MAX_QUEUE,
+    ):
+        self.predict_fn = predict_fn
+        self.max_batch_size = max(1, max_batch_size)
+        self.max_wait = max(0.0, max_wait_ms) / 1000
+        self.concurrency = max(1, concurrency)
+        self.max_queue = max_queue
+        self.rejected = 0
+        self._queue: "queue.Queue" = queue.Queue()
+        self._lock = threading.Lock()
+        self._workers = []
+
+    def start(self):
+        with self._lock:
+            self._workers = [worker for worker in self._workers if worker.is_alive()]
+            while len(self._workers) < self.concurrency:
+                worker = threading.Thread(target=self._run, name="micro-batcher", daemon=True)
+                worker.start()
+                self._workers.append(worker)
+
+    def close(self):
+        with self._lock:
+            workers, self._workers = self._workers, []
+        for _ in workers:
+            self._queue.put(None)
+        for worker in workers:
+            worker.join()
+
+    @property
+    def queue_depth(self) -> int:
+        return self._queue.qsize()
+
+    # A request's texts are admitted all together or not at all
+    def _admit(self, count: int):
+        if self.max_queue and self._queue.qsize() + count > self.max_queue:
+            self.rejected += 1
+            raise Overloaded("The inference queue is full, please retry later")
+
+    def submit(self, text: str) -> Future:
+        self._admit(1)
+        return self._enqueue(text)
+
+    def _enqueue(self, text: str) -> Future:
+        self.start()
+        future = Future()
+        self._queue.put((text, future))
+        return future
+
+    async def predict(self, text: str):
+        return await asyncio.wrap_future(self.submit(text))
+
+    async def predict_many(self, texts: List[str]) -> list:
+        self._admit(len(texts))
+        futures = [self._enqueue(text) for text in texts]
+        return list(await asyncio.gather(*(asyncio.wrap_future(f) for f in futures)))
+
+    # Block for the first item, then keep collecting until the batch is full
+    # or the wait budget measured from that first item runs out.
+    def _next_batch(self):
+        item = self._queue.get()
+        if item is None:
+            return None
+        batch = [item]
+        deadline = time.monotonic() + self.max_wait
+        while len(batch) < self.max_batch_size:
+            remaining = deadline - time.monotonic()
+            try:
+                item = self._queue.get(timeout=remaining) if remaining > 0 else self._queue.get_nowait()
+            except queue.Empty:
+                break
+            if item is None:
+                self._queue.put(None)
+                break
+            batch.append(item)
+        return batch
+
+    def _run(self):
+        while True:
+            batch = self._next_batch()
+            if batch is None:
+                return
+            batch = [(text, future) for text, future in batch if future.set_running_or_notify_cancel()]
+            if batch:
+                self._process(batch)
+
+    def _process(self, batch):
+        texts = [text for text, _ in batch]
+        try:
+            results = self.predict_fn(texts)
+        except Exception as e:
+            if len(batch) == 1:
+                batch[0][1].set_exception(e)
+                return
+            # One bad input must not fail everyone else in the batch
+            for text, future in batch:
+                try:
+                    future.set_result(self.predict_fn([text])[0])
+                except Exception as item_error:
+                    future.set_exception(item_error)
+            return
+        for (_, future), result in zip(batch, results):
+            future.set_result(result)
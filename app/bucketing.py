@@ -0,0 +1,103 @@
+import bisect
+import os
+import threading
+from collections import deque
+from concurrent.futures import Future
+from typing import Callable, List
+
+# Upper token-length bound of each bucket; longer texts share a last bucket
+BUCKET_BOUNDARIES = [int(bound) for bound in os.getenv("BUCKET_BOUNDARIES", "16,32,64,128,256").split(",")]
+# How many queued texts are pulled at once to be sorted into buckets
+BUCKET_POOL_SIZE = int(os.getenv("BUCKET_POOL_SIZE", "128"))
+
+
+# Tracks how much of each forward pass is spent on padding tokens, overall
+# and per bucket, so bucket boundaries can be tuned against real traffic
+class PaddingStats:
+    def __init__(self, history: int = 100):
+        self.recent = deque(maxlen=history)
+        self.buckets = {}
+        self._lock = threading.Lock()
+
+    def record(self, bucket: str, lengths: List[int]):
+        padded = max(lengths) * len(lengths)
+        ratio = 1 - sum(lengths) / padded if padded else 0.0
+        with self._lock:
+            self.recent.append({"bucket": bucket, "size": len(lengths), "max_tokens": max(lengths), "padding_ratio": ratio})
+            totals = self.buckets.setdefault(bucket, {"batches": 0, "tokens": 0, "padded_tokens": 0})
+            totals["batches"] += 1
+            totals["tokens"] += sum(lengths)
+            totals["padded_tokens"] += padded
+
+    def summary(self) -> dict:
+        with self._lock:
+            tokens = sum(totals["tokens"] for totals in self.buckets.values())
+            padded = sum(totals["padded_tokens"] for totals in self.buckets.values())
+            return {
+                "batches": sum(totals["batches"] for totals in self.buckets.values()),
+                "padding_ratio": 1 - tokens / padded if padded else 0.0,
+                "buckets": {
+                    bucket: dict(totals, padding_ratio=1 - totals["tokens"] / totals["padded_tokens"])
+                    for bucket, totals in self.buckets.items()
+                },
+                "recent": list(self.recent),
+            }
+
+
+# Function that counts the model input tokens of each text
+def token_lengths(tokenizer, texts: List[str]) -> List[int]:
+    return [len(ids) for ids in tokenizer(texts, verbose=False)["input_ids"]]
+
+
+# Wraps a batch predict function: texts are sorted into token-length
+# buckets, batched within their bucket, and the outputs are put back in the
+# original order. With `submit_fn` (a batch in, a future of its outputs
+# out) every batch is handed over before the first result is awaited, so a
+# staged model can tokenize one batch while running the previous one.
+class LengthBucketer:
+    def __init__(
+        self,
+        predict_fn: Callable[[List[str]], list],
+        length_fn: Callable[[List[str]], List[int]],
+        max_batch_size: int,
+        boundaries: List[int] = BUCKET_BOUNDARIES,
+        stats: PaddingStats = None,
+        submit_fn: Callable[[List[str]], Future] = None,
+    ):
+        self.predict_fn = predict_fn
+        self.submit_fn = submit_fn
+        self.length_fn = length_fn
+        self.max_batch_size = max(1, max_batch_size)
+        self.boundaries = sorted(boundaries)
+        self.stats = stats if stats is not None else PaddingStats()
+
+    def bucket_name(self, length: int) -> str:
+        index = bisect.bisect_left(self.boundaries, length)
+        return f"<={self.boundaries[index]}" if index < len(self.boundaries) else f">{self.boundaries[-1]}"
+
+    # Returns the batches to run, as lists of indices into the input
+    def plan(self, lengths: List[int]) -> List[List[int]]:
+        buckets = {}
+        for index in sorted(range(len(lengths)), key=lengths.__getitem__):
+            buckets.setdefault(self.bucket_name(lengths[index]), []).append(index)
+        return [
+            indices[start:start + self.max_batch_size]
+            for indices in buckets.values()
+            for start in range(0, len(indices), self.max_batch_size)
+        ]
+
+    def __call__(self, texts: List[str]) -> list:
+        lengths = self.length_fn(texts)
+        results = [None] * len(texts)
+        batches = self.plan(lengths)
+        if self.submit_fn is not None:
+            futures = [self.submit_fn([texts[i] for i in batch]) for batch in batches]
+            batches = zip(batches, (future.result() for future in futures))
+        else:
+            batches = ((batch, self.predict_fn([texts[i] for i in batch])) for batch in batches)
+        for batch, outputs in batches:
+            batch_lengths = [lengths[i] for i in batch]
+            self.stats.record(self.bucket_name(max(batch_lengths)), batch_lengths)
+            for index, output in zip(batch, outputs):
+                results[index] = output
+        return results
@@ -0,0 +1,190 @@
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+import unicodedata
+from collections import OrderedDict
+from typing import List, Optional
+
+# Prediction cache settings (a size of 0 disables the cache, a TTL of 0
+# keeps entries until they are evicted)
+PREDICTION_CACHE_SIZE = int(os.getenv("PREDICTION_CACHE_SIZE", "10000"))
+PREDICTION_CACHE_TTL = float(os.getenv("PREDICTION_CACHE_TTL", "0"))
+PREDICTION_CACHE_PATH = os.getenv("PREDICTION_CACHE_PATH", "")
+# Entries kept in the SQLite tier, least recently used evicted first
+PREDICTION_CACHE_DISK_SIZE = int(os.getenv("PREDICTION_CACHE_DISK_SIZE", "100000"))
+
+
+# Collapse whitespace differences so retried uploads and copy-pasted
+# reviews map to the same entry
+def normalize_text(text: str) -> str:
+    return " ".join(unicodedata.normalize("NFC", text).split())
+
+
+def cache_key(text: str, model_id: str, top_k) -> str:
+    raw = f"{model_id}\0{top_k}\0{normalize_text(text)}"
+    return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+
+# Second cache tier kept in a SQLite file, so entries survive restarts and
+# are shared by all workers on the host. Expired entries are deleted when
+# read, and every max_entries / 10 writes the expired and least recently
+# used entries beyond max_entries are purged, so the file stays bounded.
+class SqliteCache:
+    def __init__(self, path: str, ttl: float = 0, max_entries: int = PREDICTION_CACHE_DISK_SIZE):
+        self.ttl = ttl
+        self.max_entries = max(1, max_entries)
+        self.purge_every = max(1, self.max_entries // 10)
+        self._writes = 0
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS predictions (key TEXT PRIMARY KEY, value TEXT, expires REAL, accessed REAL DEFAULT 0)"
+        )
+        # Files created before the tier was bounded
+        columns = {row[1] for row in self._conn.execute("PRAGMA table_info(predictions)")}
+        if "accessed" not in columns:
+            self._conn.execute("ALTER TABLE predictions ADD COLUMN accessed REAL DEFAULT 0")
+        self._conn.execute("CREATE INDEX IF NOT EXISTS predictions_accessed ON predictions (accessed)")
+
+    def get(self, key: str):
+        now = time.time()
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT value, expires FROM predictions WHERE key = ?", (key,)
+            ).fetchone()
+            if row is None:
+                return None
+            if row[1] and row[1] < now:
+                self._conn.execute("DELETE FROM predictions WHERE key = ?", (key,))
+                return None
+            self._conn.execute("UPDATE predictions SET accessed = ? WHERE key = ?", (now, key))
+        return json.loads(row[0])
+
+    # Arrays (score rows) are stored as lists and read back as lists
+    def set(self, key: str, value):
+        now = time.time()
+        expires = now + self.ttl if self.ttl else 0
+        if hasattr(value, "tolist"):
+            value = value.tolist()
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO predictions (key, value, expires, accessed) VALUES (?, ?, ?, ?)",
+                (key, json.dumps(value), expires, now),
+            )
+            self._writes += 1
+            if self._writes % self.purge_every == 0:
+                self._purge(now)
+
+    def _purge(self, now: float):
+        self._conn.execute("DELETE FROM predictions WHERE expires > 0 AND expires < ?", (now,))
+        excess = self._conn.execute("SELECT COUNT(*) FROM predictions").fetchone()[0] - self.max_entries
+        if excess > 0:
+            self._conn.execute(
+                "DELETE FROM predictions WHERE key IN (SELECT key FROM predictions ORDER BY accessed LIMIT ?)",
+                (excess,),
+            )
+
+    def count(self) -> int:
+        with self._lock:
+            return self._conn.execute("SELECT COUNT(*) FROM predictions").fetchone()[0]
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+
+# In-process LRU cache of predictions with an optional TTL and an optional
+# SQLite tier behind it
+class PredictionCache:
+    def __init__(
+        self,
+        model_id: str,
+        top_k=None,
+        max_entries: int = PREDICTION_CACHE_SIZE,
+        ttl: float = PREDICTION_CACHE_TTL,
+        path: str = PREDICTION_CACHE_PATH,
+        disk_max_entries: int = PREDICTION_CACHE_DISK_SIZE,
+    ):
+        self.model_id = model_id
+        self.top_k = top_k
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.disk = SqliteCache(path, ttl, disk_max_entries) if path and max_entries > 0 else None
+        self.hits = 0
+        self.misses = 0
+        self.disk_hits = 0
+        self._entries: "OrderedDict[str, tuple]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    @property
+    def enabled(self) -> bool:
+        return self.max_entries > 0
+
+    def key(self, text: str) -> str:
+        return cache_key(text, self.model_id, self.top_k)
+
+    def get(self, text: str):
+        if not self.enabled:
+            return None
+        key = self.key(text)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and (not entry[1] or entry[1] >= time.monotonic()):
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return entry[0]
+        value = self.disk.get(key) if self.disk else None
+        with self._lock:
+            if value is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            self.disk_hits += 1
+        self._remember(key, value)
+        return value
+
+    def set(self, text: str, value):
+        if not self.enabled:
+            return
+        key = self.key(text)
+        self._remember(key, value)
+        if self.disk:
+            self.disk.set(key, value)
+
+    def _remember(self, key: str, value):
+        expires = time.monotonic() + self.ttl if self.ttl else 0
+        with self._lock:
+            self._entries[key] = (value, expires)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def get_many(self, texts: List[str]) -> List[Optional[list]]:
+        return [self.get(text) for text in texts]
+
+    def set_many(self, texts: List[str], values: list):
+        for text, value in zip(texts, values):
+            self.set(text, value)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self) -> dict:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "enabled": self.enabled,
+                "entries": len(self._entries),
+                "max_entries": self.max_entries,
+                "ttl": self.ttl,
+                "disk": self.disk is not None,
+                "hits": self.hits,
+                "misses": self.misses,
+                "disk_hits": self.disk_hits,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+            }
@@ -0,0 +1,51 @@
+import os
+from typing import List
+
+# Long-document settings: window size and overlap in tokens (the window
+# leaves room for the two special tokens of the 512-token model input)
+CHUNK_WINDOW_TOKENS = int(os.getenv("CHUNK_WINDOW_TOKENS", "510"))
+CHUNK_STRIDE_TOKENS = int(os.getenv("CHUNK_STRIDE_TOKENS", "64"))
+CHUNK_BATCH_SIZE = int(os.getenv("CHUNK_BATCH_SIZE", "16"))
+
+AGGREGATIONS = ("mean", "max", "weighted")
+
+
+# Function that splits a text on tokenizer token boundaries into windows of
+# `window` tokens, consecutive windows sharing `stride` tokens
+def chunk_text(
+    text: str,
+    tokenizer,
+    window: int = CHUNK_WINDOW_TOKENS,
+    stride: int = CHUNK_STRIDE_TOKENS,
+) -> List[dict]:
+    encoding = tokenizer(text, add_special_tokens=False, return_offsets_mapping=True, verbose=False)
+    offsets = encoding["offset_mapping"]
+    if not offsets:
+        return [{"text": text, "start": 0, "end": len(text), "tokens": 0}]
+
+    step = max(1, window - max(0, stride))
+    chunks = []
+    for first in range(0, len(offsets), step):
+        span = offsets[first:first + window]
+        start, end = span[0][0], span[-1][1]
+        chunks.append({"text": text[start:end], "start": start, "end": end, "tokens": len(span)})
+        if first + window >= len(offsets):
+            break
+    return chunks
+
+
+# Function that combines the per-chunk score matrix (chunks, labels) into
+# one document-level score per label
+def aggregate_scores(chunk_scores, weights: List[int], method: str = "mean"):
+    import numpy as np # type: ignore
+
+    if method not in AGGREGATIONS:
+        raise ValueError(f"Unknown aggregation '{method}', expected one of {', '.join(AGGREGATIONS)}")
+
+    chunk_scores = np.asarray(chunk_scores, dtype=np.float32)
+    if method == "max":
+        return chunk_scores.max(axis=0)
+    if method == "mean":
+        return chunk_scores.mean(axis=0)
+    weights = np.asarray(weights, dtype=np.float32)
+    return weights @ chunk_scores / (weights.sum() or 1)
@@ -0,0 +1,92 @@
+import os
+from typing import List, Optional
+
+import numpy as np # type: ignore
+
+# Decimal places of the scores returned as a compact array (output=scores)
+SCORE_DECIMALS = int(os.getenv("SCORE_DECIMALS", "4"))
+
+OUTPUTS = ("labels", "scores")
+
+# The model outputs every label's score for every text, as a (texts, labels)
+# float32 matrix in the model's label order. The functions below turn that
+# matrix into what a request asked for, working on whole batches at once.
+
+
+# Function that returns a classifier's labels in output order
+def labels_of(classifier) -> List[str]:
+    loaded = classifier.load() if hasattr(classifier, "load") else classifier
+    if hasattr(loaded, "labels"):
+        return list(loaded.labels)
+    config = getattr(loaded, "config", None) or loaded.model.config
+    return [config.id2label[i] for i in range(len(config.id2label))]
+
+
+# Function that turns pipeline-style predictions with every label back into
+# a score matrix in label order
+def scores_from_predictions(predictions: List[list], labels: List[str]) -> np.ndarray:
+    index = {label: i for i, label in enumerate(labels)}
+    scores = np.zeros((len(predictions), len(labels)), dtype=np.float32)
+    for row, prediction in enumerate(predictions):
+        for pred in prediction:
+            scores[row, index[pred["label"]]] = pred["score"]
+    return scores
+
+
+# Function that parses a threshold: one number for every label, or
+# comma-separated label:number pairs with "*" for the labels not listed
+# (labels left out are never returned)
+def parse_thresholds(spec: str, labels: List[str]) -> np.ndarray:
+    spec = spec.strip()
+    try:
+        return np.full(len(labels), float(spec), dtype=np.float32)
+    except ValueError:
+        pass
+    values = {}
+    for entry in spec.split(","):
+        label, _, value = entry.strip().rpartition(":")
+        if label != "*" and label not in labels:
+            raise ValueError(f"Unknown label {label!r} in threshold")
+        try:
+            values[label] = float(value)
+        except ValueError:
+            raise ValueError(f"Invalid threshold {entry.strip()!r}, expected label:number")
+    thresholds = np.full(len(labels), values.get("*", np.inf), dtype=np.float32)
+    for i, label in enumerate(labels):
+        if label in values:
+            thresholds[i] = values[label]
+    return thresholds
+
+
+# Function that picks each text's labels: the `top_k` best (all of them for
+# None), best first, on the whole matrix at once. Returns the label indices
+# and scores of that ranking, and which of them reach their threshold.
+def select_labels(scores: np.ndarray, top_k: Optional[int] = 1, thresholds: np.ndarray = None):
+    width = scores.shape[1]
+    k = width if top_k is None else max(0, min(top_k, width))
+    if k < width:
+        picked = np.argpartition(-scores, k - 1, axis=1)[:, :k] if k else np.empty((len(scores), 0), dtype=np.intp)
+        order = np.argsort(-np.take_along_axis(scores, picked, axis=1), axis=1, kind="stable")
+        picked = np.take_along_axis(picked, order, axis=1)
+    else:
+        picked = np.argsort(-scores, axis=1, kind="stable")
+    top = np.take_along_axis(scores, picked, axis=1)
+    keep = top >= thresholds[picked] if thresholds is not None else np.ones(top.shape, dtype=bool)
+    return picked, top, keep
+
+
+# Function that decodes each text's selected labels as label/score dicts;
+# dicts are only built for the labels returned
+def decode_scores(scores, labels: List[str], top_k: Optional[int] = 1, thresholds: np.ndarray = None) -> List[list]:
+    scores = np.asarray(scores, dtype=np.float32).reshape(-1, len(labels))
+    picked, top, keep = select_labels(scores, top_k, thresholds)
+    return [
+        [{"label": labels[i], "score": score} for i, score, kept in zip(row_labels, row_scores, row_kept) if kept]
+        for row_labels, row_scores, row_kept in zip(picked.tolist(), top.tolist(), keep.tolist())
+    ]
+
+
+# Function that rounds a score matrix for compact output, one list of
+# floats per text in label order
+def compact_scores(scores, decimals: int = SCORE_DECIMALS) -> List[List[float]]:
+    return np.round(np.asarray(scores, dtype=np.float64), decimals).tolist()
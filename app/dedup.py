@@ -0,0 +1,55 @@
+import hashlib
+import os
+from typing import Awaitable, Callable, List
+
+import numpy as np # type: ignore
+
+from app.cache import normalize_text
+
+# Distinct texts of one upload whose scores are kept for their later
+# duplicates (duplicates within one batch are always merged)
+DEDUP_MAX_ENTRIES = int(os.getenv("DEDUP_MAX_ENTRIES", "100000"))
+
+
+# Digest of a text's normalized form, the same normalization the prediction
+# cache keys on, so texts sharing a digest share their scores either way
+def text_digest(text: str) -> bytes:
+    return hashlib.blake2b(normalize_text(text).encode("utf-8"), digest_size=16).digest()
+
+
+# Duplicate texts of one request, stream or job. `score` sends each distinct
+# text to the scorer once and fans its score row out to every text that
+# matches it, in this batch or, up to `max_entries` distinct texts, in the
+# upload's later batches.
+class Deduplicator:
+    def __init__(self, max_entries: int = DEDUP_MAX_ENTRIES):
+        self.max_entries = max(0, max_entries)
+        self.units = 0
+        self.scored = 0
+        self._rows = {}
+
+    async def score(self, texts: List[str], score_texts: Callable[[List[str]], Awaitable[np.ndarray]]) -> np.ndarray:
+        if not texts:
+            return await score_texts([])
+        digests = [text_digest(text) for text in texts]
+        fresh = {}
+        for text, digest in zip(texts, digests):
+            if digest not in self._rows and digest not in fresh:
+                fresh[digest] = text
+        scores = await score_texts(list(fresh.values()))
+        rows = dict(zip(fresh, scores))
+        matrix = np.stack([rows[digest] if digest in rows else self._rows[digest] for digest in digests])
+        for digest, row in rows.items():
+            if len(self._rows) >= self.max_entries:
+                break
+            self._rows[digest] = row
+        self.units += len(texts)
+        self.scored += len(fresh)
+        return matrix
+
+    def summary(self) -> dict:
+        return {
+            "units": self.units,
+            "scored": self.scored,
+            "duplicate_ratio": 1 - self.scored / self.units if self.units else 0.0,
+        }
@@ -0,0 +1,76 @@
+import asyncio
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+# Threads reading and parsing uploads, and how many extraction jobs may wait
+# for them before new requests are turned away
+EXTRACTION_THREADS = int(os.getenv("EXTRACTION_THREADS", "4"))
+EXTRACTION_MAX_PENDING = int(os.getenv("EXTRACTION_MAX_PENDING", "32"))
+# Threads running model calls that bypass the micro-batcher (long documents)
+INFERENCE_THREADS = int(os.getenv("INFERENCE_THREADS", "2"))
+INFERENCE_MAX_PENDING = int(os.getenv("INFERENCE_MAX_PENDING", "8"))
+# Seconds a client is asked to wait before retrying a rejected request
+OVERLOAD_RETRY_AFTER = int(os.getenv("OVERLOAD_RETRY_AFTER", "1"))
+
+
+# Raised when a queue in the request path is full; the API answers 503
+# with a Retry-After header instead of letting latency grow without bound
+class Overloaded(Exception):
+    pass
+
+
+# Thread pool that admits at most `max_pending` queued or running jobs
+class BoundedExecutor:
+    def __init__(self, name: str, max_workers: int, max_pending: int):
+        self.name = name
+        self.max_workers = max(1, max_workers)
+        self.max_pending = max(1, max_pending)
+        self.pending = 0
+        self.rejected = 0
+        self._executor = ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix=name)
+        self._lock = threading.Lock()
+
+    def _admit(self, force: bool):
+        with self._lock:
+            if not force and self.pending >= self.max_pending:
+                self.rejected += 1
+                raise Overloaded(f"The {self.name} queue is full, please retry later")
+            self.pending += 1
+
+    def _done(self, _future=None):
+        with self._lock:
+            self.pending -= 1
+
+    # `force` admits the job even when the queue is full; it is used for the
+    # follow-up steps of a request that was already admitted
+    async def run(self, fn, *args, force: bool = False):
+        self._admit(force)
+        try:
+            future = self._executor.submit(fn, *args)
+        except Exception:
+            self._done()
+            raise
+        future.add_done_callback(self._done)
+        return await asyncio.wrap_future(future)
+
+    # Iterate over a blocking iterator, one next() call per job; only the
+    # first call is subject to admission
+    async def iterate(self, iterator):
+        done = object()
+        force = False
+        while True:
+            item = await self.run(next, iterator, done, force=force)
+            if item is done:
+                return
+            force = True
+            yield item
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "max_workers": self.max_workers,
+                "max_pending": self.max_pending,
+                "pending": self.pending,
+                "rejected": self.rejected,
+            }
@@ -0,0 +1,211 @@
+import io
+import multiprocessing
+import os
+import shutil
+import tempfile
+import threading
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import contextmanager
+from itertools import islice
+from fastapi import UploadFile # type: ignore
+from app.metrics import stage_timer
+
+# Rows read from a CSV upload at a time when streaming
+CSV_CHUNK_ROWS = int(os.getenv("CSV_CHUNK_ROWS", "1000"))
+
+# PDF extraction settings: the most pages read from one upload (0 for no
+# limit), and when and how pages are split across extraction processes
+PDF_MAX_PAGES = int(os.getenv("PDF_MAX_PAGES", "2000"))
+PDF_PROCESSES = int(os.getenv("PDF_PROCESSES", str(min(4, os.cpu_count() or 1))))
+PDF_PARALLEL_MIN_PAGES = int(os.getenv("PDF_PARALLEL_MIN_PAGES", "32"))
+PDF_PAGES_PER_TASK = int(os.getenv("PDF_PAGES_PER_TASK", "16"))
+
+CHAPTER_MARKER = "Chapter "
+
+
+# The functions below split an upload into units (pages, chapters,
+# paragraphs or rows) and yield them one by one as (unit_id, text) pairs,
+# so a large file never has to be held as one string.
+
+# Copy an upload to a named temporary file in fixed-size chunks, so PDFs
+# are read page by page from disk (and by other processes) instead of
+# being held in memory as one bytes object
+@contextmanager
+def spooled_upload(file: UploadFile, suffix: str = ""):
+    with stage_timer("file_read", suffix.lstrip(".")), tempfile.NamedTemporaryFile(suffix=suffix, delete=False) as spool:
+        shutil.copyfileobj(file.file, spool, 1024 * 1024)
+    try:
+        yield spool.name
+    finally:
+        os.remove(spool.name)
+
+
+_pdf_executor = None
+_pdf_executor_lock = threading.Lock()
+
+
+def get_pdf_executor() -> ProcessPoolExecutor:
+    global _pdf_executor
+    with _pdf_executor_lock:
+        if _pdf_executor is None:
+            # Spawned rather than forked: the API process runs many threads
+            _pdf_executor = ProcessPoolExecutor(
+                max_workers=PDF_PROCESSES, mp_context=multiprocessing.get_context("spawn")
+            )
+        return _pdf_executor
+
+
+def _extract_page_range(path: str, start: int, stop: int) -> list:
+    import fitz   # type: ignore
+
+    with fitz.open(path) as doc:
+        return [doc[number].get_text() for number in range(start, stop)]
+
+
+# Function that yields (page_number, text) for the selected pages of a PDF
+# file. Large documents are split into page ranges extracted in parallel by
+# a process pool; only a few ranges are in flight at a time, so memory stays
+# bounded and pages still come out in order.
+def iter_pdf_pages(path: str, first_page: int = None, last_page: int = None, max_pages: int = PDF_MAX_PAGES):
+    import fitz   # type: ignore
+
+    with fitz.open(path) as doc:
+        page_count = doc.page_count
+    start = max(1, first_page or 1) - 1
+    stop = min(page_count, last_page or page_count)
+    if max_pages:
+        stop = min(stop, start + max_pages)
+
+    if PDF_PROCESSES <= 1 or stop - start < PDF_PARALLEL_MIN_PAGES:
+        with fitz.open(path) as doc:
+            for number in range(start, stop):
+                yield number + 1, doc[number].get_text()
+        return
+
+    executor = get_pdf_executor()
+    ranges = ((first, min(first + PDF_PAGES_PER_TASK, stop)) for first in range(start, stop, PDF_PAGES_PER_TASK))
+    pending = deque(
+        (first, executor.submit(_extract_page_range, path, first, last))
+        for first, last in islice(ranges, PDF_PROCESSES * 2)
+    )
+    try:
+        while pending:
+            first, future = pending.popleft()
+            texts = future.result()
+            for first_next, last_next in islice(ranges, 1):
+                pending.append((first_next, executor.submit(_extract_page_range, path, first_next, last_next)))
+            for offset, text in enumerate(texts):
+                yield first + offset + 1, text
+    finally:
+        for _, future in pending:
+            future.cancel()
+
+
+def iter_pdf_units(file: UploadFile, unit: str = "page", first_page: int = None, last_page: int = None):
+    with spooled_upload(file, ".pdf") as path:
+        pages = iter_pdf_pages(path, first_page, last_page)
+        if unit == "chapter":
+            yield from _iter_chapters(text for _, text in pages)
+            return
+        for number, text in pages:
+            text = text.strip()
+            if text:
+                yield f"page-{number}", text
+
+
+# Chapters may span pages, so only the current chapter is buffered; text
+# before the first "Chapter " heading is skipped, as in the UI
+def _iter_chapters(pages):
+    title, buffer = None, []
+    for page_text in pages:
+        parts = page_text.split(CHAPTER_MARKER)
+        buffer.append(parts[0])
+        for part in parts[1:]:
+            if title is not None:
+                yield title, "".join(buffer).strip()
+            heading, _, body = part.partition("\n")
+            title, buffer = CHAPTER_MARKER + heading.strip(), [body]
+    if title is not None:
+        yield title, "".join(buffer).strip()
+
+
+def iter_txt_units(file: UploadFile):
+    paragraph, number = [], 0
+    for line in io.TextIOWrapper(file.file, encoding="utf-8"):
+        if line.strip():
+            paragraph.append(line)
+        elif paragraph:
+            number += 1
+            yield f"paragraph-{number}", "".join(paragraph).strip()
+            paragraph = []
+    if paragraph:
+        yield f"paragraph-{number + 1}", "".join(paragraph).strip()
+
+
+# Resolve a column given by name or by position (a number) against the header
+def resolve_csv_column(columns: list, column) -> str:
+    if column is None:
+        return None
+    column = str(column)
+    if column in columns:
+        return column
+    if column.lstrip("-").isdigit() and -len(columns) <= int(column) < len(columns):
+        return columns[int(column)]
+    raise ValueError(f"Column {column!r} not found in the CSV header")
+
+
+# Only the text column (and the ID column, if any) is parsed, CSV_CHUNK_ROWS
+# rows at a time, so memory stays flat however large the export is. Rows
+# are identified by the ID column's value, or else by their row number;
+# rows with an empty text are skipped.
+def iter_csv_units(file: UploadFile, text_column=None, id_column=None):
+    import pandas as pd  # type: ignore
+
+    columns = list(pd.read_csv(file.file, nrows=0).columns)
+    file.file.seek(0)
+    text_column = resolve_csv_column(columns, text_column if text_column is not None else 0)
+    id_column = resolve_csv_column(columns, id_column)
+    usecols = [text_column] if id_column in (None, text_column) else [text_column, id_column]
+
+    chunks = pd.read_csv(file.file, usecols=usecols, dtype={text_column: str}, chunksize=CSV_CHUNK_ROWS)
+    for chunk in chunks:
+        chunk = chunk[chunk[text_column].notna()]
+        ids = chunk[id_column].tolist() if id_column else chunk.index.tolist()
+        for row_id, text in zip(ids, chunk[text_column].tolist()):
+            if text.strip():
+                yield row_id, text
+
+
+def iter_file_units(
+    file: UploadFile,
+    unit: str = "page",
+    first_page: int = None,
+    last_page: int = None,
+    text_column=None,
+    id_column=None,
+):
+    if file.filename.endswith(".pdf"):
+        return iter_pdf_units(file, unit, first_page, last_page)
+    if file.filename.endswith(".txt"):
+        return iter_txt_units(file)
+    if file.filename.endswith(".csv"):
+        return iter_csv_units(file, text_column, id_column)
+    return None
+
+
+# Format label of a file for metrics, from its extension
+def file_format(filename: str) -> str:
+    return os.path.splitext(filename)[1].lstrip(".").lower()
+
+
+# Group units into lists of at most `size` items
+def batched(units, size: int):
+    batch = []
+    for unit in units:
+        batch.append(unit)
+        if len(batch) >= size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
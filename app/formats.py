@@ -0,0 +1,200 @@
+import io
+from typing import Dict, List, Optional
+
+import numpy as np # type: ignore
+
+from app.decoding import select_labels
+
+# Result formats and their media types. The binary formats are columnar:
+# labels go out as integer IDs into a label list sent once, and scores as a
+# float32 column (one per label with output=scores).
+MEDIA_TYPES = {
+    "json": "application/json",
+    "ndjson": "application/x-ndjson",
+    "sse": "text/event-stream",
+    "csv": "text/csv",
+    "arrow": "application/vnd.apache.arrow.stream",
+    "parquet": "application/vnd.apache.parquet",
+    "msgpack": "application/msgpack",
+}
+# Other names clients use for the same formats
+MEDIA_TYPE_ALIASES = {
+    "application/x-parquet": "parquet",
+    "application/x-msgpack": "msgpack",
+    "application/vnd.msgpack": "msgpack",
+}
+BINARY_FORMATS = ("arrow", "parquet", "msgpack")
+
+
+def msgpack_available() -> bool:
+    try:
+        import msgpack # type: ignore # noqa: F401
+    except ImportError:
+        return False
+    return True
+
+
+# Function that picks the format to answer with from an Accept header: the
+# offered format with the highest quality, the first offered one on a tie
+# or when there is no header. Returns None when nothing offered is acceptable.
+def negotiate(accept: Optional[str], offered: List[str]) -> Optional[str]:
+    if not accept or not accept.strip():
+        return offered[0]
+    ranges = []
+    for part in accept.split(","):
+        media_range, *params = [item.strip() for item in part.split(";")]
+        quality = 1.0
+        for param in params:
+            name, _, value = param.partition("=")
+            if name.strip() == "q":
+                try:
+                    quality = float(value)
+                except ValueError:
+                    quality = 0.0
+        ranges.append((media_range.lower(), quality))
+
+    best, best_quality = None, 0.0
+    for name in offered:
+        media_types = [MEDIA_TYPES[name]] + [alias for alias, target in MEDIA_TYPE_ALIASES.items() if target == name]
+        quality, specificity = 0.0, -1
+        for media_range, range_quality in ranges:
+            for media_type in media_types:
+                if media_range == media_type:
+                    match = 2
+                elif media_range == media_type.split("/")[0] + "/*":
+                    match = 1
+                elif media_range == "*/*":
+                    match = 0
+                else:
+                    continue
+                if match > specificity:
+                    quality, specificity = range_quality, match
+        if quality > best_quality:
+            best, best_quality = name, quality
+    return best
+
+
+# Function that lays scored results out as columns. With output=labels there
+# is one row per returned label, best first, and `label` indexes `labels`
+# (texts left with no label have no row); with output=scores one row per
+# text and one float32 column per label.
+def result_columns(ids: list, scores, labels: List[str], options: dict, texts: list = None) -> Dict[str, object]:
+    scores = np.asarray(scores, dtype=np.float32).reshape(-1, len(labels))
+    if options["output"] == "scores":
+        columns = {"id": list(ids)}
+        if texts is not None:
+            columns["text"] = list(texts)
+        columns.update({label: scores[:, i] for i, label in enumerate(labels)})
+        return columns
+    picked, top, keep = select_labels(scores, options["top_k"], options["thresholds"])
+    rows, ranks = np.nonzero(keep)
+    columns = {"id": [ids[row] for row in rows.tolist()]}
+    if texts is not None:
+        columns["text"] = [texts[row] for row in rows.tolist()]
+    columns["label"] = picked[rows, ranks].astype(np.int16 if len(labels) > 127 else np.int8)
+    columns["score"] = top[rows, ranks]
+    return columns
+
+
+# IDs keep their type when they all share one, else (or when there are
+# none) they are sent as strings
+def id_array(ids: list):
+    import pyarrow as pa # type: ignore
+
+    if not ids:
+        return pa.array([], pa.string())
+    try:
+        return pa.array(ids)
+    except (pa.ArrowInvalid, pa.ArrowTypeError):
+        return pa.array([None if value is None else str(value) for value in ids], pa.string())
+
+
+def arrow_table(columns: Dict[str, object], labels: List[str]):
+    import pyarrow as pa # type: ignore
+
+    arrays = {}
+    for name, values in columns.items():
+        if name == "id":
+            arrays[name] = id_array(values)
+        elif name == "text":
+            arrays[name] = pa.array(values, pa.string())
+        elif name == "label":
+            arrays[name] = pa.DictionaryArray.from_arrays(pa.array(values), pa.array(labels, pa.string()))
+        else:
+            arrays[name] = pa.array(values, pa.float32())
+    return pa.table(arrays)
+
+
+def encode_arrow(columns: Dict[str, object], labels: List[str]) -> bytes:
+    encoder = ArrowStreamEncoder(labels)
+    return encoder.encode(columns) + encoder.close()
+
+
+def encode_parquet(columns: Dict[str, object], labels: List[str]) -> bytes:
+    import pyarrow.parquet as pq # type: ignore
+
+    sink = io.BytesIO()
+    pq.write_table(arrow_table(columns, labels), sink, compression="zstd")
+    return sink.getvalue()
+
+
+# Scores are packed as single-precision floats
+def pack_msgpack(value) -> bytes:
+    import msgpack # type: ignore
+
+    return msgpack.packb(value, use_single_float=True)
+
+
+def msgpack_columns(columns: Dict[str, object]) -> Dict[str, list]:
+    return {name: values if isinstance(values, list) else values.tolist() for name, values in columns.items()}
+
+
+# One MessagePack map: the label list and the columns, label IDs as small ints
+def encode_msgpack(columns: Dict[str, object], labels: List[str]) -> bytes:
+    return pack_msgpack({"labels": labels, "columns": msgpack_columns(columns)})
+
+
+ENCODERS = {"arrow": encode_arrow, "parquet": encode_parquet, "msgpack": encode_msgpack}
+
+
+# Arrow IPC stream written one batch of results at a time: the first call
+# returns the schema and the first record batch, later calls their own
+# record batch only, so each is sent as soon as it is scored. `options` and
+# `include_text` give the columns of the empty table sent when there were
+# no results at all.
+class ArrowStreamEncoder:
+    def __init__(self, labels: List[str], options: dict = None, include_text: bool = False):
+        self.labels = labels
+        self.options = options or {"output": "labels", "top_k": 1, "thresholds": None}
+        self.include_text = include_text
+        self._sink = io.BytesIO()
+        self._writer = None
+        self._schema = None
+
+    def encode(self, columns: Dict[str, object]) -> bytes:
+        import pyarrow as pa # type: ignore
+
+        table = arrow_table(columns, self.labels)
+        if self._writer is None:
+            self._schema = table.schema
+            self._writer = pa.ipc.new_stream(self._sink, self._schema)
+        elif table.schema != self._schema:
+            table = table.cast(self._schema)
+        self._writer.write_table(table)
+        return self._drain()
+
+    # The end-of-stream marker, after the schema when nothing was encoded,
+    # so an upload without results is still a valid (empty) stream
+    def close(self) -> bytes:
+        content = b""
+        if self._writer is None:
+            empty = np.empty((0, len(self.labels)), dtype=np.float32)
+            content = self.encode(result_columns([], empty, self.labels, self.options, [] if self.include_text else None))
+        self._writer.close()
+        return content + self._drain()
+
+    def _drain(self) -> bytes:
+        content = self._sink.getvalue()
+        self._sink.seek(0)
+        self._sink.truncate()
+        return content
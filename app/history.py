@@ -0,0 +1,206 @@
+import json
+import os
+import sqlite3
+import tempfile
+import threading
+import time
+from datetime import datetime, timedelta, timezone
+from typing import List
+
+from app.prediction_log import segment_hour
+
+# Whether closed log segments are compacted into the Parquet history
+PREDICTION_HISTORY = os.getenv("PREDICTION_HISTORY", "true").lower() == "true"
+PREDICTION_HISTORY_DIR = os.getenv("PREDICTION_HISTORY_DIR", "prediction_history")
+# How often the log is checked for closed segments, and how long after the
+# end of an hour its segments may still receive buffered records
+PREDICTION_HISTORY_COMPACT_SECONDS = float(os.getenv("PREDICTION_HISTORY_COMPACT_SECONDS", "300"))
+PREDICTION_HISTORY_GRACE_SECONDS = float(os.getenv("PREDICTION_HISTORY_GRACE_SECONDS", "300"))
+# Hours before the last compacted one whose segments are checked again for
+# records appended after they were compacted
+PREDICTION_HISTORY_RESCAN_HOURS = int(os.getenv("PREDICTION_HISTORY_RESCAN_HOURS", "24"))
+
+INTERVALS = ("hour", "day", "week", "month")
+PERCENTILES = (0.5, 0.9, 0.99)
+
+
+def history_schema():
+    import pyarrow as pa # type: ignore
+
+    return pa.schema([
+        ("username", pa.string()),
+        ("request_time", pa.timestamp("us", tz="UTC")),
+        ("response_time", pa.float64()),
+        ("Texts", pa.string()),
+        ("predictions", pa.string()),
+        ("score", pa.float64()),
+    ])
+
+
+def as_utc(value: datetime) -> datetime:
+    return value.replace(tzinfo=timezone.utc) if value.tzinfo is None else value.astimezone(timezone.utc)
+
+
+# Prediction history kept as zstd-compressed Parquet files partitioned by
+# date (date=YYYY-MM-DD/<hour>-<segment>.parquet), sorted by request time.
+# Queries read only the columns they need, skip other dates by partition
+# and skip row groups by their request_time statistics. The size each
+# segment had when it was compacted is kept in _compacted.db, next to the
+# Parquet files (queries ignore it).
+class HistoryStore:
+    def __init__(
+        self,
+        directory: str = PREDICTION_HISTORY_DIR,
+        compact_seconds: float = PREDICTION_HISTORY_COMPACT_SECONDS,
+        grace_seconds: float = PREDICTION_HISTORY_GRACE_SECONDS,
+        rescan_hours: int = PREDICTION_HISTORY_RESCAN_HOURS,
+    ):
+        self.directory = directory
+        self.compact_seconds = compact_seconds
+        self.grace_seconds = grace_seconds
+        self.rescan_hours = rescan_hours
+        self.compacted = 0
+        self._last_compact = 0.0
+        self._lock = threading.Lock()
+        self._db = None
+
+    # Opened on first compaction, so a store that is only queried leaves
+    # nothing on disk
+    @property
+    def _conn(self) -> sqlite3.Connection:
+        if self._db is None:
+            os.makedirs(self.directory, exist_ok=True)
+            conn = sqlite3.connect(os.path.join(self.directory, "_compacted.db"), check_same_thread=False, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("CREATE TABLE IF NOT EXISTS segments (name TEXT PRIMARY KEY, hour TEXT, size INTEGER)")
+            self._db = conn
+        return self._db
+
+    def path_for(self, segment: str) -> str:
+        date, hour, file = segment.split("/")[:3]
+        return os.path.join(self.directory, date, f"{hour[len('hour='):]}-{file[:-len('.jsonl')]}.parquet")
+
+    # Write one log segment (JSONL bytes) as a Parquet file; it is written
+    # to a hidden temporary file first, so queries and other compacting
+    # processes never see a partial file
+    def write_segment(self, segment: str, data: bytes):
+        import pyarrow as pa # type: ignore
+        import pyarrow.parquet as pq # type: ignore
+
+        records = [json.loads(line) for line in data.decode("utf-8").splitlines() if line.strip()]
+        for record in records:
+            record["request_time"] = datetime.fromisoformat(record["request_time"])
+        records.sort(key=lambda record: record["request_time"])
+        table = pa.Table.from_pylist(records, schema=history_schema())
+
+        path = self.path_for(segment)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with tempfile.NamedTemporaryFile(dir=os.path.dirname(path), prefix=".", suffix=".tmp", delete=False) as tmp:
+            pq.write_table(table, tmp, compression="zstd")
+        os.replace(tmp.name, path)
+
+    # Sizes of the log segments worth checking: those of the dates from
+    # `rescan_hours` before the last compacted hour on, or all of them
+    # before anything was compacted
+    def _segment_sizes(self, writer, now: datetime) -> dict:
+        last = self._conn.execute("SELECT MAX(hour) FROM segments").fetchone()[0]
+        if last is None:
+            return writer.sizes()
+        day = (datetime.fromisoformat(last) - timedelta(hours=self.rescan_hours)).date()
+        sizes = {}
+        while day <= now.date():
+            sizes.update(writer.sizes(f"date={day:%Y-%m-%d}/"))
+            day += timedelta(days=1)
+        return sizes
+
+    # Compact every log segment whose hour is over and which is not in the
+    # history yet, or which grew since it was compacted (records buffered
+    # past the grace period); returns how many were written
+    def compact(self, writer, now: datetime = None) -> int:
+        now = now or datetime.now(timezone.utc)
+        closed_before = now - timedelta(hours=1, seconds=self.grace_seconds)
+        written = 0
+        with self._lock:
+            compacted = dict(self._conn.execute("SELECT name, size FROM segments"))
+            for segment, size in sorted(self._segment_sizes(writer, now).items()):
+                hour = segment_hour(segment)
+                if hour > closed_before or size <= compacted.get(segment, -1):
+                    continue
+                # The size read, not the size listed, as records may have
+                # been appended in between
+                data = writer.read(segment)
+                self.write_segment(segment, data)
+                self._conn.execute(
+                    "INSERT OR REPLACE INTO segments (name, hour, size) VALUES (?, ?, ?)",
+                    (segment, hour.isoformat(), len(data)),
+                )
+                written += 1
+            self.compacted += written
+        return written
+
+    def compact_due(self, writer) -> int:
+        if time.monotonic() - self._last_compact < self.compact_seconds:
+            return 0
+        self._last_compact = time.monotonic()
+        return self.compact(writer)
+
+    def _scan(self, columns: List[str], start: datetime, end: datetime):
+        import pyarrow as pa # type: ignore
+        import pyarrow.dataset as ds # type: ignore
+
+        if not os.path.isdir(self.directory):
+            return history_schema().empty_table().select(columns)
+        start, end = as_utc(start), as_utc(end)
+        dataset = ds.dataset(
+            self.directory,
+            schema=history_schema().append(pa.field("date", pa.string())),
+            format="parquet",
+            partitioning=ds.partitioning(pa.schema([("date", pa.string())]), flavor="hive"),
+            ignore_prefixes=[".", "_"],
+        )
+        timestamp = pa.timestamp("us", tz="UTC")
+        condition = (
+            (ds.field("date") >= start.strftime("%Y-%m-%d"))
+            & (ds.field("date") <= end.strftime("%Y-%m-%d"))
+            & (ds.field("request_time") >= pa.scalar(start, type=timestamp))
+            & (ds.field("request_time") < pa.scalar(end, type=timestamp))
+        )
+        return dataset.to_table(columns=columns, filter=condition)
+
+    # Number of predictions of each label per hour, day, week or month
+    def label_distribution(self, start: datetime, end: datetime, interval: str = "day") -> List[dict]:
+        import pyarrow as pa # type: ignore
+        import pyarrow.compute as pc # type: ignore
+
+        table = self._scan(["request_time", "predictions"], start, end)
+        periods = pa.table({
+            "period": pc.floor_temporal(table["request_time"], unit=interval),
+            "label": table["predictions"],
+        })
+        counts = periods.group_by(["period", "label"]).aggregate([("label", "count")])
+
+        distribution = {}
+        for row in counts.sort_by([("period", "ascending"), ("label_count", "descending")]).to_pylist():
+            distribution.setdefault(row["period"].isoformat(), {})[row["label"]] = row["label_count"]
+        return [{"period": period, "counts": labels} for period, labels in distribution.items()]
+
+    # Number of predictions per user, busiest first
+    def user_volume(self, start: datetime, end: datetime) -> List[dict]:
+        table = self._scan(["username"], start, end)
+        counts = table.group_by("username").aggregate([("username", "count")])
+        return [
+            {"username": row["username"], "predictions": row["username_count"]}
+            for row in counts.sort_by([("username_count", "descending")]).to_pylist()
+        ]
+
+    # Response time percentiles, in seconds
+    def latency_percentiles(self, start: datetime, end: datetime, percentiles=PERCENTILES) -> dict:
+        import pyarrow.compute as pc # type: ignore
+
+        response_times = self._scan(["response_time"], start, end)["response_time"]
+        if len(response_times) == 0:
+            return {"count": 0}
+        quantiles = pc.quantile(response_times, q=list(percentiles)).to_pylist()
+        result = {"count": len(response_times), "mean": pc.mean(response_times).as_py()}
+        result.update({f"p{round(q * 100):g}": value for q, value in zip(percentiles, quantiles)})
+        return result
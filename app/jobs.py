@@ -0,0 +1,291 @@
+import json
+import logging
+import os
+import shutil
+import sqlite3
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from itertools import islice
+from typing import Callable, List, Optional
+
+from starlette.datastructures import UploadFile # type: ignore
+
+from app.dedup import Deduplicator
+from app.executors import OVERLOAD_RETRY_AFTER, Overloaded
+from app.extraction import batched, file_format, iter_file_units
+from app.metrics import stage_timer, timed_iter
+
+# SQLite file holding job state and results, and where uploaded files are
+# kept until their job finishes
+JOBS_DB_PATH = os.getenv("JOBS_DB_PATH", os.path.join("jobs", "jobs.db"))
+JOBS_DIR = os.getenv("JOBS_DIR", os.path.join("jobs", "files"))
+# Jobs run at the same time, and file units classified per saved batch
+JOBS_WORKERS = int(os.getenv("JOBS_WORKERS", "2"))
+JOB_BATCH_SIZE = int(os.getenv("JOB_BATCH_SIZE", "64"))
+# Results returned per page when downloading, at most
+JOB_RESULTS_PAGE_SIZE = int(os.getenv("JOB_RESULTS_PAGE_SIZE", "1000"))
+
+logger = logging.getLogger(__name__)
+
+
+# Job state and results in SQLite. Each batch's results are saved in the
+# same transaction as the job's progress, so after a restart a job picks
+# up right after its last saved batch.
+class JobStore:
+    def __init__(self, path: str = JOBS_DB_PATH, files_dir: str = JOBS_DIR):
+        self.path = path
+        self.files_dir = files_dir
+        self._lock = threading.Lock()
+        self._db = None
+
+    # The database is opened on first use, so importing the app or starting
+    # it with no jobs leaves nothing on disk
+    @property
+    def _conn(self) -> sqlite3.Connection:
+        if self._db is None:
+            os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+            conn = sqlite3.connect(self.path, check_same_thread=False, isolation_level=None)
+            conn.row_factory = sqlite3.Row
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS jobs ("
+                "id TEXT PRIMARY KEY, username TEXT, filename TEXT, path TEXT, options TEXT, status TEXT, "
+                "units_done INTEGER DEFAULT 0, batches_done INTEGER DEFAULT 0, error TEXT, "
+                "created_at REAL, started_at REAL, updated_at REAL, finished_at REAL, units_scored INTEGER DEFAULT 0, "
+                "via_api_key INTEGER DEFAULT 0)"
+            )
+            # Databases created before duplicate units were counted, or
+            # before API-key owners were told from users
+            columns = {row["name"] for row in conn.execute("PRAGMA table_info(jobs)")}
+            if "units_scored" not in columns:
+                conn.execute("ALTER TABLE jobs ADD COLUMN units_scored INTEGER DEFAULT 0")
+            if "via_api_key" not in columns:
+                conn.execute("ALTER TABLE jobs ADD COLUMN via_api_key INTEGER DEFAULT 0")
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS results ("
+                "job_id TEXT, seq INTEGER, unit_id TEXT, predictions TEXT, PRIMARY KEY (job_id, seq))"
+            )
+            self._db = conn
+        return self._db
+
+    # Save an upload under the jobs directory and queue a job for it; the
+    # owner is the name and whether it is an API key's, as a key and a
+    # user may share a name
+    def create(self, username: str, file: UploadFile, options: dict, via_api_key: bool = False) -> str:
+        job_id = uuid.uuid4().hex
+        path = os.path.join(self.files_dir, job_id + os.path.splitext(file.filename)[1])
+        os.makedirs(self.files_dir, exist_ok=True)
+        with stage_timer("file_read", file_format(file.filename)), open(path, "wb") as f:
+            shutil.copyfileobj(file.file, f, 1024 * 1024)
+        now = time.time()
+        with self._lock:
+            self._conn.execute(
+                "INSERT INTO jobs (id, username, filename, path, options, status, created_at, updated_at, via_api_key) "
+                "VALUES (?, ?, ?, ?, ?, 'queued', ?, ?, ?)",
+                (job_id, username, file.filename, path, json.dumps(options), now, now, int(via_api_key)),
+            )
+        return job_id
+
+    def get(self, job_id: str) -> Optional[dict]:
+        with self._lock:
+            row = self._conn.execute("SELECT * FROM jobs WHERE id = ?", (job_id,)).fetchone()
+        if row is None:
+            return None
+        job = dict(row)
+        job["options"] = json.loads(job["options"])
+        return job
+
+    def unfinished(self) -> List[str]:
+        if self._db is None and not os.path.exists(self.path):
+            return []
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT id FROM jobs WHERE status IN ('queued', 'running') ORDER BY created_at"
+            ).fetchall()
+        return [row["id"] for row in rows]
+
+    def mark_running(self, job_id: str):
+        now = time.time()
+        with self._lock:
+            self._conn.execute(
+                "UPDATE jobs SET status = 'running', started_at = COALESCE(started_at, ?), updated_at = ? WHERE id = ?",
+                (now, now, job_id),
+            )
+
+    # `scored` is how many of the batch's units were distinct texts sent for
+    # scoring, the rest being duplicates of units already scored
+    def save_batch(self, job_id: str, first_seq: int, results: list, scored: int = None):
+        with self._lock:
+            self._conn.execute("BEGIN")
+            try:
+                self._conn.executemany(
+                    "INSERT OR REPLACE INTO results (job_id, seq, unit_id, predictions) VALUES (?, ?, ?, ?)",
+                    [
+                        (job_id, first_seq + i, json.dumps(unit_id), json.dumps(predictions))
+                        for i, (unit_id, predictions) in enumerate(results)
+                    ],
+                )
+                self._conn.execute(
+                    "UPDATE jobs SET units_done = ?, units_scored = units_scored + ?, batches_done = batches_done + 1, "
+                    "updated_at = ? WHERE id = ?",
+                    (first_seq + len(results), len(results) if scored is None else scored, time.time(), job_id),
+                )
+                self._conn.execute("COMMIT")
+            except Exception:
+                self._conn.execute("ROLLBACK")
+                raise
+
+    def finish(self, job_id: str, status: str, error: str = None):
+        now = time.time()
+        with self._lock:
+            self._conn.execute(
+                "UPDATE jobs SET status = ?, error = ?, updated_at = ?, finished_at = ? WHERE id = ?",
+                (status, error, now, now, job_id),
+            )
+
+    def results(self, job_id: str, offset: int = 0, limit: int = JOB_RESULTS_PAGE_SIZE) -> list:
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT unit_id, predictions FROM results WHERE job_id = ? AND seq >= ? ORDER BY seq LIMIT ?",
+                (job_id, offset, limit),
+            ).fetchall()
+        return [{"id": json.loads(row["unit_id"]), "predictions": json.loads(row["predictions"])} for row in rows]
+
+    def close(self):
+        with self._lock:
+            if self._db is not None:
+                self._db.close()
+                self._db = None
+
+
+# Public view of a job, with its throughput so far
+def job_summary(job: dict) -> dict:
+    elapsed = (job["finished_at"] or job["updated_at"]) - job["started_at"] if job["started_at"] else 0.0
+    return {
+        "id": job["id"],
+        "status": job["status"],
+        "filename": job["filename"],
+        "units_done": job["units_done"],
+        "units_scored": job["units_scored"],
+        "duplicate_ratio": 1 - job["units_scored"] / job["units_done"] if job["units_done"] else 0.0,
+        "batches_done": job["batches_done"],
+        "error": job["error"],
+        "created_at": job["created_at"],
+        "started_at": job["started_at"],
+        "finished_at": job["finished_at"],
+        "elapsed_seconds": elapsed,
+        "units_per_second": job["units_done"] / elapsed if elapsed > 0 else 0.0,
+    }
+
+
+# Runs queued jobs on a pool of worker threads. `predict_fn(job, texts)`
+# classifies one batch, with the job's Deduplicator under job["dedup"] so
+# repeated units are scored once; a batch refused because the server is
+# overloaded is retried after a pause rather than failing the job.
+class JobRunner:
+    def __init__(
+        self,
+        store: JobStore,
+        predict_fn: Callable[[dict, List[str]], list],
+        workers: int = JOBS_WORKERS,
+        batch_size: int = JOB_BATCH_SIZE,
+    ):
+        self.store = store
+        self.predict_fn = predict_fn
+        self.workers = max(1, workers)
+        self.batch_size = max(1, batch_size)
+        self._executor = None
+        self._active = set()
+        self._closed = threading.Event()
+        self._lock = threading.Lock()
+
+    def _ensure_executor(self) -> ThreadPoolExecutor:
+        with self._lock:
+            if self._executor is None:
+                self._closed.clear()
+                self._executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="jobs")
+            return self._executor
+
+    # Start the workers and queue every job left unfinished by a previous run
+    def start(self):
+        if self._executor is not None:
+            return
+        self._ensure_executor()
+        for job_id in self.store.unfinished():
+            self.submit(job_id)
+
+    def submit(self, job_id: str):
+        with self._lock:
+            if job_id in self._active:
+                return
+            self._active.add(job_id)
+        self._ensure_executor().submit(self._run, job_id)
+
+    def close(self):
+        self._closed.set()
+        with self._lock:
+            executor, self._executor = self._executor, None
+        if executor is not None:
+            executor.shutdown(wait=True, cancel_futures=True)
+        with self._lock:
+            self._active.clear()
+
+    def _predict(self, job: dict, texts: List[str]) -> list:
+        while True:
+            try:
+                return self.predict_fn(job, texts)
+            except Overloaded:
+                if self._closed.wait(OVERLOAD_RETRY_AFTER):
+                    raise
+
+    def _run(self, job_id: str):
+        try:
+            self._run_job(job_id)
+        finally:
+            with self._lock:
+                self._active.discard(job_id)
+
+    def _run_job(self, job_id: str):
+        job = self.store.get(job_id)
+        if job is None or job["status"] not in ("queued", "running"):
+            return
+        self.store.mark_running(job_id)
+        options = job["options"]
+        job["dedup"] = dedup = Deduplicator()
+        try:
+            with open(job["path"], "rb") as f:
+                file = UploadFile(f, filename=job["filename"])
+                units = iter_file_units(
+                    file,
+                    options.get("unit", "page"),
+                    options.get("first_page"),
+                    options.get("last_page"),
+                    options.get("text_column"),
+                    options.get("id_column"),
+                )
+                if units is None:
+                    raise ValueError("Unsupported file type. Please upload a PDF, TXT, or CSV file.")
+                # Units already saved before a restart are read again but not classified
+                seq = job["units_done"]
+                batches = batched(islice(units, seq, None), self.batch_size)
+                for batch in timed_iter(batches, "extract", file_format(job["filename"])):
+                    if self._closed.is_set():
+                        return
+                    units_before, scored_before = dedup.units, dedup.scored
+                    predictions = self._predict(job, [text for _, text in batch])
+                    results = [(unit_id, p) for (unit_id, _), p in zip(batch, predictions)]
+                    # Every unit counts as scored when predict_fn does not deduplicate
+                    scored = dedup.scored - scored_before if dedup.units > units_before else None
+                    self.store.save_batch(job_id, seq, results, scored)
+                    seq += len(batch)
+        except Exception as e:
+            if self._closed.is_set():
+                return
+            logger.error(f"Job {job_id} failed: {e}")
+            self.store.finish(job_id, "failed", str(e))
+        else:
+            self.store.finish(job_id, "completed")
+        if os.path.exists(job["path"]):
+            os.remove(job["path"])
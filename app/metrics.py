@@ -0,0 +1,85 @@
+import time
+from contextlib import contextmanager
+
+from prometheus_client import CONTENT_TYPE_LATEST, Counter, Gauge, Histogram, generate_latest # type: ignore
+
+# Latency buckets in seconds, from sub-millisecond auth checks up to long
+# document extractions
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+
+REQUEST_SECONDS = Histogram(
+    "emotion_request_seconds", "Time to answer a request", ["method", "route", "status"], buckets=LATENCY_BUCKETS
+)
+REQUESTS_IN_FLIGHT = Gauge("emotion_requests_in_flight", "Requests being answered")
+STAGE_SECONDS = Histogram(
+    "emotion_stage_seconds", "Time spent in each stage of a request", ["stage", "format"], buckets=LATENCY_BUCKETS
+)
+BATCH_SIZE = Histogram(
+    "emotion_model_batch_size", "Texts per model forward pass", buckets=(1, 2, 4, 8, 16, 32, 64, 128)
+)
+INPUT_TOKENS = Histogram(
+    "emotion_input_tokens", "Model input tokens per text", buckets=(8, 16, 32, 64, 128, 256, 512, 1024, 4096)
+)
+PREDICTIONS = Counter("emotion_predictions", "Texts classified", ["source"])
+DEDUP_TEXTS = Counter("emotion_dedup_texts", "Texts scored, or answered from a duplicate in the same upload", ["outcome"])
+# Read from the batcher, executors, caches and log when scraped
+QUEUE_DEPTH = Gauge("emotion_queue_depth", "Items waiting or running in a queue", ["queue"])
+CACHE_HIT_RATE = Gauge("emotion_cache_hit_rate", "Share of lookups answered by a cache", ["cache"])
+LOG_BUFFERED = Gauge("emotion_prediction_log_buffered", "Prediction records waiting to be written")
+
+
+# Time a block of work as one stage; `format` tells file formats apart
+@contextmanager
+def stage_timer(stage: str, format: str = ""):
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        STAGE_SECONDS.labels(stage=stage, format=format).observe(time.perf_counter() - start)
+
+
+# Iterate while timing each step as one stage; used for extractors, whose
+# work happens a unit at a time as they are iterated
+def timed_iter(iterator, stage: str, format: str = ""):
+    iterator = iter(iterator)
+    done = object()
+    while True:
+        with stage_timer(stage, format):
+            item = next(iterator, done)
+        if item is done:
+            return
+        yield item
+
+
+# ASGI middleware timing every HTTP request by route until its last byte
+# is sent, so streamed responses count in full
+class RequestMetricsMiddleware:
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        status_code = 500
+
+        async def send_with_status(message):
+            nonlocal status_code
+            if message["type"] == "http.response.start":
+                status_code = message["status"]
+            await send(message)
+
+        REQUESTS_IN_FLIGHT.inc()
+        start = time.perf_counter()
+        try:
+            await self.app(scope, receive, send_with_status)
+        finally:
+            REQUESTS_IN_FLIGHT.dec()
+            route = scope.get("route")
+            REQUEST_SECONDS.labels(
+                method=scope["method"], route=getattr(route, "path", "unmatched"), status=str(status_code)
+            ).observe(time.perf_counter() - start)
+
+
+def render_metrics():
+    return generate_latest(), CONTENT_TYPE_LATEST
@@ -0,0 +1,227 @@
+import os
+import queue
+import threading
+import time
+from concurrent.futures import Future
+from contextlib import nullcontext
+from typing import Callable, List
+
+import numpy as np # type: ignore
+
+from app.decoding import labels_of, scores_from_predictions
+from app.metrics import stage_timer
+
+# Run tokenization, the forward pass and decoding on separate threads, so
+# one batch is tokenized while the previous one is in the model
+STAGED_INFERENCE = os.getenv("STAGED_INFERENCE", "true").lower() == "true"
+# Batches allowed to wait in front of each stage
+STAGED_QUEUE_SIZE = int(os.getenv("STAGED_QUEUE_SIZE", "4"))
+
+STAGES = ("tokenize", "forward", "postprocess")
+
+
+# A loaded pipeline's model when it is a PyTorch module, else None
+def torch_model(loaded):
+    model = getattr(loaded, "model", None)
+    try:
+        import torch # type: ignore
+    except ImportError:
+        return None
+    return model if isinstance(model, torch.nn.Module) else None
+
+
+def encode(tokenizer, texts: List[str], truncation: bool = True):
+    return tokenizer(texts, padding=True, truncation=truncation, return_tensors="pt")
+
+
+def forward(model, encoded):
+    import torch # type: ignore
+
+    with torch.inference_mode():
+        return model(**encoded).logits
+
+
+# Sigmoid or softmax by the rule the pipeline uses, as a float32 matrix
+def activate(model, logits):
+    import torch # type: ignore
+
+    config = model.config
+    logits = logits.float()
+    if config.problem_type == "multi_label_classification" or config.num_labels == 1:
+        return torch.sigmoid(logits).numpy()
+    return torch.softmax(logits, dim=-1).numpy()
+
+
+# Function that scores one batch in one go: the three stages inline for a
+# PyTorch pipeline, `scores` for classifiers that have it (ONNX, the stub),
+# else the pipeline's output with every label
+def score_batch(classifier, texts: List[str], truncation: bool = True):
+    loaded = classifier.load() if hasattr(classifier, "load") else classifier
+    if hasattr(loaded, "scores"):
+        return loaded.scores(texts, truncation=truncation)
+    model = torch_model(loaded)
+    if model is not None:
+        return activate(model, forward(model, encode(loaded.tokenizer, texts, truncation)))
+    predictions = loaded(texts, top_k=None, batch_size=len(texts), truncation=truncation)
+    return scores_from_predictions(predictions, labels_of(loaded))
+
+
+# Classifier called like the pipeline that returns each batch's score
+# matrix; what runs in the inference worker processes
+class BatchScorer:
+    def __init__(self, classifier):
+        self.classifier = classifier
+
+    def load(self):
+        if hasattr(self.classifier, "load"):
+            self.classifier.load()
+        return self
+
+    def __call__(self, texts: List[str], batch_size: int = None, truncation: bool = True):
+        return score_batch(self.classifier, texts, truncation)
+
+
+# Per-stage counters: batches and texts done, and the time spent on them
+class StageStats:
+    def __init__(self):
+        self.batches = 0
+        self.texts = 0
+        self.busy_seconds = 0.0
+
+    def record(self, texts: int, seconds: float):
+        self.batches += 1
+        self.texts += texts
+        self.busy_seconds += seconds
+
+
+# A transformers text-classification pipeline split into three stages
+# connected by bounded queues: fast-tokenizer batch encoding, the forward
+# pass, and sigmoid/softmax. `submit` returns a future of the batch's
+# (texts, labels) score matrix, decoded by the caller. Models the
+# stages cannot be split from (ONNX, the stub) are called as they are.
+# `forward_context` wraps every forward pass, or every whole call of an
+# unsplit model (the profiler hooks in there).
+class StagedPipeline:
+    def __init__(
+        self,
+        classifier,
+        queue_size: int = STAGED_QUEUE_SIZE,
+        forward_context: Callable = nullcontext,
+    ):
+        self.classifier = classifier
+        self.queue_size = max(1, queue_size)
+        self.forward_context = forward_context
+        self.stats_by_stage = {stage: StageStats() for stage in STAGES}
+        self._queues = {stage: queue.Queue(maxsize=self.queue_size) for stage in STAGES}
+        self._threads = []
+        self._started_at = None
+        self._model = None
+        self._checked = False
+        self._lock = threading.Lock()
+
+    @property
+    def staged(self) -> bool:
+        return self._model is not None
+
+    # Loads the model, and starts the stage threads if it is a PyTorch model
+    def start(self):
+        with self._lock:
+            if self._threads or self._checked:
+                return
+            loaded = self.classifier.load() if hasattr(self.classifier, "load") else self.classifier
+            self._checked = True
+            model = torch_model(loaded)
+            if model is None:
+                return
+            self._model, self._tokenizer = model, loaded.tokenizer
+            self._started_at = time.monotonic()
+            for stage, work in zip(STAGES, (self._tokenize, self._forward, self._postprocess)):
+                thread = threading.Thread(target=self._run_stage, args=(stage, work), name=f"staged-{stage}", daemon=True)
+                thread.start()
+                self._threads.append(thread)
+
+    def close(self):
+        with self._lock:
+            threads, self._threads = self._threads, []
+            self._checked = False
+        if threads:
+            self._queues["tokenize"].put(None)
+        for thread in threads:
+            thread.join()
+
+    def submit(self, texts: List[str], truncation: bool = True) -> Future:
+        self.start()
+        future = Future()
+        if not self._threads:
+            try:
+                with self.forward_context():
+                    future.set_result(score_batch(self.classifier, texts, truncation))
+            except Exception as e:
+                future.set_exception(e)
+            return future
+        self._queues["tokenize"].put((future, len(texts), (texts, truncation)))
+        return future
+
+    def __call__(self, texts: List[str], batch_size: int = None, truncation: bool = True):
+        batch_size = batch_size or len(texts) or 1
+        futures = [self.submit(texts[i:i + batch_size], truncation) for i in range(0, len(texts), batch_size)]
+        return np.concatenate([future.result() for future in futures])
+
+    # Each stage thread takes a batch from its queue, works on it and hands
+    # the result to the next stage; a failed batch fails only its own future
+    def _run_stage(self, stage: str, work: Callable):
+        inbox = self._queues[stage]
+        outbox = self._queues[STAGES[STAGES.index(stage) + 1]] if stage != STAGES[-1] else None
+        while True:
+            item = inbox.get()
+            if item is None:
+                if outbox is not None:
+                    outbox.put(None)
+                return
+            future, count, payload = item
+            if future.done():
+                continue
+            start = time.perf_counter()
+            try:
+                with stage_timer(f"model_{stage}"):
+                    payload = work(payload)
+            except Exception as e:
+                future.set_exception(e)
+                continue
+            finally:
+                self.stats_by_stage[stage].record(count, time.perf_counter() - start)
+            if outbox is None:
+                future.set_result(payload)
+            else:
+                outbox.put((future, count, payload))
+
+    def _tokenize(self, payload):
+        texts, truncation = payload
+        return encode(self._tokenizer, texts, truncation)
+
+    def _forward(self, encoded):
+        with self.forward_context():
+            return forward(self._model, encoded)
+
+    def _postprocess(self, logits):
+        return activate(self._model, logits)
+
+    def queue_depth(self, stage: str) -> int:
+        return self._queues[stage].qsize()
+
+    def stats(self) -> dict:
+        elapsed = time.monotonic() - self._started_at if self._started_at is not None else 0.0
+        return {
+            "staged": self.staged,
+            "stages": {
+                stage: {
+                    "batches": stats.batches,
+                    "texts": stats.texts,
+                    "busy_seconds": stats.busy_seconds,
+                    "texts_per_second": stats.texts / stats.busy_seconds if stats.busy_seconds else 0.0,
+                    "utilization": stats.busy_seconds / elapsed if elapsed else 0.0,
+                    "queued": self.queue_depth(stage),
+                }
+                for stage, stats in self.stats_by_stage.items()
+            },
+        }
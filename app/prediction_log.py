@@ -0,0 +1,231 @@
+import json
+import logging
+import os
+import socket
+import threading
+from datetime import datetime, timezone
+from typing import Dict, List
+
+from app.metrics import stage_timer
+
+# Where prediction records go: "local" files, an Azure "blob" container, or
+# "none" to turn logging off
+PREDICTION_LOG_BACKEND = os.getenv("PREDICTION_LOG_BACKEND", "none")
+PREDICTION_LOG_DIR = os.getenv("PREDICTION_LOG_DIR", "prediction_logs")
+PREDICTION_LOG_CONTAINER = os.getenv("PREDICTION_LOG_CONTAINER", "predictions")
+# Records are written once this many are buffered, or every few seconds
+PREDICTION_LOG_BATCH_SIZE = int(os.getenv("PREDICTION_LOG_BATCH_SIZE", "500"))
+PREDICTION_LOG_FLUSH_SECONDS = float(os.getenv("PREDICTION_LOG_FLUSH_SECONDS", "5"))
+# Records kept in memory at most; beyond this new records are dropped
+PREDICTION_LOG_MAX_BUFFER = int(os.getenv("PREDICTION_LOG_MAX_BUFFER", "100000"))
+
+# Azure append blobs take at most 4 MiB per block
+BLOB_BLOCK_BYTES = 4 * 1024 * 1024
+
+logger = logging.getLogger(__name__)
+
+
+# Segment a record is written to: one JSONL file per hour and per process,
+# so writers never touch each other's files and nothing is rewritten
+def segment_name(request_time: str, writer_id: str) -> str:
+    hour = datetime.fromisoformat(request_time).astimezone(timezone.utc)
+    return f"date={hour:%Y-%m-%d}/hour={hour:%H}/predictions-{writer_id}.jsonl"
+
+
+# Start of the hour a segment covers, read back from its name
+def segment_hour(name: str) -> datetime:
+    date, hour = name.split("/")[:2]
+    return datetime.strptime(f"{date[len('date='):]} {hour[len('hour='):]}", "%Y-%m-%d %H").replace(tzinfo=timezone.utc)
+
+
+# Appends to segment files under a local directory
+class LocalLogWriter:
+    def __init__(self, directory: str = PREDICTION_LOG_DIR):
+        self.directory = directory
+
+    def append(self, name: str, data: bytes):
+        path = os.path.join(self.directory, name)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, "ab") as f:
+            f.write(data)
+
+    def list(self, prefix: str = "") -> List[str]:
+        return sorted(self.sizes(prefix))
+
+    # Size in bytes of each segment whose name starts with `prefix`, a
+    # partition such as "date=2024-05-01/"
+    def sizes(self, prefix: str = "") -> Dict[str, int]:
+        sizes = {}
+        for root, _, files in os.walk(os.path.join(self.directory, prefix)):
+            for file in files:
+                if file.endswith(".jsonl"):
+                    path = os.path.join(root, file)
+                    sizes[os.path.relpath(path, self.directory).replace(os.sep, "/")] = os.path.getsize(path)
+        return sizes
+
+    def read(self, name: str) -> bytes:
+        with open(os.path.join(self.directory, name), "rb") as f:
+            return f.read()
+
+
+# Appends to append blobs in an Azure storage container (or an Azurite
+# emulator, through its connection string)
+class BlobLogWriter:
+    def __init__(self, connection_string: str, container: str = PREDICTION_LOG_CONTAINER):
+        from azure.core import MatchConditions # type: ignore
+        from azure.core.exceptions import ResourceExistsError # type: ignore
+        from azure.storage.blob import BlobServiceClient # type: ignore
+
+        self._exists_error = ResourceExistsError
+        self._if_missing = MatchConditions.IfMissing
+        self.container_client = BlobServiceClient.from_connection_string(connection_string).get_container_client(container)
+        try:
+            self.container_client.create_container()
+        except ResourceExistsError:
+            pass
+        self._created = set()
+
+    def append(self, name: str, data: bytes):
+        blob_client = self.container_client.get_blob_client(name)
+        if name not in self._created:
+            try:
+                blob_client.create_append_blob(etag="*", match_condition=self._if_missing)
+            except self._exists_error:
+                pass
+            self._created.add(name)
+        for start in range(0, len(data), BLOB_BLOCK_BYTES):
+            blob_client.append_block(data[start:start + BLOB_BLOCK_BYTES])
+
+    def list(self, prefix: str = "") -> List[str]:
+        return sorted(self.sizes(prefix))
+
+    def sizes(self, prefix: str = "") -> Dict[str, int]:
+        blobs = self.container_client.list_blobs(name_starts_with=prefix or None)
+        return {blob.name: blob.size for blob in blobs if blob.name.endswith(".jsonl")}
+
+    def read(self, name: str) -> bytes:
+        return self.container_client.get_blob_client(name).download_blob().readall()
+
+
+def get_log_writer(backend: str = PREDICTION_LOG_BACKEND):
+    if backend == "none":
+        return None
+    if backend == "local":
+        return LocalLogWriter()
+    if backend == "blob":
+        return BlobLogWriter(os.getenv("AZURE_CONNECTION_STRING"))
+    raise ValueError(f"Unknown prediction log backend {backend!r}, expected one of: none, local, blob")
+
+
+# Buffers prediction records in memory and appends them to hourly segments
+# from a background thread, in batches, so a request only pays for a list
+# append whatever the size of the log
+class PredictionLog:
+    def __init__(
+        self,
+        writer,
+        batch_size: int = PREDICTION_LOG_BATCH_SIZE,
+        flush_seconds: float = PREDICTION_LOG_FLUSH_SECONDS,
+        max_buffer: int = PREDICTION_LOG_MAX_BUFFER,
+        history=None,
+    ):
+        self.writer = writer
+        self.history = history
+        self.batch_size = max(1, batch_size)
+        self.flush_seconds = flush_seconds
+        self.max_buffer = max_buffer
+        self.writer_id = f"{socket.gethostname()}-{os.getpid()}"
+        self.written = 0
+        self.dropped = 0
+        self.failed = 0
+        self._buffer = []
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._closed = False
+        self._thread = None
+
+    @property
+    def enabled(self) -> bool:
+        return self.writer is not None
+
+    def start(self):
+        if not self.enabled or self._thread is not None:
+            return
+        self._closed = False
+        self._thread = threading.Thread(target=self._run, name="prediction-log", daemon=True)
+        self._thread.start()
+
+    def log(self, records: List[dict]):
+        if not self.enabled:
+            return
+        with self._lock:
+            room = self.max_buffer - len(self._buffer)
+            if room < len(records):
+                self.dropped += len(records) - max(room, 0)
+                records = records[:max(room, 0)]
+            self._buffer.extend(records)
+            full = len(self._buffer) >= self.batch_size
+        if full:
+            self._wakeup.set()
+
+    def flush(self):
+        with self._flush_lock:
+            with self._lock:
+                records, self._buffer = self._buffer, []
+            if not records:
+                return
+            segments = {}
+            for record in records:
+                name = segment_name(record["request_time"], self.writer_id)
+                segments.setdefault(name, []).append(json.dumps(record, default=str) + "\n")
+            for name, lines in segments.items():
+                try:
+                    with stage_timer("log_flush"):
+                        self.writer.append(name, "".join(lines).encode("utf-8"))
+                    self.written += len(lines)
+                except Exception as e:
+                    self.failed += len(lines)
+                    logger.error(f"Error writing predictions to {name}: {e}")
+
+    def _run(self):
+        while not self._closed:
+            if self.history is not None:
+                try:
+                    self.history.compact_due(self.writer)
+                except Exception as e:
+                    logger.error(f"Error compacting the prediction history: {e}")
+            self._wakeup.wait(self.flush_seconds)
+            self._wakeup.clear()
+            self.flush()
+
+    def close(self):
+        self._closed = True
+        self._wakeup.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+        if self.enabled:
+            self.flush()
+
+    def stats(self) -> dict:
+        with self._lock:
+            buffered = len(self._buffer)
+        return {"buffered": buffered, "written": self.written, "dropped": self.dropped, "failed": self.failed}
+
+
+# Function that builds the log records for one request, one per text, with
+# the fields of the original CSV prediction log
+def prediction_records(username: str, request_time: datetime, response_time: float, texts: list, predictions: list) -> List[dict]:
+    records = []
+    for text, prediction in zip(texts, predictions):
+        top = prediction[0] if prediction else {}
+        records.append({
+            "username": username,
+            "request_time": request_time.isoformat(),
+            "response_time": response_time,
+            "Texts": text,
+            "predictions": top.get("label", "Unknown label"),
+            "score": top.get("score"),
+        })
+    return records
@@ -0,0 +1,277 @@
+import cProfile
+import json
+import marshal
+import os
+import pstats
+import sys
+import threading
+import time
+import tracemalloc
+from collections import Counter
+from contextlib import contextmanager, nullcontext
+
+# Seconds between stack samples in sampler mode, and the longest a
+# profiling session may run
+PROFILE_SAMPLE_INTERVAL_MS = float(os.getenv("PROFILE_SAMPLE_INTERVAL_MS", "5"))
+PROFILE_MAX_SECONDS = float(os.getenv("PROFILE_MAX_SECONDS", "300"))
+
+PROFILE_MODES = ("cprofile", "sampler")
+# Output formats, and the file name and media type they download as
+PROFILE_OUTPUTS = {
+    "pstats": ("profile.pstats", "application/octet-stream"),
+    "speedscope": ("profile.speedscope.json", "application/json"),
+    "flamegraph": ("profile.folded", "text/plain"),
+    "torch": ("torch_ops.json", "application/json"),
+    "memory": ("memory.json", "application/json"),
+}
+
+_NOT_PROFILING = nullcontext()
+
+
+# Name of a frame as shown in stack samples
+def frame_name(frame) -> str:
+    code = frame.f_code
+    return f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})"
+
+
+# One profiling run. cprofile mode profiles whole model calls, one at a time
+# (calls arriving while one is being profiled run unprofiled); sampler mode
+# samples the stacks of every thread at a fixed interval. Either can also
+# record PyTorch operator timings and tracemalloc peaks of the profiled calls.
+class ProfilingSession:
+    def __init__(self, mode: str, max_calls: int, seconds: float, torch_ops: bool = False, memory: bool = False):
+        self.mode = mode
+        self.max_calls = max(1, max_calls)
+        self.seconds = min(seconds, PROFILE_MAX_SECONDS)
+        self.torch_ops = torch_ops
+        self.memory = memory
+        self.started_at = time.time()
+        self.finished_at = None
+        self.calls = 0
+        self.skipped = 0
+        self._deadline = time.monotonic() + self.seconds
+        self._busy = threading.Lock()
+        self._lock = threading.Lock()
+        self._pstats = None
+        self._ops = {}
+        self._peaks = []
+        self._top_allocations = []
+        self._started_tracemalloc = False
+        self._samples = Counter()
+        self._sampler = None
+        self._stop_sampler = threading.Event()
+
+        if memory and not tracemalloc.is_tracing():
+            tracemalloc.start()
+            self._started_tracemalloc = True
+        if mode == "sampler":
+            self._sampler = threading.Thread(target=self._sample, name="profiler-sampler", daemon=True)
+            self._sampler.start()
+
+    @property
+    def done(self) -> bool:
+        return self.finished_at is not None or self.calls >= self.max_calls or time.monotonic() >= self._deadline
+
+    def finish(self):
+        with self._lock:
+            if self.finished_at is not None:
+                return
+            self.finished_at = time.time()
+        self._stop_sampler.set()
+        if self._sampler is not None and self._sampler is not threading.current_thread():
+            self._sampler.join()
+        if self.memory and tracemalloc.is_tracing():
+            snapshot = tracemalloc.take_snapshot()
+            self._top_allocations = [
+                {"location": str(stat.traceback), "size_bytes": stat.size, "count": stat.count}
+                for stat in snapshot.statistics("lineno")[:25]
+            ]
+            if self._started_tracemalloc:
+                tracemalloc.stop()
+
+    @contextmanager
+    def capture(self):
+        # Only one call is profiled at a time, and none past the limits
+        if self.done or not self._busy.acquire(blocking=False):
+            self.skipped += 1
+            yield
+            return
+        try:
+            self.calls += 1
+            with self._torch_profiler() as torch_profiler:
+                profile = cProfile.Profile() if self.mode == "cprofile" else None
+                if self.memory:
+                    baseline = tracemalloc.get_traced_memory()[0]
+                    tracemalloc.reset_peak()
+                if profile is not None:
+                    profile.enable()
+                try:
+                    yield
+                finally:
+                    if profile is not None:
+                        profile.disable()
+                        self._add_pstats(profile)
+                    if self.memory:
+                        self._peaks.append(tracemalloc.get_traced_memory()[1] - baseline)
+            if torch_profiler is not None:
+                self._add_ops(torch_profiler)
+        finally:
+            self._busy.release()
+
+    def _torch_profiler(self):
+        if not self.torch_ops:
+            return nullcontext()
+        import torch # type: ignore
+
+        return torch.profiler.profile(activities=[torch.profiler.ProfilerActivity.CPU])
+
+    def _add_pstats(self, profile: cProfile.Profile):
+        with self._lock:
+            if self._pstats is None:
+                self._pstats = pstats.Stats(profile)
+            else:
+                self._pstats.add(profile)
+
+    def _add_ops(self, torch_profiler):
+        with self._lock:
+            for event in torch_profiler.key_averages():
+                op = self._ops.setdefault(event.key, {"count": 0, "self_cpu_us": 0.0, "cpu_us": 0.0})
+                op["count"] += event.count
+                op["self_cpu_us"] += event.self_cpu_time_total
+                op["cpu_us"] += event.cpu_time_total
+
+    def _sample(self):
+        interval = PROFILE_SAMPLE_INTERVAL_MS / 1000
+        own = threading.get_ident()
+        while not self._stop_sampler.wait(interval):
+            if time.monotonic() >= self._deadline:
+                break
+            names = {thread.ident: thread.name for thread in threading.enumerate()}
+            for ident, frame in sys._current_frames().items():
+                if ident == own:
+                    continue
+                stack = []
+                while frame is not None:
+                    stack.append(frame_name(frame))
+                    frame = frame.f_back
+                stack.append(names.get(ident, str(ident)))
+                self._samples[";".join(reversed(stack))] += 1
+
+    def status(self) -> dict:
+        return {
+            "mode": self.mode,
+            "active": not self.done,
+            "calls": self.calls,
+            "max_calls": self.max_calls,
+            "skipped_calls": self.skipped,
+            "seconds": self.seconds,
+            "started_at": self.started_at,
+            "finished_at": self.finished_at,
+            "outputs": self.outputs(),
+        }
+
+    def outputs(self) -> list:
+        outputs = []
+        if self._pstats is not None:
+            outputs.append("pstats")
+        if self._samples:
+            outputs += ["speedscope", "flamegraph"]
+        if self._ops:
+            outputs.append("torch")
+        if self.memory:
+            outputs.append("memory")
+        return outputs
+
+    def render(self, output: str) -> bytes:
+        if output == "pstats":
+            return marshal.dumps(self._pstats.stats)
+        if output == "flamegraph":
+            return "".join(f"{stack} {count}\n" for stack, count in self._samples.most_common()).encode("utf-8")
+        if output == "speedscope":
+            return json.dumps(self._speedscope()).encode("utf-8")
+        if output == "torch":
+            ops = sorted(self._ops.items(), key=lambda item: item[1]["self_cpu_us"], reverse=True)
+            return json.dumps([dict(op=key, **values) for key, values in ops]).encode("utf-8")
+        if output == "memory":
+            return json.dumps({"peak_bytes_per_call": self._peaks, "top_allocations": self._top_allocations}).encode("utf-8")
+        raise KeyError(output)
+
+    # Samples in speedscope's "sampled" file format, weighted in milliseconds
+    def _speedscope(self) -> dict:
+        frames, index, samples, weights = [], {}, [], []
+        for stack, count in self._samples.items():
+            ids = []
+            for name in stack.split(";"):
+                if name not in index:
+                    index[name] = len(frames)
+                    frames.append({"name": name})
+                ids.append(index[name])
+            samples.append(ids)
+            weights.append(count * PROFILE_SAMPLE_INTERVAL_MS)
+        return {
+            "$schema": "https://www.speedscope.app/file-format-schema.json",
+            "shared": {"frames": frames},
+            "profiles": [{
+                "type": "sampled",
+                "name": "emotion-api",
+                "unit": "milliseconds",
+                "startValue": 0,
+                "endValue": sum(weights),
+                "samples": samples,
+                "weights": weights,
+            }],
+        }
+
+
+# Holds the current (or last) session. `capture()` is what the hot path
+# calls: with no active session it is one attribute check and a shared
+# no-op context manager.
+class Profiler:
+    def __init__(self):
+        self.session = None
+        self._lock = threading.Lock()
+
+    def capture(self):
+        session = self.session
+        if session is None or session.finished_at is not None:
+            return _NOT_PROFILING
+        if session.done:
+            session.finish()
+            return _NOT_PROFILING
+        return session.capture()
+
+    def start(self, mode: str, max_calls: int, seconds: float, torch_ops: bool = False, memory: bool = False) -> dict:
+        if mode not in PROFILE_MODES:
+            raise ValueError(f"Unknown profiling mode {mode!r}, expected one of: {', '.join(PROFILE_MODES)}")
+        with self._lock:
+            if self.session is not None and not self.session.done:
+                raise RuntimeError("A profiling session is already running")
+            if self.session is not None:
+                self.session.finish()
+            self.session = ProfilingSession(mode, max_calls, seconds, torch_ops, memory)
+            return self.session.status()
+
+    def stop(self) -> dict:
+        session = self.session
+        if session is None:
+            return {"active": False}
+        session.finish()
+        return session.status()
+
+    def status(self) -> dict:
+        session = self.session
+        if session is None:
+            return {"active": False}
+        if session.done:
+            session.finish()
+        return session.status()
+
+    # A finished session's output, or None when there is none of that kind
+    def output(self, output: str):
+        session = self.session
+        if session is None or not session.done:
+            return None
+        session.finish()
+        if output not in session.outputs():
+            return None
+        return session.render(output)
@@ -0,0 +1,90 @@
+import gc
+import logging
+import multiprocessing
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from typing import List
+
+# Number of inference worker processes (0 runs the model in the API process)
+INFERENCE_WORKERS = int(os.getenv("INFERENCE_WORKERS", "0"))
+# Torch threads per worker process, so the workers do not oversubscribe the cores
+INFERENCE_WORKER_THREADS = int(
+    os.getenv("INFERENCE_WORKER_THREADS", str(max(1, (os.cpu_count() or 1) // max(1, INFERENCE_WORKERS))))
+)
+
+logger = logging.getLogger(__name__)
+
+# The loaded model, set in the parent just before the workers are forked so
+# every worker inherits it instead of loading its own copy
+_classifier = None
+
+
+def _init_worker(threads: int):
+    try:
+        import torch # type: ignore
+        torch.set_num_threads(threads)
+    except ImportError:
+        pass
+
+
+def _predict_batch(texts: List[str]) -> list:
+    return _classifier(texts, batch_size=len(texts), truncation=True)
+
+
+# Pool of forked inference processes sharing the parent's model weights.
+# The parent loads the model once; after fork the weights are shared
+# copy-on-write and are never written to, so each extra worker only costs its
+# own activations and interpreter state. Only texts and predictions travel
+# over the pool's queues.
+class InferenceWorkerPool:
+    def __init__(self, classifier, processes: int = INFERENCE_WORKERS, threads: int = INFERENCE_WORKER_THREADS):
+        self.classifier = classifier
+        self.processes = max(1, processes)
+        self.threads = max(1, threads)
+        self._executor = None
+        self._lock = threading.Lock()
+
+    @property
+    def started(self) -> bool:
+        return self._executor is not None
+
+    def start(self):
+        global _classifier
+        with self._lock:
+            if self._executor is not None:
+                return
+            loaded = self.classifier.load() if hasattr(self.classifier, "load") else self.classifier
+            _classifier = loaded
+            # Workers must not re-enter the tokenizer's own thread pool after fork
+            os.environ.setdefault("TOKENIZERS_PARALLELISM", "false")
+            # Keep the garbage collector from touching (and so copying) the
+            # pages holding objects created before the fork
+            gc.collect()
+            gc.freeze()
+            self._executor = ProcessPoolExecutor(
+                max_workers=self.processes,
+                mp_context=multiprocessing.get_context("fork"),
+                initializer=_init_worker,
+                initargs=(self.threads,),
+            )
+            # Fork every worker now, while the parent holds the loaded model
+            for future in [self._executor.submit(os.getpid) for _ in range(self.processes)]:
+                future.result()
+            gc.unfreeze()
+
+    def predict(self, texts: List[str]) -> list:
+        self.start()
+        try:
+            return self._executor.submit(_predict_batch, texts).result()
+        except BrokenProcessPool:
+            logger.error("An inference worker died, restarting the pool")
+            self.close()
+            raise
+
+    def close(self):
+        with self._lock:
+            executor, self._executor = self._executor, None
+        if executor is not None:
+            executor.shutdown(wait=True, cancel_futures=True)
@@ -1,31 +1,42 @@
 from fastapi import Depends, HTTPException, status
-from fastapi.security import OAuth2PasswordBearer
+from fastapi.concurrency import run_in_threadpool
+from fastapi.security import APIKeyHeader, OAuth2PasswordBearer
 from pydantic import BaseModel
-from datetime import datetime, timedelta
-from jose import JWTError, jwt
+from datetime import datetime, timedelta, timezone
+from typing import Optional
+from collections import OrderedDict
+import jwt
+from jwt import PyJWTError
 from passlib.context import CryptContext
 from dotenv import load_dotenv
+from functools import lru_cache
+import hashlib
+import threading
+import time
 import os
 load_dotenv()
 
+# JWT settings
+SECRET_KEY = os.getenv("SECRET_KEY")
+ALGORITHM = os.getenv("ALGORITHM")
+ACCESS_TOKEN_EXPIRE_MINUTES = 30
+
+# Verified tokens remembered until they expire (0 disables the cache)
+AUTH_TOKEN_CACHE_SIZE = int(os.getenv("AUTH_TOKEN_CACHE_SIZE", "10000"))
+# API keys for machine clients, as comma-separated name:key pairs
+API_KEYS = os.getenv("API_KEYS", "")
 
 
 pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="token")
+# The same schemes without their own 401, so either one may be used
+bearer_scheme = OAuth2PasswordBearer(tokenUrl="token", auto_error=False)
+api_key_scheme = APIKeyHeader(name="X-API-Key", auto_error=False)
 
 def get_password_hash(password):
     return pwd_context.hash(password)
 
 
-db = {
-    os.getenv("USER_NAME"): {
-        "username": os.getenv("USER_NAME"),
-        "hashed_password": get_password_hash(os.getenv("PASSWORD_USER")),
-        "disabled": False
-    }
-}
-
-
 class Token(BaseModel):
     access_token: str
     token_type: str
@@ -39,24 +50,59 @@ class User(BaseModel):
     username: str
     email: str = None
     disabled: bool = None
+    role: str = "user"
 
 
 class UserInDB(User):
     hashed_password: str
 
 
+# User records, built and hashed once on first use rather than at import,
+# bcrypt being slow on purpose
+@lru_cache(maxsize=1)
+def get_db():
+    accounts = [
+        (os.getenv("ADMIN_NAME"), os.getenv("PASSWORD_ADMIN"), "admin"),
+        (os.getenv("USER_NAME"), os.getenv("PASSWORD_USER"), "user"),
+    ]
+    return {
+        username: UserInDB(username=username, hashed_password=get_password_hash(password), role=role, disabled=False)
+        for username, password, role in accounts
+        if username and password
+    }
+
+
+# The user records for async code: built in the thread pool the first
+# time, so hashing never blocks the event loop (the app also builds them
+# at startup)
+async def user_db():
+    if get_db.cache_info().currsize:
+        return get_db()
+    return await run_in_threadpool(get_db)
+
+
+# API key digests mapped to client names, so a request only hashes the key
+# it sends
+@lru_cache(maxsize=1)
+def get_api_keys():
+    keys = {}
+    for entry in API_KEYS.split(","):
+        name, _, key = entry.strip().partition(":")
+        if name and key:
+            keys[hashlib.sha256(key.encode("utf-8")).digest()] = name
+    return keys
+
+
 def verify_password(plain_password, hashed_password):
     return pwd_context.verify(plain_password, hashed_password)
 
 
 def get_user(db, username: str):
-    if username in db:
-        user_data = db[username]
-        return UserInDB(**user_data)
+    return db.get(username)
 
 
-def authenticate_user( username: str, password: str, db = db):
-    user = get_user(db, username)
+def authenticate_user( username: str, password: str, db = None):
+    user = get_user(db if db is not None else get_db(), username)
     if not user:
         return False
     if not verify_password(password, user.hashed_password):
@@ -68,29 +114,149 @@ def authenticate_user( username: str, password: str, db = db):
 def create_access_token(data: dict, expires_delta: timedelta = None):
     to_encode = data.copy()
     if expires_delta:
-        expire = datetime.utcnow() + expires_delta
+        expire = datetime.now(timezone.utc) + expires_delta
     else:
-        expire = datetime.utcnow() + timedelta(minutes=15)
+        expire = datetime.now(timezone.utc) + timedelta(minutes=15)
 
     to_encode.update({"exp": expire})
-    encoded_jwt = jwt.encode(to_encode, os.getenv("SECRET_KEY"), algorithm=os.getenv("ALGORITHM"))
+    encoded_jwt = jwt.encode(to_encode, SECRET_KEY, algorithm=ALGORITHM)
     return encoded_jwt
 
 
+# Bounded LRU of tokens whose signature was already checked, keyed by the
+# token's SHA-256 and kept only until the token's own expiry
+class TokenCache:
+    def __init__(self, max_entries: int = AUTH_TOKEN_CACHE_SIZE):
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def key(token: str) -> bytes:
+        return hashlib.sha256(token.encode("utf-8")).digest()
+
+    def get(self, token: str) -> Optional[str]:
+        if self.max_entries <= 0:
+            return None
+        key = self.key(token)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[1] > time.time():
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return entry[0]
+            if entry is not None:
+                del self._entries[key]
+            self.misses += 1
+            return None
+
+    def set(self, token: str, username: str, expires: float):
+        if self.max_entries <= 0:
+            return
+        with self._lock:
+            self._entries[self.key(token)] = (username, expires)
+            self._entries.move_to_end(self.key(token))
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self) -> dict:
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                "entries": len(self._entries),
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / total if total else 0.0,
+            }
+
+
+token_cache = TokenCache()
+
+
+# Returns the token's subject, checking the signature only the first time
+# a token is seen; tokens without an expiry are never cached
+def decode_token(token: str):
+    username = token_cache.get(token)
+    if username is not None:
+        return username
+    try:
+        payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
+    except PyJWTError:
+        raise HTTPException(
+            status_code=status.HTTP_401_UNAUTHORIZED, detail="Invalid token"
+        )
+    username = payload.get("sub")
+    if username is None:
+        raise HTTPException(
+            status_code=status.HTTP_401_UNAUTHORIZED, detail="Invalid token"
+        )
+    if isinstance(payload.get("exp"), (int, float)):
+        token_cache.set(token, username, payload["exp"])
+    return username
+
+
+def verify_api_key(api_key: str):
+    name = get_api_keys().get(hashlib.sha256(api_key.encode("utf-8")).digest())
+    if name is None:
+        raise HTTPException(
+            status_code=status.HTTP_401_UNAUTHORIZED, detail="Invalid API key"
+        )
+    return name
+
+
+# The caller's name, used wherever a username is; `via_api_key` tells API
+# key clients from users who logged in, as the two may share a name
+class Identity(str):
+    via_api_key: bool
+
+    def __new__(cls, name: str, via_api_key: bool = False):
+        identity = super().__new__(cls, name)
+        identity.via_api_key = via_api_key
+        return identity
+
+
+# Dependency for the API endpoints: the caller's identity, from an X-API-Key
+# header or a bearer token. It is async so the check runs inline on the
+# event loop instead of being sent to the thread pool.
+async def get_current_username(
+    token: Optional[str] = Depends(bearer_scheme), api_key: Optional[str] = Depends(api_key_scheme)
+) -> Identity:
+    if api_key:
+        return Identity(verify_api_key(api_key), via_api_key=True)
+    if token:
+        return Identity(decode_token(token))
+    raise HTTPException(
+        status_code=status.HTTP_401_UNAUTHORIZED,
+        detail="Not authenticated",
+        headers={"WWW-Authenticate": "Bearer"},
+    )
+
+
+# Dependency for admin-only endpoints; API-key clients are never admins
+async def get_current_admin(username: Identity = Depends(get_current_username)):
+    user = None if username.via_api_key else get_user(await user_db(), username)
+    if user is None or user.role != "admin":
+        raise HTTPException(
+            status_code=status.HTTP_403_FORBIDDEN, detail="Admin access required"
+        )
+    return username
+
+
 async def get_current_user(token: str = Depends(oauth2_scheme)):
     credential_exception = HTTPException(status_code=status.HTTP_401_UNAUTHORIZED,
                                          detail="Could not validate credentials", headers={"WWW-Authenticate": "Bearer"})
     try:
-        payload = jwt.decode(token, os.getenv("SECRET_KEY"), algorithms=[os.getenv("ALGORITHM")])
-        username: str = payload.get("sub")
-        if username is None:
-            raise credential_exception
-
-        token_data = TokenData(username=username)
-    except JWTError:
+        username = decode_token(token)
+    except HTTPException:
         raise credential_exception
 
-    user = get_user(db, username=token_data.username)
+    user = get_user(await user_db(), username=username)
     if user is None:
         raise credential_exception
 
@@ -102,4 +268,3 @@ async def get_current_active_user(current_user: UserInDB = Depends(get_current_u
         raise HTTPException(status_code=400, detail="Inactive user")
 
     return current_user
-
@@ -0,0 +1,83 @@
+import argparse
+import json
+import os
+import time
+from datetime import timedelta
+
+import jwt # type: ignore
+from fastapi import Depends, FastAPI # type: ignore
+from fastapi.testclient import TestClient # type: ignore
+
+from auth import auth
+
+
+# Mean microseconds per call of fn over `runs` calls
+def time_call(fn, runs: int) -> float:
+    fn()  # warm-up
+    start = time.perf_counter()
+    for _ in range(runs):
+        fn()
+    return (time.perf_counter() - start) / runs * 1e6
+
+
+# The per-request work before the shared auth module: a full signature
+# check and a fresh pydantic user record on every call
+def verify_uncached(token: str):
+    payload = jwt.decode(token, auth.SECRET_KEY, algorithms=[auth.ALGORITHM])
+    return auth.UserInDB(username=payload["sub"], hashed_password="x", disabled=False)
+
+
+# A small app with one route per auth path, to include the dependency
+# overhead (the old dependency ran in the thread pool)
+def make_app() -> FastAPI:
+    bench_app = FastAPI()
+
+    @bench_app.get("/before")
+    def before(token: str = Depends(auth.oauth2_scheme)):
+        return verify_uncached(token).username
+
+    @bench_app.get("/after")
+    async def after(username: str = Depends(auth.get_current_username)):
+        return username
+
+    return bench_app
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Measure the per-request cost of authentication before and after caching")
+    parser.add_argument("--runs", type=int, default=20000, help="Calls per function measurement")
+    parser.add_argument("--requests", type=int, default=2000, help="HTTP requests per endpoint measurement")
+    parser.add_argument("--output", help="Write the results as JSON to this file")
+    args = parser.parse_args()
+
+    auth.SECRET_KEY = auth.SECRET_KEY or "benchmark-secret-key-of-at-least-32-bytes"
+    auth.ALGORITHM = auth.ALGORITHM or "HS256"
+    auth.API_KEYS = "benchmark:benchmark-key"
+    auth.get_api_keys.cache_clear()
+    token = auth.create_access_token({"sub": os.getenv("USER_NAME", "user")}, timedelta(minutes=30))
+
+    results = {
+        "function_us": {
+            "before_uncached_jwt": time_call(lambda: verify_uncached(token), args.runs),
+            "after_cached_jwt": time_call(lambda: auth.decode_token(token), args.runs),
+            "after_api_key": time_call(lambda: auth.verify_api_key("benchmark-key"), args.runs),
+        }
+    }
+
+    client = TestClient(make_app())
+    headers = {"Authorization": f"Bearer {token}"}
+    results["request_us"] = {
+        "before_uncached_jwt": time_call(lambda: client.get("/before", headers=headers), args.requests),
+        "after_cached_jwt": time_call(lambda: client.get("/after", headers=headers), args.requests),
+        "after_api_key": time_call(lambda: client.get("/after", headers={"X-API-Key": "benchmark-key"}), args.requests),
+    }
+
+    report = json.dumps(results, indent=2)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(report)
+    print(report)
+
+
+if __name__ == "__main__":
+    main()
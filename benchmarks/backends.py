@@ -0,0 +1,62 @@
+import argparse
+import json
+import statistics
+import time
+from app.backends import BACKENDS, REFERENCE_TEXTS, check_parity, load_classifier
+
+MODEL_NAME = "SamLowe/roberta-base-go_emotions"
+# Backends that run the real model; stub and tiny can be timed too, but
+# their labels are not the model's, so they get no parity check
+MODEL_BACKENDS = ("pytorch", "pytorch-int8", "onnx")
+
+
+# Latency of single-text calls and throughput of one batched call per backend
+def benchmark(classifier, runs: int, batch_size: int) -> dict:
+    classifier(REFERENCE_TEXTS[:2], batch_size=2)  # warm-up
+
+    latencies = []
+    for i in range(runs):
+        text = REFERENCE_TEXTS[i % len(REFERENCE_TEXTS)]
+        start = time.perf_counter()
+        classifier([text], batch_size=1)
+        latencies.append((time.perf_counter() - start) * 1000)
+
+    texts = (REFERENCE_TEXTS * (batch_size // len(REFERENCE_TEXTS) + 1))[:batch_size]
+    start = time.perf_counter()
+    classifier(texts, batch_size=batch_size)
+    elapsed = time.perf_counter() - start
+
+    latencies.sort()
+    return {
+        "latency_ms_p50": statistics.median(latencies),
+        "latency_ms_p95": latencies[int(0.95 * (len(latencies) - 1))],
+        "throughput_texts_per_s": batch_size / elapsed,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare inference backends on latency, throughput and top-1 parity")
+    parser.add_argument("--backends", nargs="+", default=list(MODEL_BACKENDS), choices=BACKENDS)
+    parser.add_argument("--model", default=MODEL_NAME)
+    parser.add_argument("--runs", type=int, default=50)
+    parser.add_argument("--batch-size", type=int, default=64)
+    parser.add_argument("--output", help="Write the results as JSON to this file")
+    args = parser.parse_args()
+
+    reference = load_classifier(args.model, backend="pytorch")
+    results = {}
+    for backend in args.backends:
+        classifier = reference if backend == "pytorch" else load_classifier(args.model, backend=backend)
+        results[backend] = benchmark(classifier, args.runs, args.batch_size)
+        if backend in MODEL_BACKENDS:
+            results[backend]["parity_mismatches"] = check_parity(reference, classifier)
+
+    report = json.dumps(results, indent=2)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(report)
+    print(report)
+
+
+if __name__ == "__main__":
+    main()
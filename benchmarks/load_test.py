@@ -0,0 +1,149 @@
+import argparse
+import asyncio
+import json
+import os
+import socket
+import subprocess
+import sys
+import time
+from contextlib import contextmanager
+from datetime import timedelta
+
+import httpx # type: ignore
+
+SMALL_TEXT = "Great product, arrived on time!"
+
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def make_csv(rows: int) -> bytes:
+    lines = ["review"] + [f"Review {i}: the product was fine but the delivery took a while." for i in range(rows)]
+    return "\n".join(lines).encode("utf-8")
+
+
+def make_pdf(pages: int) -> bytes:
+    import fitz   # type: ignore
+
+    doc = fitz.open()
+    for i in range(pages):
+        doc.new_page().insert_text((72, 72), f"Page {i}\nI really enjoyed this book, but chapter {i} dragged on.")
+    return doc.tobytes()
+
+
+def percentiles(latencies: list) -> dict:
+    latencies = sorted(latencies)
+    if not latencies:
+        return {}
+    pick = lambda q: latencies[min(len(latencies) - 1, int(q * len(latencies)))]
+    return {"count": len(latencies), "p50_ms": pick(0.50), "p95_ms": pick(0.95), "p99_ms": pick(0.99), "max_ms": latencies[-1]}
+
+
+# Yield the base URL of a ready API: `url` if given, else a uvicorn server
+# started for the duration of the block. Raises if it is not ready within
+# `ready_timeout` seconds.
+@contextmanager
+def local_server(url: str = None, env: dict = None, ready_timeout: float = 300):
+    server = None
+    if url is None:
+        port = free_port()
+        url = f"http://127.0.0.1:{port}"
+        server = subprocess.Popen(
+            [sys.executable, "-m", "uvicorn", "app.app:app", "--port", str(port), "--log-level", "warning"],
+            env={**os.environ, **(env or {})},
+        )
+    try:
+        deadline = time.time() + ready_timeout
+        while time.time() < deadline:
+            if server is not None and server.poll() is not None:
+                raise RuntimeError("The API server exited before it was ready")
+            try:
+                if httpx.get(f"{url}/ready").status_code == 200:
+                    break
+            except httpx.TransportError:
+                pass
+            time.sleep(0.5)
+        else:
+            raise RuntimeError(f"The API server was not ready after {ready_timeout:g} s")
+        yield url
+    finally:
+        if server is not None:
+            server.terminate()
+            server.wait()
+
+
+# Time small requests (health probes and one-sentence predictions) for
+# `duration` seconds; texts are unique so the prediction cache never answers
+async def probe(client: httpx.AsyncClient, headers: dict, duration: float, phase: str) -> dict:
+    health, small = [], []
+    deadline = time.perf_counter() + duration
+    while time.perf_counter() < deadline:
+        start = time.perf_counter()
+        await client.get("/health")
+        health.append((time.perf_counter() - start) * 1000)
+
+        start = time.perf_counter()
+        await client.post("/predict/", data={"text": f"{SMALL_TEXT} ({phase} {len(small)})"}, headers=headers)
+        small.append((time.perf_counter() - start) * 1000)
+        await asyncio.sleep(0.01)
+    return {"health": percentiles(health), "small_text": percentiles(small)}
+
+
+# Upload large files to the streaming endpoint over and over until stopped
+async def upload_large_files(client: httpx.AsyncClient, headers: dict, files: list, stop: asyncio.Event, counts: dict):
+    while not stop.is_set():
+        for name, content in files:
+            async with client.stream("POST", "/predict/stream", files={"file": (name, content)}, headers=headers) as response:
+                counts[response.status_code] = counts.get(response.status_code, 0) + 1
+                async for _ in response.aiter_lines():
+                    pass
+            if stop.is_set():
+                return
+
+
+async def run(base_url: str, duration: float, uploaders: int, csv_rows: int, pdf_pages: int) -> dict:
+    from auth import create_access_token
+
+    headers = {"Authorization": f"Bearer {create_access_token({'sub': os.getenv('USER_NAME')}, timedelta(minutes=30))}"}
+    files = [("reviews.csv", make_csv(csv_rows)), ("book.pdf", make_pdf(pdf_pages))]
+
+    async with httpx.AsyncClient(base_url=base_url, timeout=600) as client:
+        idle = await probe(client, headers, duration, "idle")
+
+        stop, counts = asyncio.Event(), {}
+        tasks = [asyncio.create_task(upload_large_files(client, headers, files, stop, counts)) for _ in range(uploaders)]
+        await asyncio.sleep(1)  # let the uploads get going
+        loaded = await probe(client, headers, duration, "under load")
+        stop.set()
+        await asyncio.gather(*tasks)
+
+    return {"idle": idle, "under_load": loaded, "large_upload_status_codes": counts}
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Measure /health and small-text latency with and without concurrent large file uploads"
+    )
+    parser.add_argument("--url", help="Test a running server instead of starting one")
+    parser.add_argument("--duration", type=float, default=10, help="Seconds per measurement phase")
+    parser.add_argument("--uploaders", type=int, default=4, help="Concurrent large-file uploads")
+    parser.add_argument("--csv-rows", type=int, default=20000)
+    parser.add_argument("--pdf-pages", type=int, default=200)
+    parser.add_argument("--output", help="Write the results as JSON to this file")
+    args = parser.parse_args()
+
+    with local_server(args.url) as base_url:
+        results = asyncio.run(run(base_url, args.duration, args.uploaders, args.csv_rows, args.pdf_pages))
+
+    report = json.dumps(results, indent=2)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(report)
+    print(report)
+
+
+if __name__ == "__main__":
+    main()
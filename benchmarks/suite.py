@@ -0,0 +1,282 @@
+import argparse
+import asyncio
+import io
+import json
+import os
+import platform
+import random
+import statistics
+import subprocess
+import sys
+import time
+from datetime import datetime, timedelta, timezone
+
+import httpx # type: ignore
+from starlette.datastructures import UploadFile # type: ignore
+
+from app.backends import REFERENCE_TEXTS
+from app.extraction import iter_file_units
+from benchmarks.load_test import local_server, make_csv, make_pdf, percentiles
+
+TOKEN_LENGTHS = (8, 32, 128, 512)
+BATCH_SIZES = (1, 8, 32, 128)
+SECTIONS = ("latency", "throughput", "extraction", "load")
+SAMPLE_TRACE = os.path.join(os.path.dirname(__file__), "sample_trace.jsonl")
+# The server started by the suite answers from the model only: no
+# prediction cache, no prediction log and no Hub downloads
+SERVER_ENV = {"PREDICTION_CACHE_SIZE": "0", "PREDICTION_CACHE_PATH": "", "PREDICTION_LOG_BACKEND": "none", "HF_HUB_OFFLINE": "1"}
+# Settings recorded with the results, as they change what is measured
+CONFIG_VARS = (
+    "MODEL_BACKEND", "INFERENCE_WORKERS", "INFERENCE_THREADS", "BATCH_MAX_SIZE", "BATCH_MAX_WAIT_MS",
+    "BUCKET_BOUNDARIES", "PDF_PROCESSES", "CSV_CHUNK_ROWS",
+)
+VOCABULARY = sorted({word.strip(".,!?'").lower() for text in REFERENCE_TEXTS for word in text.split()} - {""})
+
+
+# Text of about `words` tokens (one word is about one token for this
+# vocabulary), the same for the same seed
+def make_text(rng: random.Random, words: int) -> str:
+    return " ".join(rng.choice(VOCABULARY) for _ in range(words)).capitalize() + "."
+
+
+def make_txt(paragraphs: int) -> bytes:
+    return "\n\n".join(
+        f"Paragraph {i}: the blender is loud, but it crushes ice in seconds." for i in range(paragraphs)
+    ).encode("utf-8")
+
+
+def summarize(latencies: list) -> dict:
+    summary = percentiles(latencies)
+    summary["mean_ms"] = statistics.fmean(latencies)
+    return summary
+
+
+# Single-text /predict/ latency for each text length, one request at a time
+def bench_latency(client: httpx.Client, headers: dict, rng: random.Random, runs: int) -> dict:
+    results = {}
+    for words in TOKEN_LENGTHS:
+        client.post("/predict/", data={"text": make_text(rng, words)}, headers=headers)  # warm-up
+        latencies = []
+        for _ in range(runs):
+            text = make_text(rng, words)
+            start = time.perf_counter()
+            client.post("/predict/", data={"text": text}, headers=headers).raise_for_status()
+            latencies.append((time.perf_counter() - start) * 1000)
+        results[f"tokens_{words}"] = summarize(latencies)
+    return results
+
+
+# /predict/batch throughput for each batch size, with 32-token texts
+def bench_throughput(client: httpx.Client, headers: dict, rng: random.Random, runs: int) -> dict:
+    results = {}
+    for size in BATCH_SIZES:
+        batches = [[make_text(rng, 32) for _ in range(size)] for _ in range(runs + 1)]
+        client.post("/predict/batch", json=batches[0], headers=headers)  # warm-up
+        latencies = []
+        for batch in batches[1:]:
+            start = time.perf_counter()
+            client.post("/predict/batch", json=batch, headers=headers).raise_for_status()
+            latencies.append((time.perf_counter() - start) * 1000)
+        results[f"batch_{size}"] = summarize(latencies)
+        results[f"batch_{size}"]["texts_per_s"] = size * runs / (sum(latencies) / 1000)
+    return results
+
+
+# Extraction speed of generated PDF, TXT and CSV files, in process and
+# without the model
+def bench_extraction(runs: int, pdf_pages: int, txt_paragraphs: int, csv_rows: int) -> dict:
+    fixtures = [
+        ("book.pdf", make_pdf(pdf_pages)),
+        ("notes.txt", make_txt(txt_paragraphs)),
+        ("reviews.csv", make_csv(csv_rows)),
+    ]
+    results = {}
+    for name, content in fixtures:
+        timings, units = [], 0
+        for _ in range(runs):
+            start = time.perf_counter()
+            units = sum(1 for _ in iter_file_units(UploadFile(io.BytesIO(content), filename=name)))
+            timings.append(time.perf_counter() - start)
+        elapsed = statistics.median(timings)
+        results[name.rsplit(".", 1)[1]] = {
+            "units": units,
+            "bytes": len(content),
+            "median_ms": elapsed * 1000,
+            "units_per_s": units / elapsed,
+            "mb_per_s": len(content) / elapsed / 1e6,
+        }
+    return results
+
+
+# Requests from a JSONL trace: one request per line, either {"text": ...}
+# for /predict/ or {"texts": [...]} for /predict/batch. Prediction log
+# records (with "Texts") are replayed the same way, so a log segment can
+# serve as a trace.
+def load_trace(path: str) -> list:
+    requests = []
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            if not line.strip():
+                continue
+            record = json.loads(line)
+            texts = record.get("texts", record.get("Texts"))
+            if isinstance(texts, str):
+                texts = [texts]
+            if "text" in record:
+                requests.append(("/predict/", record["text"]))
+            elif texts:
+                requests.append(("/predict/", texts[0]) if len(texts) == 1 else ("/predict/batch", texts))
+    if not requests:
+        raise ValueError(f"No requests found in trace {path}")
+    return requests
+
+
+# Replay the trace with `concurrency` clients for `duration` seconds, each
+# client taking the next request in turn
+async def bench_load(base_url: str, headers: dict, trace: list, concurrency: int, duration: float) -> dict:
+    latencies, statuses, texts = [], {}, 0
+    position = 0
+    deadline = time.perf_counter() + duration
+
+    async def replay(client: httpx.AsyncClient):
+        nonlocal position, texts
+        while time.perf_counter() < deadline:
+            endpoint, body = trace[position % len(trace)]
+            position += 1
+            start = time.perf_counter()
+            if endpoint == "/predict/":
+                response = await client.post(endpoint, data={"text": body}, headers=headers)
+            else:
+                response = await client.post(endpoint, json=body, headers=headers)
+            latencies.append((time.perf_counter() - start) * 1000)
+            statuses[response.status_code] = statuses.get(response.status_code, 0) + 1
+            if response.status_code == 200:
+                texts += 1 if endpoint == "/predict/" else len(body)
+
+    start = time.perf_counter()
+    async with httpx.AsyncClient(base_url=base_url, timeout=600) as client:
+        await asyncio.gather(*(replay(client) for _ in range(concurrency)))
+    elapsed = time.perf_counter() - start
+    return {
+        "concurrency": concurrency,
+        "latency": summarize(latencies),
+        "requests_per_s": len(latencies) / elapsed,
+        "texts_per_s": texts / elapsed,
+        "status_codes": {str(code): count for code, count in sorted(statuses.items())},
+    }
+
+
+def environment() -> dict:
+    try:
+        commit = subprocess.run(["git", "rev-parse", "HEAD"], capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        commit = None
+    return {
+        "timestamp": datetime.now(timezone.utc).isoformat(),
+        "git_commit": commit,
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "cpu_count": os.cpu_count(),
+        "config": {name: os.environ[name] for name in CONFIG_VARS if name in os.environ},
+    }
+
+
+def run(args) -> dict:
+    from auth import create_access_token
+
+    rng = random.Random(args.seed)
+    results = {"environment": environment(), "settings": vars(args).copy()}
+    results["settings"].pop("func", None)
+    if "extraction" in args.sections:
+        results["extraction"] = bench_extraction(args.runs, args.pdf_pages, args.txt_paragraphs, args.csv_rows)
+    if not set(args.sections) & {"latency", "throughput", "load"}:
+        return results
+
+    headers = {"Authorization": f"Bearer {create_access_token({'sub': os.getenv('USER_NAME')}, timedelta(minutes=60))}"}
+    env = {**SERVER_ENV, "MODEL_BACKEND": args.backend} if args.backend else SERVER_ENV
+    with local_server(args.url, env) as base_url, httpx.Client(base_url=base_url, timeout=600) as client:
+        if "latency" in args.sections:
+            results["latency"] = bench_latency(client, headers, rng, args.runs)
+        if "throughput" in args.sections:
+            results["throughput"] = bench_throughput(client, headers, rng, args.runs)
+        if "load" in args.sections:
+            trace = load_trace(args.trace)
+            results["load"] = asyncio.run(bench_load(base_url, headers, trace, args.concurrency, args.duration))
+    return results
+
+
+# Walk two result trees and list the metrics that got worse by more than
+# `threshold` (a fraction): latencies (`*_ms`, except the max) that rose
+# and rates (`*_per_s`) that fell
+def find_regressions(baseline: dict, current: dict, threshold: float, path: str = "") -> list:
+    regressions = []
+    for key, before in baseline.items():
+        if key in ("environment", "settings") or key not in current:
+            continue
+        after, name = current[key], f"{path}.{key}" if path else key
+        if isinstance(before, dict) and isinstance(after, dict):
+            regressions += find_regressions(before, after, threshold, name)
+        elif not isinstance(before, (int, float)) or not isinstance(after, (int, float)) or before <= 0:
+            continue
+        elif key.endswith("_ms") and key != "max_ms" and after > before * (1 + threshold):
+            regressions.append({"metric": name, "baseline": before, "current": after, "change": after / before - 1})
+        elif key.endswith("_per_s") and after < before * (1 - threshold):
+            regressions.append({"metric": name, "baseline": before, "current": after, "change": after / before - 1})
+    return regressions
+
+
+def write_report(results: dict, output: str = None):
+    report = json.dumps(results, indent=2)
+    if output:
+        with open(output, "w") as f:
+            f.write(report)
+    print(report)
+
+
+def run_command(args):
+    write_report(run(args), args.output)
+
+
+def compare_command(args):
+    with open(args.baseline) as f:
+        baseline = json.load(f)
+    with open(args.current) as f:
+        current = json.load(f)
+    regressions = find_regressions(baseline, current, args.threshold)
+    write_report({"threshold": args.threshold, "regressions": regressions}, args.output)
+    if regressions:
+        sys.exit(1)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the API and compare the results against a baseline")
+    commands = parser.add_subparsers(required=True)
+
+    run_parser = commands.add_parser("run", help="Run the benchmarks and write the results as JSON")
+    run_parser.add_argument("--url", help="Benchmark a running server instead of starting one")
+    run_parser.add_argument("--backend", help="MODEL_BACKEND of the started server, e.g. stub to leave the model out")
+    run_parser.add_argument("--sections", nargs="+", default=list(SECTIONS), choices=SECTIONS)
+    run_parser.add_argument("--runs", type=int, default=20, help="Measured requests (or extractions) per case")
+    run_parser.add_argument("--seed", type=int, default=1234, help="Seed of the generated texts")
+    run_parser.add_argument("--pdf-pages", type=int, default=100)
+    run_parser.add_argument("--txt-paragraphs", type=int, default=5000)
+    run_parser.add_argument("--csv-rows", type=int, default=20000)
+    run_parser.add_argument("--trace", default=SAMPLE_TRACE, help="JSONL trace replayed by the load test")
+    run_parser.add_argument("--concurrency", type=int, default=16, help="Concurrent clients in the load test")
+    run_parser.add_argument("--duration", type=float, default=20, help="Seconds the load test runs")
+    run_parser.add_argument("--output", help="Write the results as JSON to this file")
+    run_parser.set_defaults(func=run_command)
+
+    compare_parser = commands.add_parser("compare", help="List regressions of a result file against a baseline")
+    compare_parser.add_argument("baseline")
+    compare_parser.add_argument("current")
+    compare_parser.add_argument("--threshold", type=float, default=0.1, help="Tolerated relative change")
+    compare_parser.add_argument("--output", help="Write the regressions as JSON to this file")
+    compare_parser.set_defaults(func=compare_command)
+
+    args = parser.parse_args()
+    args.func(args)
+
+
+if __name__ == "__main__":
+    main()